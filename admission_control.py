@@ -0,0 +1,144 @@
+"""
+Rate limiting and admission control for chatbot requests.
+
+Every ``asr_text`` becomes a slow, paid LLM + TTS call, so the voice chat
+server meters them at three levels with token buckets (per client, per
+room, global) and caps how many run at once. Requests beyond the cap wait
+in a bounded admission queue; when that is full, or a bucket is empty,
+the caller is rejected immediately with a retry-after hint instead of
+piling more work onto the backend.
+"""
+
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict, Optional, Tuple
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted; ``retry_after`` is in seconds"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"{reason}, retry after {retry_after:.2f}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at ``rate`` tokens per second"""
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def wait_time(self, tokens: float = 1.0) -> float:
+        """Seconds until ``tokens`` are available (0 if they are available now)"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= tokens:
+            return 0.0
+        return (tokens - self.tokens) / self.rate
+
+    def consume(self, tokens: float = 1.0):
+        self.tokens -= tokens
+
+
+class AdmissionController:
+    """
+    Per-client, per-room and global token buckets plus a concurrency cap.
+
+    Rates are ``(requests_per_second, burst)`` pairs; a rate of ``None``
+    disables that bucket. ``max_concurrent`` requests run at once and up
+    to ``max_queue`` more wait for a slot, each for at most ``queue_timeout``.
+    """
+
+    def __init__(self,
+                 client_rate: Optional[Tuple[float, float]] = (0.5, 3),
+                 room_rate: Optional[Tuple[float, float]] = (1.0, 5),
+                 global_rate: Optional[Tuple[float, float]] = (20.0, 40),
+                 max_concurrent: int = 8,
+                 max_queue: int = 32,
+                 queue_timeout: float = 10.0):
+        self.client_rate = client_rate
+        self.room_rate = room_rate
+        self.global_bucket = TokenBucket(*global_rate) if global_rate else None
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._client_buckets: Dict[str, TokenBucket] = {}
+        self._room_buckets: Dict[str, TokenBucket] = {}
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._waiting = 0
+        self._running = 0
+        # 单个请求耗时的滑动平均，用于估算排队时的retry_after
+        self._avg_service_time = 1.0
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    @property
+    def waiting(self) -> int:
+        return self._waiting
+
+    def check_rate(self, client_id: str, room_id: str):
+        """Take one token from every bucket, or raise AdmissionRejected without taking any"""
+        buckets = []
+        if self.client_rate:
+            buckets.append(("client_rate_limited", self._bucket(self._client_buckets, client_id, self.client_rate)))
+        if self.room_rate:
+            buckets.append(("room_rate_limited", self._bucket(self._room_buckets, room_id, self.room_rate)))
+        if self.global_bucket is not None:
+            buckets.append(("server_rate_limited", self.global_bucket))
+
+        for reason, bucket in buckets:
+            wait = bucket.wait_time()
+            if wait > 0:
+                raise AdmissionRejected(reason, wait)
+        for _, bucket in buckets:
+            bucket.consume()
+
+    @staticmethod
+    def _bucket(buckets: Dict[str, TokenBucket], key: str, rate: Tuple[float, float]) -> TokenBucket:
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = TokenBucket(*rate)
+        return bucket
+
+    @asynccontextmanager
+    async def slot(self):
+        """Hold one of the ``max_concurrent`` backend slots, queueing if needed"""
+        if self._slots.locked():
+            if self._waiting >= self.max_queue:
+                raise AdmissionRejected("overloaded", self._estimated_wait())
+            self._waiting += 1
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                raise AdmissionRejected("overloaded", self._estimated_wait()) from None
+            finally:
+                self._waiting -= 1
+        else:
+            await self._slots.acquire()
+
+        self._running += 1
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._running -= 1
+            self._slots.release()
+            self._avg_service_time = 0.8 * self._avg_service_time + 0.2 * (time.monotonic() - start)
+
+    def _estimated_wait(self) -> float:
+        return self._avg_service_time * (self._waiting + 1) / self.max_concurrent
+
+    def forget_client(self, client_id: str):
+        self._client_buckets.pop(client_id, None)
+
+    def forget_room(self, room_id: str):
+        self._room_buckets.pop(room_id, None)
@@ -0,0 +1,170 @@
+"""
+Binary PCM16 audio ingestion for server-side recognition.
+
+Browsers send framed chunks over ``/ws/audio/{client_id}/{room_id}``::
+
+    uint32 LE  sequence number
+    float64 LE capture timestamp in milliseconds
+    int16 LE   mono PCM samples ...
+
+Each client's samples land in a preallocated ring buffer that is reused
+for the life of the connection, and a recognizer consumes them as
+fixed-size frames through an async iterator.
+"""
+
+import struct
+import asyncio
+import logging
+from typing import AsyncIterator, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+FRAME_HEADER = struct.Struct("<Id")
+BYTES_PER_SAMPLE = 2
+# 客户端可以声明的采样率；采样率决定环形缓冲区的大小，不能直接信任查询参数
+SUPPORTED_SAMPLE_RATES = frozenset({8000, 11025, 12000, 16000, 22050, 24000, 32000, 44100, 48000, 88200, 96000})
+
+
+class PCMRingBuffer:
+    """
+    Fixed-capacity ring buffer of PCM16 bytes.
+
+    Writes copy into the preallocated storage; when a reader falls behind
+    the oldest audio is overwritten and counted in ``overruns``.
+    """
+
+    def __init__(self, capacity_bytes: int, sample_rate: int = 16000):
+        if capacity_bytes <= 0 or capacity_bytes % BYTES_PER_SAMPLE:
+            raise ValueError("capacity_bytes must be a positive multiple of 2")
+        self.sample_rate = sample_rate
+        self.capacity = capacity_bytes
+        self._storage = bytearray(capacity_bytes)
+        self._view = memoryview(self._storage)
+        self._read_pos = 0
+        self._size = 0
+        self._closed = False
+        self._data_ready = asyncio.Event()
+
+        # 帧元数据
+        self.last_seq: Optional[int] = None
+        self.last_timestamp: Optional[float] = None
+        self.lost_chunks = 0
+        self.overruns = 0
+
+    @property
+    def available(self) -> int:
+        return self._size
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def write_frame(self, frame: bytes) -> bool:
+        """Parse one framed chunk and append its samples; False if malformed"""
+        if len(frame) < FRAME_HEADER.size or (len(frame) - FRAME_HEADER.size) % BYTES_PER_SAMPLE:
+            return False
+        seq, timestamp = FRAME_HEADER.unpack_from(frame)
+        if self.last_seq is not None:
+            expected = (self.last_seq + 1) & 0xFFFFFFFF
+            if seq != expected:
+                # 丢包或乱序：只统计，不补静音
+                self.lost_chunks += (seq - expected) & 0xFFFFFFFF
+        self.last_seq = seq
+        self.last_timestamp = timestamp
+        self.write(memoryview(frame)[FRAME_HEADER.size:])
+        return True
+
+    def write(self, samples: memoryview):
+        """Append raw PCM16 bytes, overwriting the oldest audio when full"""
+        n = len(samples)
+        if n >= self.capacity:
+            # 单块比缓冲区还大时只保留最新的部分
+            self.overruns += self._size + n - self.capacity
+            samples = samples[n - self.capacity:]
+            n = self.capacity
+            self._read_pos = 0
+            self._size = 0
+        elif self._size + n > self.capacity:
+            dropped = self._size + n - self.capacity
+            self.overruns += dropped
+            self._read_pos = (self._read_pos + dropped) % self.capacity
+            self._size -= dropped
+
+        write_pos = (self._read_pos + self._size) % self.capacity
+        first = min(n, self.capacity - write_pos)
+        self._view[write_pos:write_pos + first] = samples[:first]
+        if first < n:
+            self._view[:n - first] = samples[first:]
+        self._size += n
+        self._data_ready.set()
+
+    def readinto(self, out: memoryview) -> int:
+        """Copy up to ``len(out)`` bytes into ``out``; returns bytes copied"""
+        n = min(len(out), self._size)
+        first = min(n, self.capacity - self._read_pos)
+        out[:first] = self._view[self._read_pos:self._read_pos + first]
+        if first < n:
+            out[first:n] = self._view[:n - first]
+        self._read_pos = (self._read_pos + n) % self.capacity
+        self._size -= n
+        if self._size == 0:
+            self._data_ready.clear()
+        return n
+
+    async def frames(self, frame_ms: int = 20) -> AsyncIterator[memoryview]:
+        """
+        Yield consecutive ``frame_ms`` frames until the buffer is closed.
+
+        The yielded memoryview is reused for every frame; copy it if it
+        has to outlive the next iteration.
+        """
+        frame_bytes = self.sample_rate * frame_ms // 1000 * BYTES_PER_SAMPLE
+        out = memoryview(bytearray(frame_bytes))
+        while True:
+            while self._size < frame_bytes:
+                if self._closed:
+                    return
+                await self._data_ready.wait()
+                self._data_ready.clear()
+            self.readinto(out)
+            yield out
+
+    def close(self):
+        self._closed = True
+        self._data_ready.set()
+
+
+class AudioIngestManager:
+    """Per-client PCM ring buffers fed by the binary audio route"""
+
+    def __init__(self, buffer_seconds: float = 10.0):
+        self.buffer_seconds = buffer_seconds
+        self.buffers: Dict[str, PCMRingBuffer] = {}
+        self._opened = asyncio.Condition()
+
+    async def open(self, client_id: str, sample_rate: int) -> PCMRingBuffer:
+        if sample_rate not in SUPPORTED_SAMPLE_RATES:
+            raise ValueError(f"unsupported sample rate {sample_rate}")
+        capacity = int(sample_rate * self.buffer_seconds) * BYTES_PER_SAMPLE
+        old = self.buffers.get(client_id)
+        if old is not None:
+            old.close()
+        buffer = self.buffers[client_id] = PCMRingBuffer(capacity, sample_rate)
+        async with self._opened:
+            self._opened.notify_all()
+        logger.info(f"Audio stream opened for client {client_id} at {sample_rate} Hz")
+        return buffer
+
+    def close(self, client_id: str, buffer: PCMRingBuffer):
+        buffer.close()
+        if self.buffers.get(client_id) is buffer:
+            del self.buffers[client_id]
+        logger.info(f"Audio stream closed for client {client_id} "
+                    f"(lost chunks: {buffer.lost_chunks}, overrun bytes: {buffer.overruns})")
+
+    async def stream(self, client_id: str, frame_ms: int = 20) -> AsyncIterator[memoryview]:
+        """Wait for the client's audio stream and yield its frames"""
+        async with self._opened:
+            await self._opened.wait_for(lambda: client_id in self.buffers)
+        async for frame in self.buffers[client_id].frames(frame_ms):
+            yield frame
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark connect/disconnect churn in ConnectionManager at 100k rooms.
+
+Compares the reverse-index ConnectionManager with the previous
+implementation, which scanned every room on disconnect and never
+deleted empty rooms.
+
+Usage: python bench_connection_churn.py [rooms]
+"""
+
+import sys
+import time
+import asyncio
+import logging
+
+from voice_chat_server import ConnectionManager
+
+
+class FakeWebSocket:
+    """Minimal stand-in for a FastAPI WebSocket"""
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, data: str):
+        pass
+
+
+class LegacyConnectionManager:
+    """The membership bookkeeping as it was before the reverse index"""
+
+    def __init__(self):
+        self.active_connections = {}
+        self.rooms = {}
+
+    async def connect(self, websocket, client_id, room_id):
+        await websocket.accept()
+        self.active_connections[client_id] = websocket
+        if room_id not in self.rooms:
+            self.rooms[room_id] = set()
+        self.rooms[room_id].add(client_id)
+
+    def disconnect(self, client_id):
+        if client_id in self.active_connections:
+            del self.active_connections[client_id]
+        for room_id, clients in self.rooms.items():
+            if client_id in clients:
+                clients.remove(client_id)
+
+
+async def churn(manager, rooms: int, churn_ops: int):
+    """Fill ``rooms`` single-member rooms, then time connect/disconnect cycles on top"""
+    for i in range(rooms):
+        await manager.connect(FakeWebSocket(), f"client_{i}", f"room_{i}")
+
+    start = time.perf_counter()
+    for i in range(churn_ops):
+        client_id = f"churn_{i}"
+        await manager.connect(FakeWebSocket(), client_id, f"churn_room_{i}")
+        manager.disconnect(client_id)
+    elapsed = time.perf_counter() - start
+    return elapsed / churn_ops, len(manager.rooms)
+
+
+async def main(rooms: int):
+    # 基准测试时不输出每次连接的日志
+    logging.disable(logging.CRITICAL)
+
+    print(f"Connect/disconnect churn on top of {rooms} live rooms")
+    print("=" * 60)
+    for name, manager, ops in [
+        ("reverse index (current)", ConnectionManager(), 20000),
+        ("full room scan (legacy)", LegacyConnectionManager(), 200),
+    ]:
+        per_op, room_count = await churn(manager, rooms, ops)
+        print(f"{name:28s} {per_op * 1e6:10.1f} us/cycle   rooms left: {room_count}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000))
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark the production launcher against the plain ``uvicorn.run`` path.
+
+Both servers are started as subprocesses on their own ports:
+
+- baseline: ``uvicorn.run(app)`` with its defaults, as in
+  ``python voice_chat_server.py``;
+- launcher: ``serve_voice_chat.py`` (uvloop, httptools, SO_REUSEPORT
+  workers pinned to cores, tuned WebSocket settings).
+
+For each we measure the connection accept rate (WebSocket handshakes per
+second with a fixed number in flight) and the message round trip of
+``get_users`` -> ``users_list`` while all connections stay open.
+
+The load generator runs in this process, so on a small machine it
+competes with the workers for CPU; pass ``--workers`` to match the cores
+you actually have.
+
+Usage: python bench_launcher.py [--connections 500] [--workers 2]
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+import websockets
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE = ("import uvicorn, voice_chat_server; "
+            "uvicorn.run(voice_chat_server.app, host='127.0.0.1', port={port}, log_level='warning')")
+
+
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))] * 1000 if ordered else 0.0
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(command: list, port: int, workdir: str) -> subprocess.Popen:
+    env = dict(os.environ, PYTHONPATH=REPO_DIR, CHATBOT_POOL_MIN_SIZE="0")
+    process = subprocess.Popen(command, cwd=workdir, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 20
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"server on port {port} did not start")
+
+
+def stop_server(process: subprocess.Popen):
+    process.terminate()
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+async def accept_rate(port: int, connections: int, concurrency: int, room_size: int):
+    """Open ``connections`` WebSockets with ``concurrency`` handshakes in flight"""
+    sockets = [None] * connections
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def open_one(i):
+        async with semaphore:
+            sockets[i] = await websockets.connect(
+                f"ws://127.0.0.1:{port}/ws/client_{i}/room_{i // room_size}", max_queue=None)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[open_one(i) for i in range(connections)])
+    return connections / (time.perf_counter() - start), sockets
+
+
+async def round_trips(sockets: list, rounds: int) -> list:
+    """Every client sends get_users and waits for its users_list, ``rounds`` times"""
+    latencies = []
+
+    async def client(websocket):
+        for _ in range(rounds):
+            start = time.perf_counter()
+            await websocket.send('{"type":"get_users"}')
+            while json.loads(await websocket.recv())["type"] != "users_list":
+                pass
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*[client(websocket) for websocket in sockets])
+    return latencies
+
+
+async def measure(port: int, args) -> tuple:
+    rate, sockets = await accept_rate(port, args.connections, args.concurrency, args.room_size)
+    # 等待加入房间的广播发完，避免和往返测量混在一起
+    await asyncio.sleep(1)
+    start = time.perf_counter()
+    latencies = await round_trips(sockets, args.rounds)
+    throughput = len(latencies) / (time.perf_counter() - start)
+    await asyncio.gather(*[websocket.close() for websocket in sockets], return_exceptions=True)
+    return rate, throughput, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--connections", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--room-size", type=int, default=5)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    setups = [("uvicorn.run", lambda port: [sys.executable, "-c", BASELINE.format(port=port)])]
+    launcher = lambda workers: lambda port: [
+        sys.executable, os.path.join(REPO_DIR, "serve_voice_chat.py"), "--host", "127.0.0.1",
+        "--port", str(port), "--workers", str(workers)
+    ] + (["--with-broker", "--broker-port", str(free_port())] if workers > 1 else [])
+    setups.append(("launcher, 1 worker", launcher(1)))
+    if args.workers > 1:
+        setups.append((f"launcher, {args.workers} workers", launcher(args.workers)))
+
+    print(f"{args.connections} connections ({args.concurrency} handshakes in flight, rooms of {args.room_size}), "
+          f"{args.rounds} get_users round trips each, {os.cpu_count()} CPUs")
+    print("=" * 88)
+    print(f"{'server':<22} {'accepts/s':>10} {'msgs/s':>10} {'RTT p50 (ms)':>13} {'RTT p95 (ms)':>13} {'RTT p99 (ms)':>13}")
+    with tempfile.TemporaryDirectory() as workdir:
+        for name, command in setups:
+            port = free_port()
+            server = start_server(command(port), port, workdir)
+            try:
+                rate, throughput, latencies = asyncio.run(measure(port, args))
+            finally:
+                stop_server(server)
+            print(f"{name:<22} {rate:>10,.0f} {throughput:>10,.0f} {percentile(latencies, 0.5):>13.2f} "
+                  f"{percentile(latencies, 0.95):>13.2f} {percentile(latencies, 0.99):>13.2f}")
+
+
+if __name__ == "__main__":
+    main()
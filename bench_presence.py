@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark get_users reply size in a large room with membership churn.
+
+Every poll the room loses and gains a few members; a client polling
+without a version gets the whole list each time, one passing
+``since_version`` only gets the changes.
+
+Usage: python bench_presence.py [members] [polls] [churn per poll]
+"""
+
+import sys
+import json
+import asyncio
+import logging
+
+from voice_chat_server import ConnectionManager
+
+
+class NullWebSocket:
+    async def accept(self):
+        pass
+
+    async def send_text(self, data: str):
+        pass
+
+
+async def run(members: int, polls: int, churn: int):
+    manager = ConnectionManager()
+    for i in range(members):
+        await manager.connect(NullWebSocket(), f"client_{i:05d}", "big_room")
+
+    full_bytes = delta_bytes = 0
+    version = json.loads((await manager.presence_reply("big_room")).json)["version"]
+    next_id = members
+    for poll in range(polls):
+        for i in range(churn):
+            manager.disconnect(f"client_{poll * churn + i:05d}")
+            await manager.connect(NullWebSocket(), f"client_{next_id:05d}", "big_room")
+            next_id += 1
+        await asyncio.sleep(0)
+        full_bytes += len((await manager.presence_reply("big_room")).json.encode())
+        reply = (await manager.presence_reply("big_room", version)).json
+        delta_bytes += len(reply.encode())
+        version = json.loads(reply)["version"]
+
+    print(f"{members} members, {polls} polls, {churn} joins and {churn} leaves between polls")
+    print(f"  full users_list : {full_bytes / polls:>10.0f} bytes per poll")
+    print(f"  since_version   : {delta_bytes / polls:>10.0f} bytes per poll")
+
+
+if __name__ == "__main__":
+    logging.disable(logging.CRITICAL)
+    args = [int(a) for a in sys.argv[1:]]
+    asyncio.run(run(*(args + [2000, 50, 5][len(args):])))
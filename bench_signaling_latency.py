@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark signaling coalescing: frames sent versus delivery latency.
+
+Two bursty scenarios are replayed against ConnectionManager with
+coalescing windows of 0 (off), 10, 20 and 30 ms:
+
+- join storm: clients join one room back to back, each join broadcasting
+  ``user_joined`` to everyone already there;
+- trickle ICE: every client emits a burst of ``ice_candidate`` messages.
+
+Frames sent is a proxy for send syscalls; latency is measured from the
+broadcast call to the frame reaching the (fake) socket.
+
+Usage: python bench_signaling_latency.py [room_size]
+"""
+
+import sys
+import json
+import time
+import asyncio
+import logging
+
+import voice_chat_server
+from voice_chat_server import ConnectionManager
+
+CANDIDATES_PER_CLIENT = 8
+
+
+class TimingWebSocket:
+    """Fake WebSocket that records frame count and per-message delivery latency"""
+
+    def __init__(self, latencies: list):
+        self.frames = 0
+        self.latencies = latencies
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, data: str):
+        self.frames += 1
+        now = time.perf_counter()
+        message = json.loads(data)
+        for item in message["messages"] if message["type"] == "batch" else [message]:
+            if "sent_at" in item:
+                self.latencies.append(now - item["sent_at"])
+
+
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))] * 1000 if ordered else 0.0
+
+
+async def join_storm(room_size: int) -> int:
+    manager = ConnectionManager()
+    sockets = []
+    for i in range(room_size):
+        websocket = TimingWebSocket([])
+        sockets.append(websocket)
+        await manager.connect(websocket, f"client_{i}", "bench_room")
+    await asyncio.sleep(0.1)
+    frames = sum(websocket.frames for websocket in sockets)
+    for i in range(room_size):
+        manager.disconnect(f"client_{i}")
+    await asyncio.sleep(0)
+    return frames
+
+
+async def trickle_ice(room_size: int):
+    manager = ConnectionManager()
+    latencies = []
+    sockets = [TimingWebSocket(latencies) for _ in range(room_size)]
+    for i, websocket in enumerate(sockets):
+        await manager.connect(websocket, f"client_{i}", "bench_room")
+    await asyncio.sleep(0.1)
+    for websocket in sockets:
+        websocket.frames = 0
+
+    for n in range(CANDIDATES_PER_CLIENT):
+        for i in range(room_size):
+            await manager.broadcast_to_room("bench_room", {
+                "type": "ice_candidate",
+                "sender": f"client_{i}",
+                "candidate": {"candidate": f"candidate:{n} 1 udp 2122260223 192.168.1.{i % 250} {50000 + n} typ host"},
+                "sent_at": time.perf_counter()
+            }, exclude_client=f"client_{i}")
+        # 候选地址在ICE收集过程中陆续产生
+        await asyncio.sleep(0.002)
+    await asyncio.sleep(0.1)
+
+    frames = sum(websocket.frames for websocket in sockets)
+    for i in range(room_size):
+        manager.disconnect(f"client_{i}")
+    await asyncio.sleep(0)
+    return frames, latencies
+
+
+async def main(room_size: int):
+    logging.disable(logging.CRITICAL)
+    print(f"Signaling coalescing, room of {room_size}, {CANDIDATES_PER_CLIENT} ICE candidates per client")
+    print("=" * 78)
+    print(f"{'window':>8} {'join frames':>12} {'ICE frames':>11} {'ICE p50 (ms)':>13} {'ICE p99 (ms)':>13}")
+    for window_ms in (0, 10, 20, 30):
+        voice_chat_server.COALESCE_WINDOWS.clear()
+        if window_ms:
+            for msg_type in ("ice_candidate", "user_joined", "user_left"):
+                voice_chat_server.COALESCE_WINDOWS[msg_type] = window_ms / 1000
+        join_frames = await join_storm(room_size)
+        ice_frames, latencies = await trickle_ice(room_size)
+        print(f"{window_ms:>6}ms {join_frames:>12,} {ice_frames:>11,} "
+              f"{percentile(latencies, 0.5):>13.2f} {percentile(latencies, 0.99):>13.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 20))
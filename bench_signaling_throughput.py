@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark signaling throughput (messages per second) for rooms of 2, 10 and 50 members.
+
+Each message is parsed from a text frame, broadcast to the rest of the
+room and drained by the per-connection writers. The encode-once path is
+compared with the previous behaviour of calling json.dumps for every
+recipient.
+
+Usage: python bench_signaling_throughput.py [messages]
+"""
+
+import sys
+import json
+import time
+import asyncio
+import logging
+
+import signaling_codec as codec
+from voice_chat_server import ConnectionManager
+
+
+class CountingWebSocket:
+    """Fake WebSocket that only counts delivered frames"""
+
+    def __init__(self):
+        self.frames = 0
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, data: str):
+        self.frames += 1
+
+
+class PerRecipientEncodingManager(ConnectionManager):
+    """Broadcast as before: stdlib json.dumps once per recipient"""
+
+    async def broadcast_to_room(self, room_id: str, message: dict, exclude_client: str = None):
+        for client_id in self.rooms.get(room_id, ()):
+            record = self.clients.get(client_id)
+            if client_id != exclude_client and record is not None:
+                record.outbox.put_nowait(json.dumps(message))
+
+
+ICE_FRAME = json.dumps({
+    "type": "ice_candidate",
+    "candidate": {
+        "candidate": "candidate:842163049 1 udp 1677729535 203.0.113.7 46154 typ srflx "
+                     "raddr 192.168.1.20 rport 46154 generation 0 ufrag sXsa network-cost 999",
+        "sdpMid": "0",
+        "sdpMLineIndex": 0
+    },
+    "target": "client_1"
+})
+
+
+async def measure(manager_cls, decode, room_size: int, messages: int) -> float:
+    manager = manager_cls()
+    sockets = [CountingWebSocket() for _ in range(room_size)]
+    for i, websocket in enumerate(sockets):
+        await manager.connect(websocket, f"client_{i}", "bench_room")
+    await asyncio.sleep(0)
+    for websocket in sockets:
+        websocket.frames = 0
+
+    expected = messages * (room_size - 1)
+    start = time.perf_counter()
+    for n in range(messages):
+        message = decode(ICE_FRAME)
+        await manager.broadcast_to_room("bench_room", {
+            "type": "ice_candidate",
+            "sender": "client_0",
+            "candidate": message.get("candidate")
+        }, exclude_client="client_0")
+        if n % 64 == 0:
+            await asyncio.sleep(0)
+    while sum(websocket.frames for websocket in sockets) < expected:
+        await asyncio.sleep(0)
+    elapsed = time.perf_counter() - start
+
+    for i in range(room_size):
+        manager.disconnect(f"client_{i}")
+    return messages / elapsed
+
+
+async def main(messages: int):
+    logging.disable(logging.CRITICAL)
+    print(f"Signaling throughput, {messages} ice_candidate broadcasts per room (codec: {codec.CODEC_NAME})")
+    print("=" * 72)
+    print(f"{'room size':>10} {'per-recipient json (msg/s)':>28} {'encode-once (msg/s)':>22} {'speedup':>8}")
+    for room_size in (2, 10, 50):
+        legacy = await measure(PerRecipientEncodingManager, json.loads, room_size, messages)
+        current = await measure(ConnectionManager, codec.loads, room_size, messages)
+        print(f"{room_size:>10} {legacy:>28,.0f} {current:>22,.0f} {current / legacy:>7.2f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000))
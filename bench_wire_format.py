@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark the signaling wire formats: serialized size and encode/decode CPU.
+
+Representative frames from each hop are encoded with the stdlib json
+module (what the chatbot servers used before), the JSON codec of
+signaling_codec (orjson when installed) and the negotiated msgpack
+subprotocol.
+
+Usage: python bench_wire_format.py [iterations]
+"""
+
+import sys
+import json
+import timeit
+
+import signaling_codec as codec
+
+MESSAGES = {
+    "ice_candidate": {
+        "type": "ice_candidate",
+        "sender": "client_k3j9x0a2b",
+        "target": "client_p8q7r6s5t",
+        "candidate": {
+            "candidate": "candidate:842163049 1 udp 1677729535 203.0.113.7 54321 typ srflx raddr 192.168.1.10 "
+                         "rport 54321 generation 0 ufrag EsAw network-cost 999",
+            "sdpMid": "0",
+            "sdpMLineIndex": 0,
+            "usernameFragment": "EsAw"
+        }
+    },
+    "user_joined": {"type": "user_joined", "client_id": "client_k3j9x0a2b"},
+    "asr_text (chatbot)": {
+        "type": "asr_text",
+        "text": "今天北京的天气怎么样，适合出去跑步吗？",
+        "client_id": "client_k3j9x0a2b",
+        "session_id": "room1",
+        "request_id": "9f1c2b7a4d3e4f5a8b6c7d8e9f0a1b2c",
+        "stream": True
+    },
+    "bot_response_delta": {
+        "type": "bot_response_delta",
+        "request_id": "9f1c2b7a4d3e4f5a8b6c7d8e9f0a1b2c",
+        "seq": 3,
+        "text": "今天北京晴，气温适宜，",
+        "session_id": "room1",
+        "client_id": "client_k3j9x0a2b"
+    },
+}
+
+
+def stdlib_dumps(obj):
+    return json.dumps(obj, ensure_ascii=False)
+
+
+def main(iterations: int):
+    formats = [("stdlib json", stdlib_dumps, json.loads), (codec.CODEC_NAME, codec.JSON.dumps, codec.JSON.loads)]
+    if codec.MSGPACK is not None:
+        formats.append(("msgpack", codec.MSGPACK.dumps, codec.MSGPACK.loads))
+
+    print(f"Wire formats, {iterations:,} iterations per measurement (times in µs per message)")
+    print("=" * 78)
+    print(f"{'message':<20} {'format':<12} {'bytes':>6} {'encode':>9} {'decode':>9}")
+    for name, message in MESSAGES.items():
+        for label, dumps, loads in formats:
+            data = dumps(message)
+            size = len(data.encode("utf-8") if isinstance(data, str) else data)
+            encode = min(timeit.repeat(lambda: dumps(message), number=iterations, repeat=3)) / iterations * 1e6
+            decode = min(timeit.repeat(lambda: loads(data), number=iterations, repeat=3)) / iterations * 1e6
+            print(f"{name:<20} {label:<12} {size:>6} {encode:>9.2f} {decode:>9.2f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,395 @@
+import time
+import uuid
+import asyncio
+import logging
+from typing import AsyncIterator, Dict, List, Optional, Any
+import websockets
+import signaling_codec as codec
+
+logger = logging.getLogger(__name__)
+
+# 默认的聊天机器人服务地址
+DEFAULT_CHATBOT_URI = "ws://localhost:8765"
+
+# 流式回复中的增量帧类型；其他类型的帧都是该请求的最终回复
+DELTA_TYPE = "bot_response_delta"
+# 最终回复带audio_pending时，流在随后的语音帧之后才结束
+AUDIO_TYPE = "bot_audio"
+
+
+class ChatbotChannel:
+    """
+    Multiplexed request/response channel over a single chatbot WebSocket.
+
+    Every outgoing request is tagged with a ``request_id``; one reader task
+    routes each reply to the future that is waiting for it, so any number
+    of requests can be in flight on the same socket. Streaming requests
+    get a queue instead of a future and receive every ``bot_response_delta``
+    frame followed by the final reply (and, when that reply is marked
+    ``audio_pending``, the ``bot_audio`` frame sent once speech is ready).
+
+    The encoding is negotiated when the socket opens: msgpack if the
+    chatbot server supports it, JSON otherwise.
+    """
+
+    def __init__(self, uri: str = DEFAULT_CHATBOT_URI, request_timeout: float = 60.0):
+        self.uri = uri
+        self.request_timeout = request_timeout
+        self._ws: Optional[websockets.WebSocketClientProtocol] = None
+        self._wire = codec.JSON
+        self._reader_task: Optional[asyncio.Task] = None
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._streams: Dict[str, asyncio.Queue] = {}
+        # 所有未完成请求（普通和流式）的request_id，按发出顺序
+        self._issued: Dict[str, None] = {}
+        self._reading = False
+        # 连接池已分配给调用方、但请求尚未登记的数量，计入负载，空闲回收不会关闭该通道
+        self._reserved = 0
+        # 连接池不再跟踪的通道不能重新连接，否则打开的socket没有人关闭
+        self._retired = False
+        self._connect_lock = asyncio.Lock()
+        self.last_used = time.monotonic()
+
+    @property
+    def is_open(self) -> bool:
+        # 读取任务退出后即使socket还开着也不能再用：没有人会分发回复
+        return self._ws is not None and self._ws.open and self._reading
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._pending) + len(self._streams) + self._reserved
+
+    def reserve(self):
+        """Count a request handed out by the pool until ``request``/``stream`` (with ``reserved``) registers it"""
+        self._reserved += 1
+
+    def retire(self):
+        """Refuse to (re)connect from now on; outstanding requests still finish or fail"""
+        self._retired = True
+
+    async def connect(self):
+        """Open the socket and start the reader task (idempotent)"""
+        async with self._connect_lock:
+            if self.is_open:
+                return
+            if self._retired:
+                raise ConnectionError("chatbot channel was closed")
+            self._ws = await websockets.connect(self.uri, subprotocols=codec.SUBPROTOCOLS)
+            # 旧版聊天机器人不支持子协议协商，subprotocol为None时使用JSON
+            self._wire = codec.wire_for(self._ws.subprotocol)
+            self._reading = True
+            self._reader_task = asyncio.create_task(self._read_loop(self._ws))
+            logger.info(f"Chatbot channel connected to {self.uri} ({self._ws.subprotocol or 'json'})")
+
+    async def request(self, message: Dict[str, Any], timeout: Optional[float] = None,
+                      reserved: bool = False) -> Optional[Dict[str, Any]]:
+        """Send a message and wait for the reply carrying the same request_id"""
+        await self._connect_reserved(reserved)
+        self.last_used = time.monotonic()
+
+        request_id = uuid.uuid4().hex
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        self._issued[request_id] = None
+        try:
+            payload = dict(message, request_id=request_id)
+            await self._ws.send(self._wire.dumps(payload))
+            return await asyncio.wait_for(future, timeout or self.request_timeout)
+        finally:
+            self._pending.pop(request_id, None)
+            self._issued.pop(request_id, None)
+            self.last_used = time.monotonic()
+
+    async def stream(self, message: Dict[str, Any], timeout: Optional[float] = None,
+                     reserved: bool = False) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Send a streaming request and yield its delta frames, then the final reply
+        and, if the final reply has ``audio_pending``, the ``bot_audio`` frame.
+
+        ``timeout`` bounds the wait for each frame rather than the whole stream.
+        A chatbot without streaming support just answers with the final reply.
+        """
+        await self._connect_reserved(reserved)
+        self.last_used = time.monotonic()
+
+        request_id = uuid.uuid4().hex
+        frames: asyncio.Queue = asyncio.Queue()
+        self._streams[request_id] = frames
+        self._issued[request_id] = None
+        try:
+            await self._ws.send(self._wire.dumps(dict(message, request_id=request_id, stream=True)))
+            while True:
+                frame = await asyncio.wait_for(frames.get(), timeout or self.request_timeout)
+                if isinstance(frame, Exception):
+                    raise frame
+                yield frame
+                if frame.get("type") != DELTA_TYPE and not frame.get("audio_pending"):
+                    return
+        finally:
+            self._streams.pop(request_id, None)
+            self._issued.pop(request_id, None)
+            self.last_used = time.monotonic()
+
+    async def _connect_reserved(self, reserved: bool):
+        """Connect, then hand a pool reservation over to the request about to be registered"""
+        try:
+            await self.connect()
+        finally:
+            # 释放后到登记请求之间没有await，负载计数不会出现空档
+            if reserved:
+                self._reserved -= 1
+
+    async def ping(self, timeout: float = 5.0) -> bool:
+        """Health check: True if the peer answers a WebSocket ping in time"""
+        if not self.is_open:
+            return False
+        try:
+            waiter = await self._ws.ping()
+            await asyncio.wait_for(waiter, timeout)
+            return True
+        except Exception:
+            return False
+
+    async def _read_loop(self, ws):
+        """
+        Dispatch every incoming reply to its pending future or stream.
+
+        A reply without ``request_id`` (a chatbot that predates multiplexing
+        and answers strictly in order) goes to the oldest outstanding
+        request, plain or streaming.
+        """
+        try:
+            async for raw in ws:
+                try:
+                    reply = codec.decode(raw)
+                except (codec.DecodeError, ValueError) as e:
+                    # 包括非UTF-8的字节：跳过这一帧，读取任务继续运行
+                    logger.warning(f"Invalid frame from chatbot: {e}")
+                    continue
+                if not isinstance(reply, dict):
+                    logger.warning(f"Ignoring non-object frame from chatbot: {reply!r:.100}")
+                    continue
+
+                request_id = reply.get("request_id")
+                if request_id is None and self._issued:
+                    # 旧版聊天机器人不回传request_id，但按顺序处理，按FIFO匹配
+                    request_id = next(iter(self._issued))
+                frames = self._streams.get(request_id)
+                if frames is not None:
+                    frames.put_nowait(reply)
+                    continue
+                future = self._pending.get(request_id)
+                if future is None:
+                    logger.warning(f"Dropping chatbot reply for unknown request {request_id}")
+                    continue
+                if not future.done():
+                    future.set_result(reply)
+        except websockets.exceptions.ConnectionClosed:
+            logger.info(f"Chatbot channel to {self.uri} closed")
+        except Exception as e:
+            logger.error(f"Chatbot channel reader error: {e}", exc_info=True)
+        finally:
+            # 读取任务无论因何退出，通道都标记为关闭，连接池不再分配它
+            self._reading = False
+            self._fail_pending(ConnectionError("chatbot connection lost"))
+            if ws.open:
+                await ws.close()
+
+    def _fail_pending(self, exc: Exception):
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(exc)
+        self._pending.clear()
+        for frames in self._streams.values():
+            frames.put_nowait(exc)
+
+    async def close(self):
+        """Close the socket for good and fail any outstanding requests"""
+        self.retire()
+        if self._ws is not None:
+            await self._ws.close()
+        if self._reader_task is not None:
+            await asyncio.gather(self._reader_task, return_exceptions=True)
+        self._ws = None
+        self._reader_task = None
+
+
+class ChatbotConnectionPool:
+    """
+    Bounded pool of multiplexed chatbot channels shared by all rooms.
+
+    ``min_size`` channels are opened eagerly by ``start()`` so the first
+    utterance in a new room does not pay the connect cost. Extra channels
+    (up to ``max_size``) are opened only when every open channel already has
+    ``max_in_flight`` requests outstanding, and are closed again once they
+    have been idle for ``idle_timeout`` seconds. A background task pings
+    every channel each ``health_check_interval`` seconds and drops the ones
+    that do not answer.
+
+    The pool lock only guards picking and dropping channels: new channels
+    connect outside it, and a picked channel is reserved until its request
+    is registered, so maintenance never closes a channel that was just
+    handed out. Dropped channels are retired and cannot reconnect.
+    """
+
+    def __init__(self, uri: str = DEFAULT_CHATBOT_URI, min_size: int = 1, max_size: int = 4,
+                 max_in_flight: int = 8, idle_timeout: float = 300.0,
+                 health_check_interval: float = 30.0, request_timeout: float = 60.0):
+        if not 0 <= min_size <= max_size or max_size < 1:
+            raise ValueError("pool sizes must satisfy 0 <= min_size <= max_size and max_size >= 1")
+        self.uri = uri
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_in_flight = max_in_flight
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.request_timeout = request_timeout
+        self._channels: List[ChatbotChannel] = []
+        # 正在建连的通道占用名额，但还不能分配
+        self._opening: List[ChatbotChannel] = []
+        self._lock = asyncio.Lock()
+        self._maintenance_task: Optional[asyncio.Task] = None
+
+    @property
+    def size(self) -> int:
+        return len(self._channels) + len(self._opening)
+
+    @property
+    def in_flight(self) -> int:
+        return sum(channel.in_flight for channel in self._channels)
+
+    async def start(self):
+        """Open the warm connections and start the maintenance task"""
+        await self._fill_to_min_size()
+        if self._maintenance_task is None:
+            self._maintenance_task = asyncio.create_task(self._maintenance_loop())
+        logger.info(f"Chatbot pool started with {self.size}/{self.max_size} connections to {self.uri}")
+
+    async def request(self, message: Dict[str, Any], timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Send a request on the least loaded channel"""
+        channel = await self.acquire()
+        return await channel.request(message, timeout, reserved=True)
+
+    async def stream(self, message: Dict[str, Any], timeout: Optional[float] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Send a streaming request on the least loaded channel"""
+        channel = await self.acquire()
+        frames = channel.stream(message, timeout, reserved=True)
+        try:
+            async for frame in frames:
+                yield frame
+        finally:
+            # 调用方提前关闭本生成器时，async for不会关闭内层的流
+            await frames.aclose()
+
+    async def acquire(self) -> ChatbotChannel:
+        """
+        Pick the least loaded open channel, growing the pool if all are busy.
+
+        The channel comes back reserved: pass ``reserved=True`` to its
+        ``request``/``stream``.
+        """
+        async with self._lock:
+            self._prune()
+            best = min(self._channels, key=lambda channel: channel.in_flight, default=None)
+            if best is None and self.size >= self.max_size:
+                # 所有名额都在建连中：共用负载最低的那个，它的request会等待同一次建连
+                best = min(self._opening, key=lambda channel: channel.in_flight)
+            if best is not None and (best.in_flight < self.max_in_flight or self.size >= self.max_size):
+                best.reserve()
+                return best
+            channel = self._reserve_new_channel()
+        # 建连在锁外进行，其他请求可以继续使用已打开的通道
+        await self._open_channel(channel)
+        return channel
+
+    def _reserve_new_channel(self) -> ChatbotChannel:
+        channel = ChatbotChannel(self.uri, self.request_timeout)
+        channel.reserve()
+        self._opening.append(channel)
+        return channel
+
+    async def _open_channel(self, channel: ChatbotChannel):
+        try:
+            await channel.connect()
+        except BaseException:
+            # 共用这个通道的请求随之失败，而不是各自打开连接池不跟踪的socket
+            channel.retire()
+            raise
+        finally:
+            self._opening.remove(channel)
+        self._channels.append(channel)
+
+    def _prune(self):
+        """Forget channels whose reader has exited; they may not reconnect behind the pool's back"""
+        channels = []
+        for channel in self._channels:
+            if channel.is_open:
+                channels.append(channel)
+            else:
+                channel.retire()
+        self._channels = channels
+
+    async def _fill_to_min_size(self):
+        while True:
+            async with self._lock:
+                self._prune()
+                if self.size >= self.min_size:
+                    return
+                channel = ChatbotChannel(self.uri, self.request_timeout)
+                self._opening.append(channel)
+            try:
+                await self._open_channel(channel)
+            except Exception as e:
+                logger.warning(f"Chatbot pool warmup failed ({self.size}/{self.min_size} open): {e}")
+                return
+
+    async def _maintenance_loop(self):
+        """Periodically drop unhealthy channels, reap idle ones and top up warm ones"""
+        while True:
+            await asyncio.sleep(self.health_check_interval)
+            try:
+                await self._check_health()
+                await self._reap_idle()
+                await self._fill_to_min_size()
+            except Exception as e:
+                logger.error(f"Chatbot pool maintenance error: {e}", exc_info=True)
+
+    async def _check_health(self):
+        # ping可能要等到超时，不持有锁
+        channels = list(self._channels)
+        results = await asyncio.gather(*[channel.ping() for channel in channels])
+        async with self._lock:
+            unhealthy = [channel for channel, healthy in zip(channels, results) if not healthy]
+            for channel in unhealthy:
+                logger.warning(f"Dropping unhealthy chatbot connection to {self.uri}")
+                self._discard(channel)
+        await asyncio.gather(*[channel.close() for channel in unhealthy], return_exceptions=True)
+
+    async def _reap_idle(self):
+        idle = []
+        async with self._lock:
+            now = time.monotonic()
+            for channel in list(self._channels):
+                if self.size <= self.min_size:
+                    break
+                # in_flight包括已分配但尚未登记的请求
+                if channel.in_flight == 0 and now - channel.last_used > self.idle_timeout:
+                    logger.info(f"Closing idle chatbot connection to {self.uri}")
+                    self._discard(channel)
+                    idle.append(channel)
+        await asyncio.gather(*[channel.close() for channel in idle], return_exceptions=True)
+
+    def _discard(self, channel: ChatbotChannel):
+        """Stop handing out ``channel``; call with the lock held, close it after releasing"""
+        if channel in self._channels:
+            self._channels.remove(channel)
+        channel.retire()
+
+    async def close(self):
+        """Stop maintenance and close every channel"""
+        if self._maintenance_task is not None:
+            self._maintenance_task.cancel()
+            await asyncio.gather(self._maintenance_task, return_exceptions=True)
+            self._maintenance_task = None
+        channels, self._channels = self._channels, []
+        await asyncio.gather(*[channel.close() for channel in channels], return_exceptions=True)
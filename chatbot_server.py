@@ -0,0 +1,428 @@
+"""
+WebSocket chatbot server shared by asr_chatbot.py and integrated_asr_chatbot.py.
+
+``ChatbotServer`` holds everything the two servers have in common: the
+Qwen model and prompt, per-session conversation memory, load shedding,
+metrics, and the request loop that answers ``asr_text`` (plain or
+streamed as ``bot_response_delta`` frames) and ``reset_session`` over
+a multiplexed, msgpack-or-JSON WebSocket. Subclasses set the system
+prompt and the message types they answer, and a server that speaks
+overrides ``synthesize``: its replies then carry an ``audio_file``, and
+streamed replies mark the final text ``audio_pending`` and follow it
+with a ``bot_audio`` frame.
+"""
+
+import time
+import logging
+import asyncio
+import websockets
+from typing import AsyncIterator, Dict, Any, Optional
+from langchain_community.chat_models import ChatOpenAI
+from langchain.prompts import ChatPromptTemplate
+from langchain.chains import LLMChain
+from langchain.schema import AIMessage, HumanMessage
+from langchain.callbacks.streaming_stdout import StreamingStdOutCallbackHandler
+from log_config import log_event
+from metrics import REGISTRY, websockets_metrics_handler
+import signaling_codec as codec
+import conversation_memory
+import load_shedding
+from load_shedding import OVERLOAD_RETRY_AFTER, ShedLevel, websockets_shedding_handler
+
+logger = logging.getLogger(__name__)
+
+# 指标：通过 http://host:8765/metrics 抓取
+REQUESTS = REGISTRY.counter("chatbot_requests_total", "Requests received by the chatbot server", ["type"])
+LLM_LATENCY = REGISTRY.histogram("llm_latency_seconds", "LLM call latency")
+LLM_FIRST_TOKEN = REGISTRY.histogram("llm_first_token_seconds", "Time to the first streamed LLM token")
+CONNECTIONS = REGISTRY.gauge("chatbot_server_connections", "Open WebSocket connections to the chatbot server")
+IN_FLIGHT = REGISTRY.gauge("chatbot_server_in_flight", "Requests being processed by the chatbot server")
+REJECTED = REGISTRY.counter("chatbot_requests_rejected_total", "asr_text requests refused by load shedding")
+
+DEFAULT_SYSTEM_PROMPT = "你是一个智能语音助手。请根据用户的语音输入提供相应的回答。保持回答简洁明了。"
+# 各类文本消息为空时的错误提示
+EMPTY_TEXT_MESSAGES = {"asr_text": "收到空的ASR文本", "text_message": "收到空的文本消息"}
+
+
+class ChatbotServer:
+    # 交给模型回答的消息类型；另外还支持reset_session
+    text_types = ("asr_text",)
+    system_prompt = DEFAULT_SYSTEM_PROMPT
+    # 覆盖synthesize的子类设为True：回复带audio_file，流式回复最后补发bot_audio
+    speaks = False
+
+    def __init__(self, api_key: str, model_name: str = "qwen-omni-turbo-realtime"):
+        """
+        初始化聊天机器人服务器
+
+        Args:
+            api_key: 阿里云百炼平台的API密钥
+            model_name: 使用的模型名称
+        """
+        self.api_key = api_key
+        self.model_name = model_name
+        self.known_message_types = set(self.text_types) | {"reset_session"}
+
+        # 初始化Qwen模型
+        self.llm = ChatOpenAI(
+            model=model_name,
+            openai_api_key=api_key,
+            openai_api_base="https://dashscope.aliyuncs.com/compatible-mode/v1",
+            streaming=True,
+            callbacks=[StreamingStdOutCallbackHandler()]
+        )
+
+        # 按session_id（房间）分开的对话记忆，限制会话数、总字节数并淘汰空闲会话
+        self.conversations = conversation_memory.from_env()
+        REGISTRY.gauge("chatbot_memory_sessions", "Sessions held in conversation memory",
+                       lambda: len(self.conversations))
+        REGISTRY.gauge("chatbot_memory_bytes", "UTF-8 bytes of text held in conversation memory",
+                       lambda: self.conversations.bytes)
+
+        # 创建对话模板
+        self.prompt = ChatPromptTemplate.from_messages([
+            ("system", self.system_prompt),
+            ("placeholder", "{chat_history}"),
+            ("user", "{input}")
+        ])
+
+        # 创建对话链；历史由调用方按会话传入
+        self.chain = LLMChain(llm=self.llm, prompt=self.prompt)
+
+        # 事件循环延迟监控：积压时拒绝新的asr_text，再严重时拒绝新连接
+        self.shedder = load_shedding.from_env()
+        REGISTRY.gauge("event_loop_lag_seconds", "Latest event loop lag sample", lambda: self.shedder.lag)
+        REGISTRY.gauge("load_shed_level", "Load shedding tier: 0 normal, 1 defer, 2 reject asr_text, "
+                       "3 refuse connections", lambda: int(self.shedder.level))
+
+    def _chat_history(self, session_id: Optional[str]) -> list:
+        """
+        把会话记忆中的轮次转换为提示模板所需的消息列表
+
+        Args:
+            session_id: 会话ID（可选）
+
+        Returns:
+            按时间顺序排列的HumanMessage/AIMessage列表
+        """
+        history = []
+        for user_text, bot_text in self.conversations.turns(session_id):
+            history.append(HumanMessage(content=user_text))
+            history.append(AIMessage(content=bot_text))
+        return history
+
+    async def process_asr_text(self, text: str, session_id: Optional[str] = None) -> str:
+        """
+        处理ASR文本并生成回复
+
+        Args:
+            text: ASR识别的文本
+            session_id: 会话ID（可选）
+
+        Returns:
+            模型生成的回复
+        """
+        try:
+            if not text or not text.strip():
+                logger.warning("Received empty or whitespace-only ASR text")
+                return "我没有听清楚您说什么，请您再说一遍。"
+
+            log_event(logger, logging.DEBUG, "asr_text", session_id=session_id, length=len(text), text=text[:50])
+
+            start = time.perf_counter()
+            response = await self.chain.arun(input=text, chat_history=self._chat_history(session_id))
+            LLM_LATENCY.observe(time.perf_counter() - start)
+            log_event(logger, logging.DEBUG, "llm_response", session_id=session_id, length=len(response or ""))
+
+            if not response or not response.strip():
+                logger.warning("Generated empty response from LLM")
+                return "我没有理解您的意思，请您换个说法再试一次。"
+
+            self.conversations.append(session_id, text, response)
+            return response
+        except Exception as e:
+            logger.error(f"Error processing ASR text: {e}", exc_info=True)
+            return "抱歉，处理您的请求时出现了错误。"
+
+    async def stream_asr_text(self, text: str, session_id: Optional[str] = None) -> AsyncIterator[str]:
+        """
+        流式处理ASR文本，逐段产出模型生成的回复
+
+        Args:
+            text: ASR识别的文本
+            session_id: 会话ID（可选）
+
+        Yields:
+            回复文本片段
+        """
+        log_event(logger, logging.DEBUG, "asr_text", session_id=session_id, length=len(text), stream=True)
+        parts = []
+        start = time.perf_counter()
+        try:
+            messages = self.prompt.format_messages(input=text, chat_history=self._chat_history(session_id))
+            async for chunk in self.llm.astream(messages):
+                if not chunk.content:
+                    continue
+                if not parts:
+                    LLM_FIRST_TOKEN.observe(time.perf_counter() - start)
+                parts.append(chunk.content)
+                yield chunk.content
+        except Exception as e:
+            logger.error(f"Error streaming ASR text response: {e}", exc_info=True)
+            if not parts:
+                yield "抱歉，处理您的请求时出现了错误。"
+            return
+
+        LLM_LATENCY.observe(time.perf_counter() - start)
+        response = "".join(parts)
+        self.conversations.append(session_id, text, response)
+        log_event(logger, logging.DEBUG, "llm_response", session_id=session_id, length=len(response), stream=True)
+
+    async def synthesize(self, text: str) -> Optional[str]:
+        """
+        把回复合成为语音文件；只有speaks为True的子类会调用
+
+        Args:
+            text: 要转换的文本
+
+        Returns:
+            音频文件路径
+        """
+        return None
+
+    async def handle_message(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        处理不同类型的消息
+
+        Args:
+            data: 消息数据
+
+        Returns:
+            回复消息
+        """
+        msg_type = data.get("type", "")
+
+        if msg_type in self.text_types:
+            # 处理ASR文本或其他文本消息
+            user_text = data.get("text", "")
+            session_id = data.get("session_id", None)
+            client_id = data.get("client_id", None)
+
+            log_event(logger, logging.INFO, f"{msg_type}_received", client_id=client_id, session_id=session_id)
+
+            if user_text:
+                response_text = await self.process_asr_text(user_text, session_id)
+                reply = {
+                    "type": "bot_response",
+                    "text": response_text,
+                    "session_id": session_id,
+                    "client_id": client_id
+                }
+                if self.speaks:
+                    reply["audio_file"] = await self.synthesize(response_text)
+                log_event(logger, logging.INFO, "bot_response", client_id=client_id, session_id=session_id,
+                          length=len(response_text))
+                return reply
+            else:
+                logger.warning(f"Received empty {msg_type}")
+                return {
+                    "type": "error",
+                    "message": EMPTY_TEXT_MESSAGES.get(msg_type, "收到空的文本"),
+                    "session_id": session_id,
+                    "client_id": client_id
+                }
+
+        elif msg_type == "reset_session":
+            # 重置会话
+            session_id = data.get("session_id", None)
+            client_id = data.get("client_id", None)
+            # 只清除该会话的记忆，其他房间的对话不受影响
+            self.conversations.clear(session_id)
+            logger.info(f"Session reset for client {client_id} in session {session_id}")
+            return {
+                "type": "session_reset",
+                "message": "会话已重置",
+                "session_id": session_id,
+                "client_id": client_id
+            }
+
+        else:
+            logger.warning(f"Unknown message type: {msg_type}")
+            return {
+                "type": "error",
+                "message": f"未知的消息类型: {msg_type}",
+                "client_id": data.get("client_id", None)
+            }
+
+    async def websocket_server(self, websocket, path):
+        """
+        WebSocket服务器处理函数
+
+        Args:
+            websocket: WebSocket连接对象
+            path: 请求路径
+        """
+        logger.info(f"New WebSocket connection established: {path}")
+        # 同一连接上的请求并发处理，响应通过request_id与请求对应
+        tasks = set()
+        CONNECTIONS.inc()
+        try:
+            async for message in websocket:
+                task = asyncio.create_task(self._process_message(websocket, message))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except websockets.exceptions.ConnectionClosed:
+            logger.info("WebSocket connection closed")
+        except Exception as e:
+            logger.error(f"WebSocket error: {e}", exc_info=True)
+        finally:
+            CONNECTIONS.dec()
+
+    async def _process_message(self, websocket, message):
+        """
+        处理单条WebSocket消息并发送回复
+
+        Args:
+            websocket: WebSocket连接对象
+            message: 原始消息
+        """
+        request_id = None
+        IN_FLIGHT.inc()
+        try:
+            # 解析收到的消息
+            data = codec.decode(message)
+            msg_type = data.get("type")
+            REQUESTS.labels(msg_type if msg_type in self.known_message_types else "other").inc()
+            log_event(logger, logging.DEBUG, "message_received", type=data.get("type"),
+                      request_id=data.get("request_id"))
+            request_id = data.get("request_id")
+
+            if msg_type == "asr_text" and self.shedder.level >= ShedLevel.REJECT:
+                # 已在处理中的请求继续完成，只拒绝新的请求
+                REJECTED.inc()
+                reply = {
+                    "type": "error",
+                    "code": "overloaded",
+                    "message": "聊天机器人繁忙，请稍后再试",
+                    "retry_after": OVERLOAD_RETRY_AFTER,
+                    "client_id": data.get("client_id", None)
+                }
+                if request_id is not None:
+                    reply["request_id"] = request_id
+                await self._send(websocket, reply)
+                return
+
+            if data.get("stream") and msg_type == "asr_text" and (data.get("text") or "").strip():
+                await self._stream_reply(websocket, data, request_id)
+                return
+
+            # 处理消息
+            reply = await self.handle_message(data)
+            if request_id is not None:
+                reply["request_id"] = request_id
+            log_event(logger, logging.DEBUG, "reply_sent", type=reply.get("type"), request_id=request_id)
+
+            # 发送回复
+            await self._send(websocket, reply)
+
+        except codec.DecodeError as e:
+            logger.error(f"Failed to decode message: {e}")
+            error_reply = {
+                "type": "error",
+                "message": "消息解析失败"
+            }
+            await self._send(websocket, error_reply)
+        except Exception as e:
+            logger.error(f"Error processing message: {e}", exc_info=True)
+            error_reply = {
+                "type": "error",
+                "message": "处理消息时出现错误"
+            }
+            if request_id is not None:
+                error_reply["request_id"] = request_id
+            await self._send(websocket, error_reply)
+        finally:
+            IN_FLIGHT.dec()
+
+    async def _send(self, websocket, message: Dict[str, Any]):
+        """
+        按连接协商的子协议编码并发送消息（msgpack或JSON）
+
+        Args:
+            websocket: WebSocket连接对象
+            message: 消息数据
+        """
+        await websocket.send(codec.wire_for(websocket.subprotocol).dumps(message))
+
+    async def _stream_reply(self, websocket, data: Dict[str, Any], request_id: Optional[str]):
+        """
+        流式回复asr_text：每段文本作为带seq的bot_response_delta立即发送，然后发送完整的bot_response；
+        会说话的服务器最后发送语音合成结果bot_audio
+
+        Args:
+            websocket: WebSocket连接对象
+            data: 消息数据
+            request_id: 请求ID
+        """
+        session_id = data.get("session_id", None)
+        client_id = data.get("client_id", None)
+        log_event(logger, logging.INFO, "asr_text_received", client_id=client_id, session_id=session_id, stream=True)
+
+        seq = 0
+        parts = []
+        async for delta in self.stream_asr_text(data["text"], session_id):
+            parts.append(delta)
+            await self._send(websocket, {
+                "type": "bot_response_delta",
+                "request_id": request_id,
+                "seq": seq,
+                "text": delta,
+                "session_id": session_id,
+                "client_id": client_id
+            })
+            seq += 1
+
+        response_text = "".join(parts) or "我没有理解您的意思，请您换个说法再试一次。"
+        log_event(logger, logging.INFO, "bot_response", client_id=client_id, session_id=session_id,
+                  length=len(response_text), deltas=seq)
+        final = {
+            "type": "bot_response",
+            "request_id": request_id,
+            "seq": seq,
+            "final": True,
+            "text": response_text,
+            "session_id": session_id,
+            "client_id": client_id
+        }
+        if not self.speaks:
+            await self._send(websocket, final)
+            return
+
+        # 先发送最终文本，语音合成完成后用bot_audio帧补发音频文件
+        final["audio_pending"] = True
+        await self._send(websocket, final)
+        audio_file = await self.synthesize(response_text)
+        await self._send(websocket, {
+            "type": "bot_audio",
+            "request_id": request_id,
+            "audio_file": audio_file,
+            "session_id": session_id,
+            "client_id": client_id
+        })
+
+    def run_websocket_server(self, host="localhost", port=8765):
+        """
+        启动WebSocket服务器
+
+        Args:
+            host: 服务器主机地址
+            port: 服务器端口
+        """
+        start_server = websockets.serve(self.websocket_server, host, port,
+                                        process_request=websockets_shedding_handler(
+                                            self.shedder, websockets_metrics_handler()),
+                                        subprotocols=codec.SUBPROTOCOLS)
+        logger.info(f"WebSocket server started on {host}:{port} (metrics at /metrics)")
+        asyncio.get_event_loop().run_until_complete(start_server)
+        self.shedder.start()
+        asyncio.get_event_loop().run_forever()
@@ -0,0 +1,143 @@
+"""
+Per-session conversation memory for the chatbot servers.
+
+Each ``session_id`` (the room, as sent by voice_chat_server.py) gets its
+own history, so concurrent rooms never see each other's turns and
+``reset_session`` only forgets one of them. A turn is kept as a plain
+``(user_text, bot_text)`` tuple; LangChain message objects are only
+built when a prompt is formatted.
+
+The store is bounded three ways: turns per session (older turns drop off
+the front, which also bounds the prompt), sessions in total and UTF-8
+bytes of text in total, both enforced by evicting the least recently
+used session. Sessions idle longer than the TTL are dropped as well.
+"""
+
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Deque, Dict, Hashable, List, Optional, Tuple
+
+# 每个会话保留的轮数
+DEFAULT_MAX_TURNS = 20
+# 同时保留的会话数
+DEFAULT_MAX_SESSIONS = 10000
+# 所有会话文本的总字节数上限
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+# 会话空闲多久后丢弃（秒）
+DEFAULT_IDLE_TTL = 1800.0
+
+Turn = Tuple[str, str]
+
+
+def _turn_size(turn: Turn) -> int:
+    return len(turn[0].encode("utf-8")) + len(turn[1].encode("utf-8"))
+
+
+class SessionHistory:
+    """The turns of one session, oldest first"""
+    __slots__ = ("turns", "size", "last_used")
+
+    def __init__(self, max_turns: int, now: float):
+        self.turns: Deque[Turn] = deque(maxlen=max_turns)
+        self.size = 0
+        self.last_used = now
+
+    def append(self, turn: Turn) -> int:
+        """Add a turn; returns the change in size, counting a turn pushed out by ``max_turns``"""
+        freed = _turn_size(self.turns[0]) if self.turns and len(self.turns) == self.turns.maxlen else 0
+        added = _turn_size(turn)
+        self.turns.append(turn)
+        self.size += added - freed
+        return added - freed
+
+    def pop_oldest(self) -> int:
+        size = _turn_size(self.turns.popleft())
+        self.size -= size
+        return size
+
+
+class ConversationStore:
+    """session_id -> SessionHistory, in least-recently-used order"""
+
+    def __init__(self, max_sessions: int = DEFAULT_MAX_SESSIONS, max_bytes: int = DEFAULT_MAX_BYTES,
+                 idle_ttl: float = DEFAULT_IDLE_TTL, max_turns: int = DEFAULT_MAX_TURNS,
+                 clock: Callable[[], float] = time.monotonic):
+        # 至少保留一轮：maxlen为0的deque放不下任何轮次
+        if max_turns < 1:
+            raise ValueError(f"max_turns must be at least 1, got {max_turns}")
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self.max_turns = max_turns
+        self.clock = clock
+        self.sessions: "OrderedDict[Hashable, SessionHistory]" = OrderedDict()
+        self.bytes = 0
+        # 按原因统计的淘汰次数：lru、bytes、ttl
+        self.evictions: Dict[str, int] = {"lru": 0, "bytes": 0, "ttl": 0}
+
+    def __len__(self) -> int:
+        return len(self.sessions)
+
+    def turns(self, session_id: Optional[str]) -> List[Turn]:
+        """The session's turns, oldest first; marks the session as recently used"""
+        now = self.clock()
+        self._expire(now)
+        history = self.sessions.get(session_id)
+        if history is None:
+            return []
+        history.last_used = now
+        self.sessions.move_to_end(session_id)
+        return list(history.turns)
+
+    def append(self, session_id: Optional[str], user_text: str, bot_text: str):
+        """Record one exchange, then evict until the store is within its limits again"""
+        now = self.clock()
+        self._expire(now)
+        history = self.sessions.get(session_id)
+        if history is None:
+            history = self.sessions[session_id] = SessionHistory(self.max_turns, now)
+        else:
+            history.last_used = now
+            self.sessions.move_to_end(session_id)
+        self.bytes += history.append((user_text, bot_text))
+
+        while len(self.sessions) > self.max_sessions:
+            self._evict("lru")
+        while self.bytes > self.max_bytes and len(self.sessions) > 1:
+            self._evict("bytes")
+        # 只剩当前会话仍超出上限时，丢弃它最早的轮次
+        while self.bytes > self.max_bytes and history.turns:
+            self.bytes -= history.pop_oldest()
+
+    def clear(self, session_id: Optional[str]) -> bool:
+        """Forget one session; returns whether it had any history"""
+        history = self.sessions.pop(session_id, None)
+        if history is None:
+            return False
+        self.bytes -= history.size
+        return True
+
+    def _evict(self, reason: str):
+        _, history = self.sessions.popitem(last=False)
+        self.bytes -= history.size
+        self.evictions[reason] += 1
+
+    def _expire(self, now: float):
+        # 会话按最近使用排序，从头部开始只需检查到第一个未过期的会话
+        deadline = now - self.idle_ttl
+        while self.sessions:
+            history = next(iter(self.sessions.values()))
+            if history.last_used > deadline:
+                break
+            self._evict("ttl")
+
+
+def from_env() -> ConversationStore:
+    """Store configured from CHATBOT_MEMORY_SESSIONS, CHATBOT_MEMORY_BYTES, CHATBOT_MEMORY_TTL and CHATBOT_MEMORY_TURNS"""
+    return ConversationStore(
+        max_sessions=int(os.getenv("CHATBOT_MEMORY_SESSIONS", str(DEFAULT_MAX_SESSIONS))),
+        max_bytes=int(os.getenv("CHATBOT_MEMORY_BYTES", str(DEFAULT_MAX_BYTES))),
+        idle_ttl=float(os.getenv("CHATBOT_MEMORY_TTL", str(DEFAULT_IDLE_TTL))),
+        max_turns=int(os.getenv("CHATBOT_MEMORY_TURNS", str(DEFAULT_MAX_TURNS))),
+    )
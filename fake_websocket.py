@@ -0,0 +1,74 @@
+"""
+Fake FastAPI WebSocket shared by the signaling tests.
+"""
+
+import json
+import asyncio
+
+try:
+    import msgpack
+except ImportError:  # msgpack是可选依赖
+    msgpack = None
+
+
+class RecordingWebSocket:
+    """Fake FastAPI WebSocket that records what the server sends, optionally stalling on every send"""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.subprotocol = None
+        self.sent = []
+        self.close_code = None
+
+    async def accept(self, subprotocol=None):
+        self.subprotocol = subprotocol
+
+    async def send_text(self, data: str):
+        await asyncio.sleep(self.delay)
+        self.sent.append(data)
+
+    async def send_bytes(self, data: bytes):
+        await asyncio.sleep(self.delay)
+        self.sent.append(data)
+
+    async def close(self, code: int = 1000):
+        self.close_code = code
+
+    @property
+    def frames(self):
+        """Decoded frames with their kind: ("text", record) or ("bytes", record)"""
+        return [("text", json.loads(data)) if isinstance(data, str) else ("bytes", msgpack.unpackb(data))
+                for data in self.sent]
+
+    @property
+    def received(self):
+        """Decoded frames in the order they were sent"""
+        return [message for _, message in self.frames]
+
+    def of_type(self, msg_type: str):
+        return [m for m in self.received if m["type"] == msg_type]
+
+
+class ScriptedWebSocket(RecordingWebSocket):
+    """RecordingWebSocket the test feeds client frames into; with ``pong`` it answers pings like the browser client"""
+
+    def __init__(self, pong: bool = False):
+        super().__init__()
+        self.scope = {}
+        self.pong = pong
+        self.inbox: asyncio.Queue = asyncio.Queue()
+
+    def push(self, message: dict):
+        self.inbox.put_nowait({"type": "websocket.receive", "text": json.dumps(message)})
+
+    async def receive(self) -> dict:
+        return await self.inbox.get()
+
+    async def send_text(self, data: str):
+        await super().send_text(data)
+        if self.pong and json.loads(data)["type"] == "ping":
+            self.push({"type": "pong"})
+
+    async def close(self, code: int = 1000):
+        await super().close(code)
+        self.inbox.put_nowait({"type": "websocket.disconnect", "code": code})
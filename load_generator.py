@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Load generator for voice_chat_server.py.
+
+Simulates many signaling clients spread over rooms, with join/leave
+churn, targeted offer/answer exchanges, ICE-candidate bursts and
+``asr_text`` requests, against a real server. A local stand-in chatbot
+answers ``asr_text`` (streamed deltas, then the final reply) after a
+configurable delay, so the numbers measure the signaling server rather
+than an LLM.
+
+End-to-end latency is measured from the moment a client sends a message
+(or starts joining/leaving) to the moment the recipient receives it; all
+simulated clients share this process's clock. Reported per message type
+as p50/p95/p99, together with connection throughput and error frames.
+
+Typical runs:
+
+    # start the server with the stand-in chatbot on a free port (1 worker)
+    python load_generator.py --spawn-server --rooms 200 --room-size 5 --duration 30
+
+    # against a server you started yourself, pointed at CHATBOT_URI=ws://localhost:8766
+    python load_generator.py --url ws://localhost:8001 --chatbot-port 8766
+
+Rate limits and connection caps of the server apply (see ASR_RATE_* and
+MAX_CONNECTIONS); rejected requests show up under "errors".
+"""
+
+import os
+import sys
+import time
+import random
+import socket
+import asyncio
+import logging
+import argparse
+import subprocess
+from collections import Counter, defaultdict, deque
+from typing import Dict, List, Optional
+
+import websockets
+
+import signaling_codec as codec
+
+logger = logging.getLogger("load_generator")
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+SDP_STAMP = "a=x-load-sent:"
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))] * 1000 if ordered else 0.0
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def raise_fd_limit():
+    """Thousands of sockets need more than the usual 1024 descriptors"""
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+
+class LoadStats:
+    """Latency samples per message type, connection counters and error frames"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Counter = Counter()
+        self.connects = 0
+        self.connect_failures = 0
+
+    def observe(self, msg_type: str, seconds: float):
+        self.latencies[msg_type].append(seconds)
+
+    def report(self, elapsed: float, ramp_seconds: float, initial_clients: int):
+        print(f"Connections: {initial_clients:,} opened in {ramp_seconds:.2f}s "
+              f"({initial_clients / ramp_seconds if ramp_seconds else 0:,.0f}/s), "
+              f"{self.connects:,} total, {self.connect_failures:,} failed")
+        print(f"Test phase: {elapsed:.1f}s")
+        print("=" * 78)
+        print(f"{'message type':<22} {'count':>9} {'p50 (ms)':>10} {'p95 (ms)':>10} {'p99 (ms)':>10} {'max (ms)':>10}")
+        for msg_type in sorted(self.latencies):
+            values = self.latencies[msg_type]
+            print(f"{msg_type:<22} {len(values):>9,} {percentile(values, 0.5):>10.2f} {percentile(values, 0.95):>10.2f} "
+                  f"{percentile(values, 0.99):>10.2f} {max(values) * 1000:>10.2f}")
+        if self.errors:
+            print("errors: " + ", ".join(f"{code}={count}" for code, count in self.errors.most_common()))
+
+
+class StandInChatbot:
+    """Answers asr_text like the real chatbot servers, after a fixed delay"""
+
+    def __init__(self, delay: float, deltas: int):
+        self.delay = delay
+        self.deltas = deltas
+        self.requests = 0
+
+    async def handler(self, websocket, path=None):
+        try:
+            async for raw in websocket:
+                asyncio.create_task(self._reply(websocket, codec.decode(raw)))
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    async def _reply(self, websocket, data: dict):
+        self.requests += 1
+        wire = codec.wire_for(websocket.subprotocol)
+        reply = {"request_id": data.get("request_id"), "session_id": data.get("session_id"),
+                 "client_id": data.get("client_id")}
+        try:
+            if data.get("stream"):
+                for seq in range(self.deltas):
+                    await asyncio.sleep(self.delay / (self.deltas + 1))
+                    await websocket.send(wire.dumps(dict(reply, type="bot_response_delta", seq=seq, text="好的，")))
+                await asyncio.sleep(self.delay / (self.deltas + 1))
+                await websocket.send(wire.dumps(dict(reply, type="bot_response", seq=self.deltas, final=True,
+                                                     text="好的，" * self.deltas)))
+            else:
+                await asyncio.sleep(self.delay)
+                await websocket.send(wire.dumps(dict(reply, type="bot_response", text="好的")))
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+
+class SimulatedClient:
+    """One signaling client: joins a room, negotiates with peers and records what it receives"""
+
+    def __init__(self, generator: "LoadGenerator", client_id: str, room_id: str):
+        self.generator = generator
+        self.client_id = client_id
+        self.room_id = room_id
+        self.ws = None
+        self.wire = codec.JSON
+        self.peers: set = set()
+        self.pending_users: deque = deque()
+        self.pending_asr: deque = deque()
+        self.first_delta_seen = False
+        self._reader: Optional[asyncio.Task] = None
+
+    async def connect(self) -> bool:
+        stats = self.generator.stats
+        self.generator.join_started[self.client_id] = time.perf_counter()
+        subprotocols = codec.SUBPROTOCOLS if self.generator.args.msgpack else None
+        start = time.perf_counter()
+        try:
+            self.ws = await websockets.connect(f"{self.generator.args.url}/ws/{self.client_id}/{self.room_id}",
+                                               subprotocols=subprotocols, max_queue=None, open_timeout=30)
+        except Exception as e:
+            stats.connect_failures += 1
+            stats.errors[f"connect:{type(e).__name__}"] += 1
+            return False
+        stats.connects += 1
+        stats.observe("connect", time.perf_counter() - start)
+        self.wire = codec.wire_for(self.ws.subprotocol)
+        self._reader = asyncio.create_task(self._read_loop())
+        self.pending_users.append(time.perf_counter())
+        await self.send({"type": "get_users"})
+        return True
+
+    async def send(self, message: dict):
+        try:
+            await self.ws.send(self.wire.dumps(message))
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    async def close(self):
+        self.generator.leave_started[self.client_id] = time.perf_counter()
+        if self.ws is not None:
+            await self.ws.close()
+        if self._reader is not None:
+            self._reader.cancel()
+
+    async def send_ice_burst(self, count: int):
+        if not self.peers:
+            return
+        target = random.choice(sorted(self.peers))
+        for n in range(count):
+            await self.send({
+                "type": "ice_candidate",
+                "target": target,
+                "candidate": {
+                    "candidate": f"candidate:{n} 1 udp 2122260223 10.0.{n % 250}.{len(self.peers)} {50000 + n} typ host",
+                    "sdpMid": "0",
+                    "sdpMLineIndex": 0,
+                    "sent_at": time.perf_counter()
+                }
+            })
+
+    async def send_asr_text(self):
+        self.pending_asr.append(time.perf_counter())
+        self.first_delta_seen = False
+        await self.send({"type": "asr_text", "text": "今天天气怎么样？"})
+
+    async def _read_loop(self):
+        try:
+            async for raw in self.ws:
+                message = codec.decode(raw)
+                if message.get("type") == "batch":
+                    for item in message["messages"]:
+                        await self._handle(item)
+                else:
+                    await self._handle(message)
+        except (websockets.exceptions.ConnectionClosed, asyncio.CancelledError):
+            pass
+        except Exception as e:
+            logger.error(f"Client {self.client_id} reader failed: {e}", exc_info=True)
+
+    async def _handle(self, message: dict):
+        stats = self.generator.stats
+        now = time.perf_counter()
+        msg_type = message.get("type")
+
+        if msg_type == "users_list":
+            if self.pending_users:
+                stats.observe("users_list", now - self.pending_users.popleft())
+            # 新成员向房间里已有的每个成员发送定向offer
+            for peer in message.get("users", []):
+                if peer != self.client_id and peer not in self.peers:
+                    self.peers.add(peer)
+                    await self.send({"type": "offer", "target": peer, "sdp": f"v=0\r\n{SDP_STAMP}{time.perf_counter()!r}\r\n"})
+        elif msg_type == "user_joined":
+            self.peers.add(message["client_id"])
+            started = self.generator.join_started.get(message["client_id"])
+            if started is not None:
+                stats.observe("user_joined", now - started)
+        elif msg_type == "user_left":
+            self.peers.discard(message["client_id"])
+            started = self.generator.leave_started.get(message["client_id"])
+            if started is not None:
+                stats.observe("user_left", now - started)
+        elif msg_type in ("offer", "answer"):
+            sdp = message.get("sdp") or ""
+            if SDP_STAMP in sdp:
+                stats.observe(msg_type, now - float(sdp.split(SDP_STAMP, 1)[1].split("\r\n", 1)[0]))
+            if msg_type == "offer":
+                self.peers.add(message["sender"])
+                await self.send({"type": "answer", "target": message["sender"],
+                                 "sdp": f"v=0\r\n{SDP_STAMP}{time.perf_counter()!r}\r\n"})
+        elif msg_type == "ice_candidate":
+            sent_at = (message.get("candidate") or {}).get("sent_at")
+            if sent_at is not None:
+                stats.observe("ice_candidate", now - sent_at)
+        elif msg_type == "bot_response_delta":
+            if message.get("client_id") == self.client_id and self.pending_asr and not self.first_delta_seen:
+                self.first_delta_seen = True
+                stats.observe("bot_response_delta", now - self.pending_asr[0])
+        elif msg_type == "bot_response":
+            if message.get("client_id") == self.client_id and self.pending_asr:
+                stats.observe("bot_response", now - self.pending_asr.popleft())
+                self.first_delta_seen = False
+        elif msg_type == "ping":
+            await self.send({"type": "pong"})
+        elif msg_type == "error":
+            stats.errors[message.get("code") or "error"] += 1
+            if self.pending_asr:
+                # 被拒绝或失败的asr_text请求不会再有回复
+                self.pending_asr.popleft()
+
+
+class LoadGenerator:
+    """Drives the scenario: ramp-up, steady traffic with churn, teardown, report"""
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.stats = LoadStats()
+        self.rooms: Dict[str, List[SimulatedClient]] = {}
+        self.join_started: Dict[str, float] = {}
+        self.leave_started: Dict[str, float] = {}
+        self._next_client = 0
+        self._running = True
+
+    def _new_client(self, room_id: str) -> SimulatedClient:
+        self._next_client += 1
+        return SimulatedClient(self, f"load_{self._next_client}", room_id)
+
+    async def ramp_up(self) -> float:
+        """Open every initial connection with ``concurrency`` handshakes in flight"""
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+
+        async def join(client: SimulatedClient):
+            async with semaphore:
+                if await client.connect():
+                    self.rooms[client.room_id].append(client)
+
+        clients = []
+        for r in range(self.args.rooms):
+            room_id = f"load_room_{r}"
+            self.rooms[room_id] = []
+            clients.extend(self._new_client(room_id) for _ in range(self.args.room_size))
+        start = time.perf_counter()
+        await asyncio.gather(*[join(client) for client in clients])
+        return time.perf_counter() - start
+
+    async def _ice_loop(self, client: SimulatedClient):
+        while self._running and self.args.ice_interval > 0:
+            await asyncio.sleep(random.expovariate(1 / self.args.ice_interval))
+            if self._running:
+                await client.send_ice_burst(self.args.ice_burst)
+
+    async def _asr_loop(self, room_id: str):
+        while self._running and self.args.asr_rate > 0:
+            await asyncio.sleep(random.expovariate(self.args.asr_rate))
+            members = self.rooms[room_id]
+            if self._running and members:
+                await random.choice(members).send_asr_text()
+
+    async def _churn_loop(self):
+        """Replace a random member with a new client, ``churn`` times per second overall"""
+        tasks = set()
+        while self._running and self.args.churn > 0:
+            await asyncio.sleep(random.expovariate(self.args.churn))
+            room_id = random.choice(list(self.rooms))
+            members = self.rooms[room_id]
+            if not members:
+                continue
+            leaving = members.pop(random.randrange(len(members)))
+            await leaving.close()
+            joining = self._new_client(room_id)
+            if await joining.connect():
+                members.append(joining)
+                task = asyncio.create_task(self._ice_loop(joining))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        for task in tasks:
+            task.cancel()
+
+    async def run(self):
+        ramp_seconds = await self.ramp_up()
+        initial = self.stats.connects
+        # 让加入阶段的offer/answer交换完成后再开始稳态流量
+        await asyncio.sleep(1)
+
+        start = time.perf_counter()
+        tasks = [asyncio.create_task(self._ice_loop(client)) for members in self.rooms.values() for client in members]
+        tasks += [asyncio.create_task(self._asr_loop(room_id)) for room_id in self.rooms]
+        tasks.append(asyncio.create_task(self._churn_loop()))
+        await asyncio.sleep(self.args.duration)
+        self._running = False
+        # 等待还在路上的回复
+        await asyncio.sleep(self.args.chatbot_delay + 1)
+        elapsed = time.perf_counter() - start
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        clients = [client for members in self.rooms.values() for client in members]
+        await asyncio.gather(*[client.close() for client in clients], return_exceptions=True)
+        self.stats.report(elapsed, ramp_seconds, initial)
+
+
+def spawn_server(args: argparse.Namespace, port: int) -> subprocess.Popen:
+    env = dict(os.environ, PYTHONPATH=REPO_DIR, CHATBOT_URI=f"ws://localhost:{args.chatbot_port}")
+    command = [sys.executable, os.path.join(REPO_DIR, "serve_voice_chat.py"), "--host", "127.0.0.1",
+               "--port", str(port), "--workers", str(args.workers)]
+    if args.workers > 1:
+        command += ["--with-broker", "--broker-port", str(free_port())]
+    process = subprocess.Popen(command, cwd=args.server_dir, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 20
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("voice chat server did not start")
+
+
+async def main(args: argparse.Namespace):
+    raise_fd_limit()
+    chatbot = StandInChatbot(args.chatbot_delay, args.chatbot_deltas)
+    server = None
+    async with websockets.serve(chatbot.handler, "localhost", args.chatbot_port, subprotocols=codec.SUBPROTOCOLS):
+        if args.spawn_server:
+            port = free_port()
+            args.url = f"ws://127.0.0.1:{port}"
+            server = await asyncio.to_thread(spawn_server, args, port)
+        try:
+            print(f"{args.rooms} rooms x {args.room_size} clients against {args.url} "
+                  f"({'msgpack' if args.msgpack else 'json'}), {args.duration:.0f}s: ICE bursts of {args.ice_burst} "
+                  f"every ~{args.ice_interval:.0f}s per client, {args.asr_rate} asr_text/s per room, "
+                  f"{args.churn} joins+leaves/s")
+            await LoadGenerator(args).run()
+            print(f"stand-in chatbot handled {chatbot.requests:,} requests")
+        finally:
+            if server is not None:
+                server.terminate()
+                await asyncio.to_thread(server.wait, 10)
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Simulate signaling clients and chatbot users against voice_chat_server")
+    parser.add_argument("--url", default="ws://localhost:8001", help="signaling server base URL")
+    parser.add_argument("--spawn-server", action="store_true", help="start serve_voice_chat.py on a free port")
+    parser.add_argument("--workers", type=int, default=1, help="workers for --spawn-server")
+    parser.add_argument("--server-dir", default=os.getcwd(), help="working directory (log files) for --spawn-server")
+    parser.add_argument("--rooms", type=int, default=100)
+    parser.add_argument("--room-size", type=int, default=5)
+    parser.add_argument("--duration", type=float, default=30, help="seconds of steady traffic after ramp-up")
+    parser.add_argument("--concurrency", type=int, default=100, help="handshakes in flight during ramp-up")
+    parser.add_argument("--churn", type=float, default=5, help="member replacements (leave + join) per second")
+    parser.add_argument("--ice-burst", type=int, default=8, help="candidates per ICE burst")
+    parser.add_argument("--ice-interval", type=float, default=10, help="mean seconds between bursts per client")
+    parser.add_argument("--asr-rate", type=float, default=0.2, help="asr_text requests per second per room")
+    parser.add_argument("--msgpack", action="store_true", help="offer the voicechat.msgpack subprotocol")
+    parser.add_argument("--chatbot-port", type=int, default=8766)
+    parser.add_argument("--chatbot-delay", type=float, default=0.3, help="stand-in chatbot reply time")
+    parser.add_argument("--chatbot-deltas", type=int, default=3, help="streamed deltas before the final reply")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(main(parse_args()))
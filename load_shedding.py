@@ -0,0 +1,164 @@
+"""
+Event-loop-lag driven load shedding.
+
+A monitor task sleeps for a fixed interval and measures how late it
+wakes up: that lag is how long every ready callback (signaling frames,
+audio chunks, chatbot replies) currently waits for the loop. The shedder
+maps the lag onto tiers, each with its own enter and exit threshold:
+
+    defer   low-priority work (get_users/presence replies, heartbeat sweeps)
+            waits until the loop catches up
+    reject  new asr_text requests are refused with an ``overloaded`` error
+    refuse  new connections are refused; established ones keep working
+
+A tier is entered when the lag reaches its enter threshold and left only
+after the lag has stayed below its exit threshold and the level has been
+held for ``hold`` seconds, so a loop hovering around a threshold does
+not flap. Tiers are configured as ``name=enter:exit`` in seconds, e.g.
+``defer=0.1:0.05,reject=0.25:0.1,refuse=0.5:0.2``.
+"""
+
+import os
+import asyncio
+import logging
+from enum import IntEnum
+from http import HTTPStatus
+from typing import Awaitable, Callable, Dict, Hashable, List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIERS = "defer=0.1:0.05,reject=0.25:0.1,refuse=0.5:0.2"
+# 采样间隔（秒）
+DEFAULT_INTERVAL = 0.1
+# 进入某一级后至少保持的时间（秒）
+DEFAULT_HOLD = 1.0
+# 过载时建议客户端的重试间隔（秒）
+OVERLOAD_RETRY_AFTER = 2.0
+
+
+class ShedLevel(IntEnum):
+    NORMAL = 0
+    DEFER = 1
+    REJECT = 2
+    REFUSE = 3
+
+
+class Tier(NamedTuple):
+    level: ShedLevel
+    enter: float
+    exit: float
+
+
+def parse_tiers(spec: str) -> List[Tier]:
+    """Parse ``name=enter:exit,...``; a tier left out is never entered"""
+    tiers = []
+    for item in spec.split(","):
+        name, _, thresholds = item.strip().partition("=")
+        if not name:
+            continue
+        enter, _, exit_ = thresholds.partition(":")
+        enter = float(enter)
+        exit_ = float(exit_) if exit_ else enter / 2
+        if exit_ > enter:
+            raise ValueError(f"load shedding tier {name}: exit threshold {exit_} above enter threshold {enter}")
+        tiers.append(Tier(ShedLevel[name.strip().upper()], enter, exit_))
+    return sorted(tiers)
+
+
+class LoadShedder:
+    """Event loop lag monitor and the shedding level derived from it"""
+
+    def __init__(self, tiers: List[Tier], interval: float = DEFAULT_INTERVAL, hold: float = DEFAULT_HOLD):
+        self.tiers = {tier.level: tier for tier in tiers}
+        self.interval = interval
+        self.hold = hold
+        self.level = ShedLevel.NORMAL
+        self.lag = 0.0
+        self.transitions = 0
+        self._changed_at = 0.0
+        # 推迟执行的低优先级任务，同一个key只保留最新的一个
+        self._deferred: Dict[Hashable, Callable[[], Awaitable]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def deferred(self) -> int:
+        return len(self._deferred)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_event_loop().create_task(self._monitor())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _monitor(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            now = loop.time()
+            self.update(max(0.0, now - start - self.interval), now)
+
+    def update(self, lag: float, now: float) -> ShedLevel:
+        """Feed one lag sample; returns the (possibly new) level"""
+        self.lag = lag
+        target = ShedLevel.NORMAL
+        for level, tier in self.tiers.items():
+            if lag >= tier.enter:
+                target = max(target, level)
+        level = self.level
+        if target > level:
+            level = target
+        elif target < level and lag < self.tiers[level].exit and now - self._changed_at >= self.hold:
+            # 延迟回落到退出阈值以下并保持足够时间后，一次只降一级
+            level = max((t for t in self.tiers if t < level), default=ShedLevel.NORMAL)
+        if level != self.level:
+            logger.warning(f"Load shedding level {self.level.name} -> {level.name} (event loop lag {lag * 1000:.0f} ms)")
+            self.level = level
+            self._changed_at = now
+            self.transitions += 1
+            if level < ShedLevel.DEFER:
+                self._flush_deferred()
+        return self.level
+
+    def defer(self, key: Hashable, callback: Callable[[], Awaitable]):
+        """Run ``callback`` once the level drops below the defer tier; a later call with the same key replaces it"""
+        if self.level < ShedLevel.DEFER:
+            asyncio.create_task(callback())
+            return
+        self._deferred.pop(key, None)
+        self._deferred[key] = callback
+
+    def _flush_deferred(self):
+        deferred, self._deferred = self._deferred, {}
+        for callback in deferred.values():
+            asyncio.create_task(callback())
+
+
+def from_env() -> LoadShedder:
+    """Shedder configured from LOAD_SHED_TIERS, LOOP_LAG_INTERVAL and LOAD_SHED_HOLD"""
+    return LoadShedder(
+        parse_tiers(os.getenv("LOAD_SHED_TIERS", DEFAULT_TIERS)),
+        interval=float(os.getenv("LOOP_LAG_INTERVAL", str(DEFAULT_INTERVAL))),
+        hold=float(os.getenv("LOAD_SHED_HOLD", str(DEFAULT_HOLD))),
+    )
+
+
+def websockets_shedding_handler(shedder: LoadShedder, process_request=None):
+    """
+    ``process_request`` hook for ``websockets.serve`` (legacy API) that
+    refuses new WebSocket connections with 503 at the refuse tier. Requests
+    answered by ``process_request`` (e.g. the metrics page) still go through.
+    """
+    async def handler(request_path: str, request_headers):
+        if process_request is not None:
+            response = await process_request(request_path, request_headers)
+            if response is not None:
+                return response
+        if shedder.level >= ShedLevel.REFUSE:
+            return (HTTPStatus.SERVICE_UNAVAILABLE, [("Retry-After", str(int(OVERLOAD_RETRY_AFTER)))],
+                    b"overloaded, retry later\n")
+        return None
+    return handler
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Local pub/sub broker stand-in for running several voice chat server workers on one machine.
+
+Speaks newline-delimited JSON over TCP. Requests carry an ``id`` and get
+a reply with the same ``id`` (a null ``id`` means no reply is wanted);
+published messages are pushed to subscribers as
+``{"channel": ..., "data": ...}``.
+
+    {"id": 1, "op": "sub", "channel": "room:r1"}
+    {"id": 2, "op": "unsub", "channel": "room:r1"}
+    {"id": 3, "op": "pub", "channel": "room:r1", "data": "..."}
+    {"id": 4, "op": "sadd", "key": "members:r1", "member": "client_1"}
+    {"id": 5, "op": "srem", "key": "members:r1", "member": "client_1"}
+    {"id": 6, "op": "smembers", "key": "members:r1"}
+    {"id": 7, "op": "sdelta", "key": "members:r1", "since": 1730000000000123}
+
+Sets are versioned (see presence.py): ``sdelta`` answers with the
+members added and removed since a version, or the full set.
+
+Set members added by a connection are removed when that connection
+drops, so a crashed worker does not leave ghost room members behind.
+
+Usage: python local_broker.py [--host localhost] [--port 8790]
+"""
+
+import asyncio
+import argparse
+import logging
+from typing import Dict, Set, Tuple
+
+import signaling_codec as codec
+from presence import VersionedMembers
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BROKER_PORT = 8790
+
+
+class LocalBroker:
+    """In-process pub/sub and set store shared by all connected workers"""
+
+    def __init__(self):
+        self.subscribers: Dict[str, Set[asyncio.StreamWriter]] = {}
+        self.sets: Dict[str, VersionedMembers] = {}
+        self._owned: Dict[asyncio.StreamWriter, Set[Tuple[str, str]]] = {}
+        self._server = None
+
+    async def start(self, host: str = "localhost", port: int = DEFAULT_BROKER_PORT):
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        logger.info(f"Local broker listening on {host}:{self.port}")
+        return self._server
+
+    @property
+    def port(self) -> int:
+        return self._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for writer in list(self._owned):
+            writer.close()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._owned[writer] = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                request = codec.loads(line)
+                result = self._execute(writer, request)
+                if request.get("id") is not None:
+                    writer.write(codec.dumps({"id": request["id"], "result": result}).encode() + b"\n")
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            logger.error(f"Broker connection error: {e}", exc_info=True)
+        finally:
+            self._drop_connection(writer)
+            writer.close()
+
+    def _execute(self, writer: asyncio.StreamWriter, request: dict):
+        op = request.get("op")
+        if op == "sub":
+            self.subscribers.setdefault(request["channel"], set()).add(writer)
+        elif op == "unsub":
+            self._unsubscribe(request["channel"], writer)
+        elif op == "pub":
+            frame = codec.dumps({"channel": request["channel"], "data": request["data"]}).encode() + b"\n"
+            receivers = self.subscribers.get(request["channel"], ())
+            for subscriber in receivers:
+                subscriber.write(frame)
+            return len(receivers)
+        elif op == "sadd":
+            members = self.sets.get(request["key"])
+            if members is None:
+                members = self.sets[request["key"]] = VersionedMembers()
+            members.add(request["member"])
+            self._owned[writer].add((request["key"], request["member"]))
+        elif op == "srem":
+            self._srem(request["key"], request["member"])
+            self._owned[writer].discard((request["key"], request["member"]))
+        elif op == "smembers":
+            members = self.sets.get(request["key"])
+            return list(members.members) if members is not None else []
+        elif op == "sdelta":
+            members = self.sets.get(request["key"])
+            if members is None:
+                return {"version": None, "members": []}
+            return members.since(request.get("since"))._asdict()
+        else:
+            return {"error": f"unknown op {op}"}
+        return None
+
+    def _unsubscribe(self, channel: str, writer: asyncio.StreamWriter):
+        subscribers = self.subscribers.get(channel)
+        if subscribers is not None:
+            subscribers.discard(writer)
+            if not subscribers:
+                del self.subscribers[channel]
+
+    def _srem(self, key: str, member: str):
+        members = self.sets.get(key)
+        if members is not None:
+            members.discard(member)
+            if not members.members:
+                del self.sets[key]
+
+    def _drop_connection(self, writer: asyncio.StreamWriter):
+        for channel in [c for c, subs in self.subscribers.items() if writer in subs]:
+            self._unsubscribe(channel, writer)
+        for key, member in self._owned.pop(writer, ()):
+            self._srem(key, member)
+
+
+async def main(host: str, port: int):
+    broker = LocalBroker()
+    server = await broker.start(host, port)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Local pub/sub broker for multi-worker voice chat servers")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=DEFAULT_BROKER_PORT)
+    args = parser.parse_args()
+    asyncio.run(main(args.host, args.port))
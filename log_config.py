@@ -0,0 +1,132 @@
+"""
+Asynchronous, structured logging shared by the voice chat and chatbot servers.
+
+Handlers run on a background QueueListener thread: the event loop only
+puts the LogRecord on a queue, and message formatting, rotation and disk
+I/O all happen off the loop. Records may carry structured fields
+(``log_event``), rendered as ``key=value`` pairs with long values
+truncated so SDP blobs and full LLM replies never hit the log verbatim.
+
+``MessageLogPolicy`` assigns a level to each signaling message type and
+samples high-frequency types such as ``ice_candidate``.
+"""
+
+import os
+import queue
+import atexit
+import logging
+import logging.handlers
+from typing import Any, Dict, Optional, Tuple
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+MAX_FIELD_CHARS = 120
+
+
+class StructuredFormatter(logging.Formatter):
+    """Appends ``key=value`` fields passed via ``extra={"fields": ...}``"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{key}={_shorten(value)}" for key, value in fields.items())
+        return line
+
+
+def _shorten(value: Any) -> str:
+    text = value if isinstance(value, str) else repr(value)
+    if len(text) > MAX_FIELD_CHARS:
+        return f"{text[:MAX_FIELD_CHARS]!r}...(+{len(text) - MAX_FIELD_CHARS} chars)"
+    return repr(text) if " " in text else text
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def setup_logging(log_file: Optional[str], level: Optional[str] = None,
+                  max_bytes: Optional[int] = None, backup_count: Optional[int] = None) -> logging.handlers.QueueListener:
+    """
+    Route the root logger through a queue to a size-capped rotating file and stderr.
+
+    Without ``log_file`` records only go to stderr. The rotating file is
+    not safe to share between processes: give each process its own file.
+    Defaults come from LOG_LEVEL, LOG_MAX_BYTES (10 MB) and LOG_BACKUP_COUNT (5).
+    """
+    level = level or os.getenv("LOG_LEVEL", "INFO")
+    max_bytes = max_bytes if max_bytes is not None else int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+    backup_count = backup_count if backup_count is not None else int(os.getenv("LOG_BACKUP_COUNT", "5"))
+
+    formatter = StructuredFormatter(LOG_FORMAT)
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        handlers.append(logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"
+        ))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_DeferredQueueHandler(log_queue))
+    root.setLevel(level)
+
+    listener.start()
+    atexit.register(stop_logging, listener)
+    return listener
+
+
+def stop_logging(listener: logging.handlers.QueueListener):
+    """Flush queued records and stop the background writer (idempotent)"""
+    if listener._thread is not None:
+        listener.stop()
+
+
+def log_event(logger: logging.Logger, level: int, event: str, **fields):
+    """Log a structured event; nothing is formatted unless the level is enabled"""
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={"fields": fields})
+
+
+class MessageLogPolicy:
+    """
+    Per-message-type log levels with 1-in-N sampling.
+
+    ``rules`` maps a message type to ``(level, sample_every)``; types not
+    listed use ``default``.
+    """
+
+    def __init__(self, rules: Dict[str, Tuple[int, int]], default: Tuple[int, int] = (logging.INFO, 1)):
+        self.rules = dict(rules)
+        self.default = default
+        self._counters: Dict[str, int] = {}
+
+    def level_for(self, msg_type: Optional[str]) -> Optional[int]:
+        """Level to log this message at, or None if it is sampled out"""
+        level, sample_every = self.rules.get(msg_type, self.default)
+        if sample_every > 1:
+            count = self._counters.get(msg_type, 0)
+            self._counters[msg_type] = count + 1
+            if count % sample_every:
+                return None
+        return level
+
+    @classmethod
+    def from_env(cls, defaults: Dict[str, Tuple[int, int]], env_var: str = "LOG_MESSAGE_LEVELS") -> "MessageLogPolicy":
+        """
+        Build a policy from defaults overridden by e.g.
+        ``LOG_MESSAGE_LEVELS="ice_candidate=DEBUG:50,offer=INFO"``.
+        """
+        rules = dict(defaults)
+        for item in filter(None, os.getenv(env_var, "").split(",")):
+            msg_type, _, spec = item.partition("=")
+            level_name, _, sample = spec.partition(":")
+            rules[msg_type.strip()] = (logging.getLevelName(level_name.strip().upper()), int(sample or 1))
+        return cls(rules)
@@ -0,0 +1,207 @@
+"""
+Server-side aiortc media peer that joins rooms as the bot.
+
+Browsers negotiate with the bot like any other room member (offer with
+``target: "bot"``). Incoming Opus tracks are decoded to 16 kHz mono PCM
+and written into the client's ring buffer in ``audio_ingest`` for
+server-side ASR; synthesized bot speech is published back on an
+outgoing audio track paced in real time.
+"""
+
+import time
+import asyncio
+import fractions
+import logging
+from typing import Dict, Optional
+
+import av
+from av.audio.resampler import AudioResampler
+from aiortc import RTCPeerConnection, RTCSessionDescription
+from aiortc.contrib.media import MediaRelay
+from aiortc.mediastreams import MediaStreamError, MediaStreamTrack
+from aiortc.sdp import candidate_from_sdp
+
+from audio_ingest import AudioIngestManager
+
+logger = logging.getLogger(__name__)
+
+ASR_SAMPLE_RATE = 16000
+SPEECH_SAMPLE_RATE = 48000
+SPEECH_FRAME_MS = 20
+
+
+def parse_ice_candidate(candidate: Optional[dict]):
+    """Browser RTCIceCandidate JSON to an aiortc candidate (None for end-of-candidates)"""
+    if not candidate or not candidate.get("candidate"):
+        return None
+    ice = candidate_from_sdp(candidate["candidate"].split(":", 1)[1])
+    ice.sdpMid = candidate.get("sdpMid")
+    ice.sdpMLineIndex = candidate.get("sdpMLineIndex")
+    return ice
+
+
+def decode_audio_file(path: str, sample_rate: int = SPEECH_SAMPLE_RATE) -> bytes:
+    """Decode any audio file to mono s16 PCM at ``sample_rate`` (blocking)"""
+    resampler = AudioResampler(format="s16", layout="mono", rate=sample_rate)
+    pcm = bytearray()
+    with av.open(path) as container:
+        for frame in container.decode(audio=0):
+            for out in resampler.resample(frame):
+                pcm += memoryview(out.planes[0])[:out.samples * 2]
+    for out in resampler.resample(None):
+        pcm += memoryview(out.planes[0])[:out.samples * 2]
+    return bytes(pcm)
+
+
+class BotSpeechTrack(MediaStreamTrack):
+    """
+    Outgoing audio track for synthesized bot speech.
+
+    Emits one 20 ms frame per tick on a wall-clock schedule (silence when
+    nothing is queued), so playback runs at real-time speed regardless of
+    how fast TTS audio is queued.
+    """
+
+    kind = "audio"
+
+    def __init__(self, sample_rate: int = SPEECH_SAMPLE_RATE):
+        super().__init__()
+        self.sample_rate = sample_rate
+        self._samples_per_frame = sample_rate * SPEECH_FRAME_MS // 1000
+        self._frame_bytes = self._samples_per_frame * 2
+        self._time_base = fractions.Fraction(1, sample_rate)
+        self._pending = bytearray()
+        self._start: Optional[float] = None
+        self._timestamp = 0
+
+    def enqueue_pcm(self, pcm: bytes):
+        """Queue mono s16 PCM at the track's sample rate for playback"""
+        self._pending += pcm
+
+    async def recv(self):
+        if self.readyState != "live":
+            raise MediaStreamError
+
+        # 按真实时间节奏输出，每帧20ms
+        if self._start is None:
+            self._start = time.time()
+        else:
+            self._timestamp += self._samples_per_frame
+            wait = self._start + self._timestamp / self.sample_rate - time.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+        chunk = self._pending[:self._frame_bytes]
+        del self._pending[:self._frame_bytes]
+        if len(chunk) < self._frame_bytes:
+            chunk += bytes(self._frame_bytes - len(chunk))
+
+        frame = av.AudioFrame(format="s16", layout="mono", samples=self._samples_per_frame)
+        frame.planes[0].update(bytes(chunk))
+        frame.pts = self._timestamp
+        frame.sample_rate = self.sample_rate
+        frame.time_base = self._time_base
+        return frame
+
+
+class RoomBot:
+    """The bot's presence in one room: its speech track and one peer connection per member"""
+
+    def __init__(self, room_id: str):
+        self.room_id = room_id
+        self.speech = BotSpeechTrack()
+        self.relay = MediaRelay()
+        self.peers: Dict[str, RTCPeerConnection] = {}
+        self.consumers: Dict[str, asyncio.Task] = {}
+
+
+class BotMediaManager:
+    """Answers offers addressed to the bot and bridges media to ASR and TTS"""
+
+    def __init__(self, audio_ingest: AudioIngestManager):
+        self.audio_ingest = audio_ingest
+        self.rooms: Dict[str, RoomBot] = {}
+
+    async def handle_offer(self, room_id: str, client_id: str, sdp: str) -> str:
+        """Accept a client's offer and return the bot's answer SDP"""
+        room = self.rooms.get(room_id)
+        if room is None:
+            room = self.rooms[room_id] = RoomBot(room_id)
+        await self.remove_client(room_id, client_id)
+
+        pc = RTCPeerConnection()
+        room.peers[client_id] = pc
+
+        @pc.on("track")
+        def on_track(track):
+            if track.kind == "audio":
+                room.consumers[client_id] = asyncio.create_task(self._consume(client_id, track))
+
+        @pc.on("connectionstatechange")
+        async def on_connectionstatechange():
+            logger.info(f"Bot media connection to {client_id} in room {room_id}: {pc.connectionState}")
+            if pc.connectionState == "failed" and room.peers.get(client_id) is pc:
+                await self.remove_client(room_id, client_id)
+
+        await pc.setRemoteDescription(RTCSessionDescription(sdp=sdp, type="offer"))
+        # 每个连接订阅同一个房间语音轨道
+        pc.addTrack(room.relay.subscribe(room.speech, buffered=False))
+        answer = await pc.createAnswer()
+        await pc.setLocalDescription(answer)
+        return pc.localDescription.sdp
+
+    async def add_ice_candidate(self, room_id: str, client_id: str, candidate: Optional[dict]):
+        """Apply a trickled browser ICE candidate to the bot's peer connection"""
+        room = self.rooms.get(room_id)
+        pc = room.peers.get(client_id) if room else None
+        ice = parse_ice_candidate(candidate)
+        if pc is None or ice is None:
+            return
+        await pc.addIceCandidate(ice)
+
+    async def speak(self, room_id: str, audio_file: str):
+        """Decode a TTS file and play it to everyone in the room"""
+        room = self.rooms.get(room_id)
+        if room is None or not audio_file:
+            return
+        loop = asyncio.get_running_loop()
+        pcm = await loop.run_in_executor(None, decode_audio_file, audio_file, room.speech.sample_rate)
+        room.speech.enqueue_pcm(pcm)
+
+    async def _consume(self, client_id: str, track):
+        """Decode the client's Opus track into 16 kHz PCM for the recognizer"""
+        resampler = AudioResampler(format="s16", layout="mono", rate=ASR_SAMPLE_RATE)
+        buffer = await self.audio_ingest.open(client_id, ASR_SAMPLE_RATE)
+        try:
+            while True:
+                frame = await track.recv()
+                for out in resampler.resample(frame):
+                    buffer.write(memoryview(out.planes[0])[:out.samples * 2])
+        except MediaStreamError:
+            pass
+        finally:
+            self.audio_ingest.close(client_id, buffer)
+
+    async def remove_client(self, room_id: str, client_id: str):
+        room = self.rooms.get(room_id)
+        if room is None:
+            return
+        consumer = room.consumers.pop(client_id, None)
+        if consumer is not None:
+            consumer.cancel()
+        pc = room.peers.pop(client_id, None)
+        if pc is not None:
+            await pc.close()
+
+    async def close_room(self, room_id: str):
+        room = self.rooms.pop(room_id, None)
+        if room is None:
+            return
+        for consumer in room.consumers.values():
+            consumer.cancel()
+        await asyncio.gather(*[pc.close() for pc in room.peers.values()], return_exceptions=True)
+        room.speech.stop()
+
+    async def close(self):
+        for room_id in list(self.rooms):
+            await self.close_room(room_id)
@@ -0,0 +1,192 @@
+"""
+Server-side aiortc forwarding peer for rooms in relay topology.
+
+In a full mesh every member keeps N-1 peer connections and uploads its
+microphone N-1 times. Above the configured room size the signaling
+server switches the room to relay mode: each member negotiates a single
+connection with the ``relay`` peer, uploads one audio track, and the
+relay forwards every member's track to everyone else through a
+``MediaRelay`` (no decoding or re-encoding of the forwarded media).
+
+New downstream tracks are added by server-initiated renegotiation: the
+relay sends an ``offer`` from ``relay`` and waits for the client's
+``answer`` before touching that connection again. When a member leaves,
+the senders forwarding its track to the others are detached and their
+transceivers stop sending in another renegotiation; ``addTrack`` reuses
+those idle transceivers for the next member instead of growing the SDP.
+"""
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Optional
+
+from aiortc import RTCPeerConnection, RTCRtpSender, RTCSessionDescription
+from aiortc.contrib.media import MediaRelay
+
+from media_peer import parse_ice_candidate
+
+logger = logging.getLogger(__name__)
+
+RENEGOTIATION_TIMEOUT = 10.0
+
+# send_signal(client_id, message): 通过信令通道把消息发给客户端
+SendSignal = Callable[[str, dict], Awaitable[None]]
+
+
+class RelayMember:
+    """One member's connection to the relay: its upstream track and forwarded downstreams"""
+
+    def __init__(self, client_id: str, pc: RTCPeerConnection):
+        self.client_id = client_id
+        self.pc = pc
+        self.upstream = None
+        # 转发给该成员的轨道：来源成员的client_id -> 发送器
+        self.forwarded: Dict[str, RTCRtpSender] = {}
+        self.lock = asyncio.Lock()
+        self.answer: Optional[asyncio.Future] = None
+
+
+class RoomRelay:
+    """Relay state of one room"""
+
+    def __init__(self, room_id: str):
+        self.room_id = room_id
+        self.relay = MediaRelay()
+        self.members: Dict[str, RelayMember] = {}
+
+
+class RelayMediaManager:
+    """Forwards each member's upstream audio to every other member of the room"""
+
+    def __init__(self, send_signal: SendSignal, peer_id: str = "relay"):
+        self.send_signal = send_signal
+        self.peer_id = peer_id
+        self.rooms: Dict[str, RoomRelay] = {}
+
+    async def handle_offer(self, room_id: str, client_id: str, sdp: str) -> str:
+        """Accept a member's upstream offer and return the relay's answer SDP"""
+        room = self.rooms.get(room_id)
+        if room is None:
+            room = self.rooms[room_id] = RoomRelay(room_id)
+        member = room.members.get(client_id)
+        if member is not None and member.pc.signalingState == "stable" and member.answer is None:
+            # 已有连接上的重新协商（例如客户端后来才打开麦克风）
+            return await self._answer(member, sdp)
+        await self.remove_client(room_id, client_id)
+
+        pc = RTCPeerConnection()
+        member = room.members[client_id] = RelayMember(client_id, pc)
+
+        @pc.on("track")
+        def on_track(track):
+            if track.kind == "audio":
+                member.upstream = track
+                asyncio.create_task(self._sync_room(room))
+
+        @pc.on("connectionstatechange")
+        async def on_connectionstatechange():
+            logger.info(f"Relay connection to {client_id} in room {room_id}: {pc.connectionState}")
+            if pc.connectionState == "failed" and room.members.get(client_id) is member:
+                await self.remove_client(room_id, client_id)
+
+        answer_sdp = await self._answer(member, sdp)
+        # 新成员需要收到房间里已有的上行音频
+        asyncio.create_task(self._sync_member(room, member))
+        return answer_sdp
+
+    async def _answer(self, member: RelayMember, sdp: str) -> str:
+        async with member.lock:
+            await member.pc.setRemoteDescription(RTCSessionDescription(sdp=sdp, type="offer"))
+            await member.pc.setLocalDescription(await member.pc.createAnswer())
+            return member.pc.localDescription.sdp
+
+    def handle_answer(self, room_id: str, client_id: str, sdp: str):
+        """Complete a relay-initiated renegotiation"""
+        room = self.rooms.get(room_id)
+        member = room.members.get(client_id) if room else None
+        if member is not None and member.answer is not None and not member.answer.done():
+            member.answer.set_result(sdp)
+
+    async def add_ice_candidate(self, room_id: str, client_id: str, candidate: Optional[dict]):
+        room = self.rooms.get(room_id)
+        member = room.members.get(client_id) if room else None
+        ice = parse_ice_candidate(candidate)
+        if member is not None and ice is not None:
+            await member.pc.addIceCandidate(ice)
+
+    async def _sync_room(self, room: RoomRelay):
+        await asyncio.gather(*[self._sync_member(room, member) for member in list(room.members.values())],
+                             return_exceptions=True)
+
+    async def _sync_member(self, room: RoomRelay, member: RelayMember):
+        """Forward every other member's upstream to ``member``, renegotiating once for all new tracks"""
+        async with member.lock:
+            if room.members.get(member.client_id) is not member:
+                return
+            sources = [other for other in room.members.values()
+                       if other is not member and other.upstream is not None
+                       and other.client_id not in member.forwarded]
+            if not sources:
+                return
+            for source in sources:
+                member.forwarded[source.client_id] = member.pc.addTrack(
+                    room.relay.subscribe(source.upstream, buffered=False))
+            try:
+                await self._renegotiate(room, member)
+            except Exception as e:
+                logger.error(f"Relay renegotiation with {member.client_id} in room {room.room_id} failed: {e}")
+
+    async def _renegotiate(self, room: RoomRelay, member: RelayMember):
+        pc = member.pc
+        await pc.setLocalDescription(await pc.createOffer())
+        member.answer = asyncio.get_running_loop().create_future()
+        try:
+            await self.send_signal(member.client_id, {
+                "type": "offer",
+                "sender": self.peer_id,
+                "sdp": pc.localDescription.sdp
+            })
+            answer_sdp = await asyncio.wait_for(member.answer, RENEGOTIATION_TIMEOUT)
+        finally:
+            member.answer = None
+        await pc.setRemoteDescription(RTCSessionDescription(sdp=answer_sdp, type="answer"))
+        logger.info(f"Relay now forwards {len(member.forwarded)} tracks to {member.client_id} in room {room.room_id}")
+
+    async def remove_client(self, room_id: str, client_id: str):
+        room = self.rooms.get(room_id)
+        if room is None:
+            return
+        member = room.members.pop(client_id, None)
+        if member is not None:
+            await member.pc.close()
+            # 其他成员连接上转发该成员音频的收发器停止发送，留给之后加入的成员复用
+            for other in room.members.values():
+                sender = other.forwarded.pop(client_id, None)
+                if sender is not None:
+                    asyncio.create_task(self._stop_forwarding(room, other, sender))
+
+    async def _stop_forwarding(self, room: RoomRelay, member: RelayMember, sender: RTCRtpSender):
+        """Detach a departed member's track from ``member``'s connection and renegotiate"""
+        async with member.lock:
+            if room.members.get(member.client_id) is not member or member.pc.connectionState == "closed":
+                return
+            if sender.track is not None:
+                sender.track.stop()
+            sender.replaceTrack(None)
+            for transceiver in member.pc.getTransceivers():
+                if transceiver.sender is sender:
+                    transceiver.direction = "recvonly" if "recv" in transceiver.direction else "inactive"
+            try:
+                await self._renegotiate(room, member)
+            except Exception as e:
+                logger.error(f"Relay renegotiation with {member.client_id} in room {room.room_id} failed: {e}")
+
+    async def close_room(self, room_id: str):
+        room = self.rooms.pop(room_id, None)
+        if room is None:
+            return
+        await asyncio.gather(*[member.pc.close() for member in room.members.values()], return_exceptions=True)
+
+    async def close(self):
+        for room_id in list(self.rooms):
+            await self.close_room(room_id)
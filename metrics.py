@@ -0,0 +1,245 @@
+"""
+Minimal metrics registry served in the Prometheus text exposition format.
+
+Both servers run a single asyncio event loop per process, so counters and
+histograms are plain attribute updates with no locks: recording a sample
+is an attribute add (counters) or one bisect over a fixed bucket tuple
+(histograms), a few hundred nanoseconds at most. Gauges for things that
+already exist elsewhere (connection counts, queue depths) are read by
+callbacks at scrape time and cost nothing on the hot path.
+
+    MESSAGES = REGISTRY.counter("signaling_messages_total", "Messages received", ["type"])
+    MESSAGES.labels("offer").inc()
+    RTT = REGISTRY.histogram("chatbot_rtt_seconds", "Chatbot round-trip time")
+    RTT.observe(0.42)
+    REGISTRY.gauge("connections", "Open connections", lambda: len(clients))
+"""
+
+import math
+from bisect import bisect_left
+from http import HTTPStatus
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 默认延迟分桶（秒），覆盖从毫秒级信令到数十秒的LLM+TTS调用
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+
+    def labels(self, *values: str):
+        """Child for one label combination; keep a reference to it on hot paths"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+
+class Counter(_Metric):
+    """Monotonic counter"""
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"
+                for values, child in self._children.items()]
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(_Metric):
+    """Fixed-bucket histogram; ``buckets`` are upper bounds in ascending order"""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for values, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), child.counts):
+                cumulative += count
+                le = 'le="' + _format_value(float(bound)) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+            lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class _GaugeChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+
+class Gauge(_Metric):
+    """
+    Value that goes up and down.
+
+    With ``function`` the gauge is computed at scrape time; it may return a
+    number, or a dict of label tuples to numbers for labeled gauges.
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, function: Optional[Callable] = None,
+                 labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1):
+        self.labels().dec(amount)
+
+    def _samples(self) -> List[str]:
+        if self.function is None:
+            values = {labels: child.value for labels, child in self._children.items()}
+        else:
+            result = self.function()
+            values = result if isinstance(result, dict) else {(): result}
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+                for labels, value in values.items()]
+
+
+class MetricsRegistry:
+    """Named collection of metrics; registering an existing name returns that metric"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric_cls, name: str, *args, **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = metric_cls(name, *args, **kwargs)
+        elif not isinstance(metric, metric_cls):
+            raise ValueError(f"metric {name} already registered as {metric.kind}")
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._register(Counter, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, documentation, labelnames, buckets)
+
+    def gauge(self, name: str, documentation: str, function: Optional[Callable] = None,
+              labelnames: Iterable[str] = ()) -> Gauge:
+        gauge = self._register(Gauge, name, documentation, function, labelnames)
+        if function is not None:
+            # 同名gauge重新注册时以最新的回调为准（例如测试中重建了管理器）
+            gauge.function = function
+        return gauge
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+def websockets_metrics_handler(registry: MetricsRegistry = REGISTRY, path: str = "/metrics"):
+    """
+    ``process_request`` hook for ``websockets.serve`` (legacy API, websockets<12)
+    that answers plain HTTP GETs on ``path`` with the metrics page.
+    """
+    async def process_request(request_path: str, request_headers):
+        if request_path != path:
+            return None
+        body = registry.render().encode()
+        return HTTPStatus.OK, [("Content-Type", CONTENT_TYPE), ("Content-Length", str(len(body)))], body
+    return process_request
@@ -0,0 +1,174 @@
+import asyncio
+import logging
+from enum import Enum
+from typing import List, Optional
+
+import signaling_codec as codec
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH_SIZE = 64
+
+
+class OverflowPolicy(str, Enum):
+    """What to do when a client's outbound queue is full"""
+    DROP_OLDEST = "drop_oldest"
+    DISCONNECT = "disconnect"
+    BLOCK = "block"
+
+
+class OutboundQueue:
+    """
+    Bounded per-connection send queue drained by its own writer task.
+
+    Producers enqueue and return immediately, so one slow or stalled
+    browser only backs up its own queue instead of the whole room.
+
+    Frames sent with ``put_batched`` are held for a short window and
+    flushed as a single ``batch`` frame; any other frame flushes the
+    pending batch first, so per-recipient ordering is preserved.
+
+    Frames are already encoded in the connection's ``wire`` format:
+    text (JSON) frames are str, binary (msgpack) frames bytes.
+    """
+
+    def __init__(self, websocket, client_id: str, maxsize: int = 256,
+                 policy: OverflowPolicy = OverflowPolicy.DROP_OLDEST, wire=codec.JSON):
+        self.websocket = websocket
+        self.client_id = client_id
+        self.wire = wire
+        self.policy = OverflowPolicy(policy)
+        self.dropped = 0
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self._writer_task: Optional[asyncio.Task] = None
+        self._closed = False
+        self._batch: List[codec.Encoded] = []
+        self._batch_handle: Optional[asyncio.TimerHandle] = None
+        # BLOCK策略下等待空位的put在连接关闭时由它唤醒
+        self._closed_waiter: Optional[asyncio.Future] = None
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def start(self):
+        if self._writer_task is None:
+            self._writer_task = asyncio.create_task(self._writer())
+
+    async def put(self, data: codec.Encoded) -> bool:
+        """Enqueue an encoded frame; returns False if it was not accepted"""
+        if self._closed:
+            return False
+        if self._batch:
+            self.flush_batch()
+        if self.policy is OverflowPolicy.BLOCK:
+            return await self._put_blocking(data)
+        return self.put_nowait(data)
+
+    async def _put_blocking(self, data: codec.Encoded) -> bool:
+        if not self._queue.full():
+            self._queue.put_nowait(data)
+            return True
+        # 等待空位，但连接关闭时立即放弃：否则房间广播会永远卡在已断开的慢客户端上
+        if self._closed_waiter is None:
+            self._closed_waiter = asyncio.get_running_loop().create_future()
+        put = asyncio.ensure_future(self._queue.put(data))
+        try:
+            await asyncio.wait((put, self._closed_waiter), return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            put.cancel()
+            raise
+        if put.done() and not self._closed:
+            return True
+        put.cancel()
+        return False
+
+    def put_nowait(self, data: codec.Encoded) -> bool:
+        """Enqueue without waiting, applying the overflow policy when full"""
+        if self._closed:
+            return False
+        if self._batch:
+            self.flush_batch()
+        return self._enqueue_nowait(data)
+
+    def put_batched(self, data: codec.Encoded, window: float) -> bool:
+        """Hold ``data`` for up to ``window`` seconds and send it with other batched frames"""
+        if self._closed:
+            return False
+        self._batch.append(data)
+        if len(self._batch) >= MAX_BATCH_SIZE:
+            self.flush_batch()
+        elif self._batch_handle is None:
+            self._batch_handle = asyncio.get_running_loop().call_later(window, self.flush_batch)
+        return True
+
+    def flush_batch(self):
+        """Enqueue the pending batch as one frame"""
+        if self._batch_handle is not None:
+            self._batch_handle.cancel()
+            self._batch_handle = None
+        if not self._batch or self._closed:
+            return
+        items, self._batch = self._batch, []
+        if len(items) == 1:
+            self._enqueue_nowait(items[0])
+        else:
+            self._enqueue_nowait(self.wire.batch(items))
+
+    def _enqueue_nowait(self, data: codec.Encoded) -> bool:
+        if self._queue.full():
+            if self.policy is OverflowPolicy.DISCONNECT:
+                logger.warning(f"Outbound queue full for client {self.client_id}, disconnecting")
+                self._close_connection()
+                return False
+            # DROP_OLDEST（BLOCK策略在非阻塞调用时也退化为丢弃最旧消息）
+            self._queue.get_nowait()
+            self.dropped += 1
+        self._queue.put_nowait(data)
+        return True
+
+    async def _writer(self):
+        try:
+            while True:
+                data = await self._queue.get()
+                if isinstance(data, str):
+                    await self.websocket.send_text(data)
+                else:
+                    await self.websocket.send_bytes(data)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error sending message to client {self.client_id}: {e}")
+            self._closed = True
+            self._wake_putters()
+
+    def _close_connection(self):
+        # 关闭连接后，接收循环会退出并完成正常的断开清理
+        self.close()
+        asyncio.create_task(self._close_websocket())
+
+    async def _close_websocket(self):
+        try:
+            await self.websocket.close(code=1013)
+        except Exception:
+            pass
+
+    def close(self):
+        """Stop the writer and discard anything still queued"""
+        self._closed = True
+        if self._batch_handle is not None:
+            self._batch_handle.cancel()
+            self._batch_handle = None
+        self._batch.clear()
+        self._wake_putters()
+        if self._writer_task is not None:
+            self._writer_task.cancel()
+            self._writer_task = None
+
+    def _wake_putters(self):
+        if self._closed_waiter is not None and not self._closed_waiter.done():
+            self._closed_waiter.set_result(None)
@@ -0,0 +1,92 @@
+"""
+Versioned room membership for delta presence sync.
+
+Every membership change gets a version from one process-wide sequence
+seeded with the wall clock, so versions only grow within a room, are
+never reused when an emptied room is created again, and a restarted
+process starts above the versions it handed out before. A bounded log
+of recent changes lets ``get_users`` with ``since_version`` answer with
+just the members added and removed since then.
+"""
+
+import time
+import itertools
+from collections import deque
+from typing import Deque, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+# 默认保留的变更记录条数，更早的since_version只能拿到完整列表
+PRESENCE_HISTORY = 256
+
+_sequence = itertools.count(time.time_ns() // 1000)
+
+
+def next_version() -> int:
+    return next(_sequence)
+
+
+class PresenceDelta(NamedTuple):
+    """Answer to a presence query: full ``members``, or ``added``/``removed`` since the caller's version"""
+    version: int
+    members: Optional[List[str]]
+    added: List[str]
+    removed: List[str]
+
+    @property
+    def unchanged(self) -> bool:
+        return self.members is None and not self.added and not self.removed
+
+
+class VersionedMembers:
+    """A membership set with a version and a bounded change log"""
+    __slots__ = ("members", "version", "base_version", "changes")
+
+    def __init__(self, history: int = PRESENCE_HISTORY):
+        self.members: Set[str] = set()
+        self.version = self.base_version = next_version()
+        self.changes: Deque[Tuple[int, str, bool]] = deque(maxlen=history)
+
+    def add(self, member: str) -> bool:
+        if member in self.members:
+            return False
+        self.members.add(member)
+        self._record(member, True)
+        return True
+
+    def discard(self, member: str) -> bool:
+        if member not in self.members:
+            return False
+        self.members.discard(member)
+        self._record(member, False)
+        return True
+
+    def _record(self, member: str, joined: bool):
+        self.version = next_version()
+        if len(self.changes) == self.changes.maxlen:
+            # 最旧的记录被挤出后，比它更早的版本无法再计算增量
+            self.base_version = self.changes[0][0]
+        self.changes.append((self.version, member, joined))
+
+    def since(self, since_version: Optional[int]) -> PresenceDelta:
+        """Changes after ``since_version``, or the full member list if the log cannot cover it"""
+        if since_version is None or not self.base_version <= since_version <= self.version:
+            return PresenceDelta(self.version, list(self.members), [], [])
+        latest = {}
+        for version, member, joined in reversed(self.changes):
+            if version <= since_version:
+                break
+            latest.setdefault(member, joined)
+        added = [member for member, joined in latest.items() if joined]
+        removed = [member for member, joined in latest.items() if not joined]
+        return PresenceDelta(self.version, None, added, removed)
+
+
+def delta_from_result(result: dict) -> PresenceDelta:
+    """Rebuild a PresenceDelta sent over the broker protocol"""
+    return PresenceDelta(result["version"], result.get("members"), result.get("added", []), result.get("removed", []))
+
+
+def with_local_members(delta: PresenceDelta, local_members: Iterable[str]) -> PresenceDelta:
+    """Make sure members connected to this worker are listed even if the shared store lags behind"""
+    if delta.members is None:
+        return delta
+    return delta._replace(members=list(set(delta.members).union(local_members)))
@@ -0,0 +1,295 @@
+"""
+Room membership and message routing backends for the voice chat server.
+
+ConnectionManager always delivers to the clients connected to its own
+process; the backend is responsible for room membership as seen by
+every worker and for carrying messages to clients on other workers.
+
+- ``InMemoryRoomBackend``: single process, nothing leaves the worker.
+- ``BrokerRoomBackend``: workers share membership sets and exchange
+  room/client messages through a pub/sub broker (``local_broker.py``).
+"""
+
+import uuid
+import asyncio
+import logging
+from typing import Callable, Dict, Iterable, Optional, Set
+from urllib.parse import urlparse
+
+import signaling_codec as codec
+from presence import PresenceDelta, VersionedMembers, delta_from_result, with_local_members
+
+logger = logging.getLogger(__name__)
+
+# deliver(room_id, client_id, exclude_client, data): 把其他worker的消息投递给本地客户端
+DeliverCallback = Callable[[Optional[str], Optional[str], Optional[str], str], None]
+
+# broker调用的超时时间（秒）
+BROKER_CALL_TIMEOUT = 5.0
+# broker断开后重连的初始间隔和最大间隔（秒），每次失败翻倍
+BROKER_RECONNECT_DELAY = 0.5
+BROKER_RECONNECT_MAX_DELAY = 30.0
+
+
+class RoomBackend:
+    """Interface shared by the room backends"""
+
+    async def start(self, deliver: DeliverCallback):
+        """Start routing; ``deliver`` receives messages published by other workers"""
+
+    async def join(self, room_id: str, client_id: str):
+        """Record that a local client joined a room"""
+
+    async def leave(self, room_id: str, client_id: str):
+        """Record that a local client left a room"""
+
+    async def members(self, room_id: str, local_members: Iterable[str]) -> Set[str]:
+        """All members of a room across workers"""
+        return set(local_members)
+
+    async def presence(self, room_id: str, since_version: Optional[int],
+                       local_members: Iterable[str]) -> PresenceDelta:
+        """Room members as a delta against ``since_version``; version None if the backend keeps none"""
+        return PresenceDelta(None, list(await self.members(room_id, local_members)), [], [])
+
+    async def publish_room(self, room_id: str, data: str, exclude_client: Optional[str] = None):
+        """Deliver an encoded frame to members of the room on other workers"""
+
+    async def publish_client(self, client_id: str, data: str):
+        """Deliver an encoded frame to a client connected to another worker"""
+
+    async def close(self):
+        """Stop routing and release backend resources"""
+
+
+class InMemoryRoomBackend(RoomBackend):
+    """Single-worker backend: every member is local, so routing is a no-op"""
+
+    def __init__(self):
+        self._presence: Dict[str, VersionedMembers] = {}
+
+    async def join(self, room_id: str, client_id: str):
+        presence = self._presence.get(room_id)
+        if presence is None:
+            presence = self._presence[room_id] = VersionedMembers()
+        presence.add(client_id)
+
+    async def leave(self, room_id: str, client_id: str):
+        presence = self._presence.get(room_id)
+        if presence is not None:
+            presence.discard(client_id)
+            if not presence.members:
+                del self._presence[room_id]
+
+    async def presence(self, room_id: str, since_version: Optional[int],
+                       local_members: Iterable[str]) -> PresenceDelta:
+        presence = self._presence.get(room_id)
+        if presence is None:
+            return PresenceDelta(None, list(local_members), [], [])
+        return presence.since(since_version)
+
+
+class BrokerRoomBackend(RoomBackend):
+    """
+    Pub/sub backend over the local broker protocol.
+
+    Each worker subscribes to ``room:<id>`` for rooms with local members
+    and to ``client:<id>`` for its own clients, and keeps room membership
+    in broker-side sets so ``get_users`` sees peers on every worker.
+
+    Every broker call is bounded by ``call_timeout``. When the broker
+    connection drops, the worker keeps serving its own clients (membership
+    and presence fall back to local members, messages for other workers are
+    dropped) while it reconnects with exponential backoff; once back, it
+    registers its local members and subscriptions again.
+    """
+
+    def __init__(self, url: str = "tcp://localhost:8790", call_timeout: float = BROKER_CALL_TIMEOUT,
+                 reconnect_delay: float = BROKER_RECONNECT_DELAY):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 8790
+        self.call_timeout = call_timeout
+        self.reconnect_delay = reconnect_delay
+        self.worker_id = uuid.uuid4().hex[:12]
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._reconnect_task: Optional[asyncio.Task] = None
+        self._connected = False
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._next_id = 0
+        self._deliver: Optional[DeliverCallback] = None
+        # 本worker上各房间的成员，断线重连后据此重新注册
+        self._local_members: Dict[str, Set[str]] = {}
+        self._closing = False
+
+    @property
+    def connected(self) -> bool:
+        return self._connected
+
+    async def start(self, deliver: DeliverCallback):
+        self._deliver = deliver
+        await self._connect()
+        logger.info(f"Worker {self.worker_id} connected to room broker at {self.host}:{self.port}")
+
+    async def _connect(self):
+        reader, self._writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port),
+                                                      self.call_timeout)
+        self._connected = True
+        self._reader_task = asyncio.create_task(self._read_loop(reader))
+
+    async def _call(self, op: str, **fields):
+        if not self._connected:
+            # 连接已断开时立即失败，不能让调用方永远等待
+            raise ConnectionError("room broker unavailable")
+        self._next_id += 1
+        request_id = self._next_id
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        try:
+            self._writer.write(codec.dumps(dict(fields, id=request_id, op=op)).encode() + b"\n")
+            return await asyncio.wait_for(future, self.call_timeout)
+        finally:
+            self._pending.pop(request_id, None)
+
+    def _send(self, op: str, **fields):
+        """Fire-and-forget request; the broker's reply is ignored"""
+        if self._connected:
+            self._writer.write(codec.dumps(dict(fields, id=None, op=op)).encode() + b"\n")
+
+    async def _read_loop(self, reader: asyncio.StreamReader):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                frame = codec.loads(line)
+                if "channel" in frame:
+                    self._dispatch(frame["channel"], frame["data"])
+                    continue
+                future = self._pending.get(frame.get("id"))
+                if future is not None and not future.done():
+                    future.set_result(frame.get("result"))
+        except Exception as e:
+            if not self._closing:
+                logger.error(f"Room broker connection error: {e}", exc_info=True)
+        finally:
+            self._connected = False
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("room broker connection lost"))
+            if not self._closing:
+                logger.error(f"Worker {self.worker_id} lost its room broker connection, serving local members only")
+                if self._reconnect_task is None or self._reconnect_task.done():
+                    self._reconnect_task = asyncio.create_task(self._reconnect())
+
+    async def _reconnect(self):
+        delay = self.reconnect_delay
+        while not self._closing:
+            await asyncio.sleep(delay)
+            try:
+                if self._writer is not None:
+                    self._writer.close()
+                await self._connect()
+                await self._restore()
+                logger.info(f"Worker {self.worker_id} reconnected to room broker at {self.host}:{self.port}")
+                return
+            except (OSError, asyncio.TimeoutError) as e:
+                delay = min(delay * 2, BROKER_RECONNECT_MAX_DELAY)
+                logger.warning(f"Room broker reconnect failed, retrying in {delay:.1f}s: {e}")
+
+    async def _restore(self):
+        """Register local members and subscriptions again on a new broker connection"""
+        for room_id, members in [(room_id, list(members)) for room_id, members in self._local_members.items()]:
+            await self._call("sub", channel=f"room:{room_id}")
+            for client_id in members:
+                await self._call("sadd", key=f"members:{room_id}", member=client_id)
+                await self._call("sub", channel=f"client:{client_id}")
+
+    def _dispatch(self, channel: str, envelope: dict):
+        if envelope.get("origin") == self.worker_id:
+            return
+        kind, _, target = channel.partition(":")
+        if kind == "room":
+            self._deliver(target, None, envelope.get("exclude"), envelope["data"])
+        elif kind == "client":
+            self._deliver(None, target, None, envelope["data"])
+
+    async def join(self, room_id: str, client_id: str):
+        members = self._local_members.setdefault(room_id, set())
+        first = not members
+        members.add(client_id)
+        try:
+            await self._call("sadd", key=f"members:{room_id}", member=client_id)
+            await self._call("sub", channel=f"client:{client_id}")
+            if first:
+                await self._call("sub", channel=f"room:{room_id}")
+        except (ConnectionError, asyncio.TimeoutError) as e:
+            # 本地成员照常通信，重连后统一重新注册
+            logger.error(f"Room broker unavailable, client {client_id} joined room {room_id} on this worker only: {e}")
+
+    async def leave(self, room_id: str, client_id: str):
+        members = self._local_members.get(room_id)
+        if members is not None:
+            members.discard(client_id)
+            if not members:
+                del self._local_members[room_id]
+        try:
+            await self._call("srem", key=f"members:{room_id}", member=client_id)
+            await self._call("unsub", channel=f"client:{client_id}")
+            if room_id not in self._local_members:
+                await self._call("unsub", channel=f"room:{room_id}")
+        except (ConnectionError, asyncio.TimeoutError) as e:
+            # 断开的连接上broker已经清除了本worker的成员和订阅
+            logger.warning(f"Room broker unavailable while client {client_id} left room {room_id}: {e}")
+
+    async def members(self, room_id: str, local_members: Iterable[str]) -> Set[str]:
+        try:
+            return set(await self._call("smembers", key=f"members:{room_id}")) | set(local_members)
+        except (ConnectionError, asyncio.TimeoutError) as e:
+            logger.warning(f"Room broker unavailable, listing local members of room {room_id} only: {e}")
+            return set(local_members)
+
+    async def presence(self, room_id: str, since_version: Optional[int],
+                       local_members: Iterable[str]) -> PresenceDelta:
+        try:
+            result = await self._call("sdelta", key=f"members:{room_id}", since=since_version)
+        except (ConnectionError, asyncio.TimeoutError) as e:
+            logger.warning(f"Room broker unavailable, listing local members of room {room_id} only: {e}")
+            return PresenceDelta(None, list(local_members), [], [])
+        return with_local_members(delta_from_result(result), local_members)
+
+    async def publish_room(self, room_id: str, data: str, exclude_client: Optional[str] = None):
+        self._send("pub", channel=f"room:{room_id}", data={
+            "origin": self.worker_id,
+            "exclude": exclude_client,
+            "data": data
+        })
+
+    async def publish_client(self, client_id: str, data: str):
+        self._send("pub", channel=f"client:{client_id}", data={
+            "origin": self.worker_id,
+            "data": data
+        })
+
+    async def close(self):
+        self._closing = True
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+            await asyncio.gather(self._reconnect_task, return_exceptions=True)
+            self._reconnect_task = None
+        if self._writer is not None:
+            self._writer.close()
+        if self._reader_task is not None:
+            await asyncio.gather(self._reader_task, return_exceptions=True)
+        self._writer = None
+        self._reader_task = None
+
+
+def create_room_backend(kind: str, broker_url: str) -> RoomBackend:
+    """Build the backend selected by ROOM_BACKEND"""
+    if kind == "broker":
+        return BrokerRoomBackend(broker_url)
+    if kind == "memory":
+        return InMemoryRoomBackend()
+    raise ValueError(f"unknown room backend: {kind}")
@@ -0,0 +1,61 @@
+"""
+Per-room sequenced log of recent outbound frames for reconnect-and-resume.
+
+Every frame a worker delivers to members of a room, broadcast or
+targeted, is stamped with the room's next ``room_seq`` and kept in a
+bounded ring buffer. A client that reconnects with its resume token and
+the last ``room_seq`` it saw gets exactly the frames addressed to it
+since then, as long as the buffer still reaches back that far.
+
+Sequences are per worker: a resume that lands on another worker, or
+after the room was emptied, falls back to a fresh join.
+"""
+
+from collections import deque
+from typing import Deque, List, NamedTuple, Optional
+
+from signaling_codec import Frame
+
+# 默认每个房间保留的帧数，断开期间错过更多消息的客户端只能重新加入
+RESUME_BUFFER_SIZE = 256
+
+
+class LogEntry(NamedTuple):
+    seq: int
+    frame: Frame
+    # 定向消息的接收者；房间广播为None
+    target: Optional[str]
+    # 房间广播排除的发送者
+    exclude: Optional[str]
+
+
+class RoomLog:
+    """Sequence counter and ring buffer of one room's recent frames"""
+    __slots__ = ("seq", "entries")
+
+    def __init__(self, size: int = RESUME_BUFFER_SIZE):
+        self.seq = 0
+        self.entries: Deque[LogEntry] = deque(maxlen=size)
+
+    def append(self, frame: Frame, target: Optional[str] = None, exclude: Optional[str] = None) -> Frame:
+        """Stamp ``frame`` with the next room_seq and keep it; returns the stamped frame"""
+        self.seq += 1
+        stamped = frame.with_field("room_seq", self.seq)
+        self.entries.append(LogEntry(self.seq, stamped, target, exclude))
+        return stamped
+
+    def replay(self, client_id: str, last_seq: int) -> Optional[List[Frame]]:
+        """Frames for ``client_id`` after ``last_seq``, or None if the buffer no longer covers the gap"""
+        if last_seq > self.seq or last_seq < 0:
+            return None
+        # 缓冲区为空（size为0）时只有没错过任何帧的客户端能续传
+        if last_seq < self.seq and (not self.entries or self.entries[0].seq > last_seq + 1):
+            return None
+        missed = []
+        for entry in reversed(self.entries):
+            if entry.seq <= last_seq:
+                break
+            if entry.target == client_id if entry.target is not None else entry.exclude != client_id:
+                missed.append(entry.frame)
+        missed.reverse()
+        return missed
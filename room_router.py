@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Room-affinity front router for voice_chat_server.py nodes.
+
+``/ws/{client_id}/{room_id}`` (and the audio route) is hashed by room
+onto a consistent-hash ring of backend nodes, so every member of a room
+reaches the same node and nodes need no shared room state. Each node
+owns many virtual points on the ring; adding or removing a node only
+moves the rooms on the arcs it gains or loses, about 1/N of them.
+
+Connections are either proxied frame by frame (default), or redirected:
+the client gets the ``reconnect`` hint used by drain mode, pointing at
+its node, and reconnects there directly.
+
+When the ring changes (SIGHUP re-reads --nodes-file, or a node stops
+accepting connections) proxied clients of rooms that moved get a
+``reconnect`` hint and are closed, so each moved room regroups on its
+new node.
+
+Usage: python room_router.py --nodes ws://10.0.0.1:8001,ws://10.0.0.2:8001 [--port 8000] [--mode redirect]
+"""
+
+import json
+import bisect
+import signal
+import asyncio
+import hashlib
+import logging
+import argparse
+from typing import Dict, Iterable, List, Optional, Set
+
+import websockets
+
+import signaling_codec as codec
+
+logger = logging.getLogger("room_router")
+
+DEFAULT_ROUTER_PORT = 8000
+# 每个节点在哈希环上的虚拟节点数，越多房间分布越均匀
+VIRTUAL_NODES = 160
+# 连接失败的节点移出哈希环的时间（秒），之后重新加入再试
+NODE_COOLDOWN = 10.0
+# 客户端异常断开时转发给后端的关闭码，后端据此保留续传会话（1006本身不能出现在关闭帧里）
+CLIENT_DROPPED = 4001
+# 不能出现在关闭帧里的关闭码
+UNSENDABLE_CLOSE_CODES = {1005, 1006, 1015}
+
+
+def _hash(key: str) -> int:
+    # 不能用hash()：各进程的字符串哈希随机化，路由器重启后房间会换节点
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent-hash ring of node URLs with virtual nodes"""
+
+    def __init__(self, nodes: Iterable[str] = (), replicas: int = VIRTUAL_NODES):
+        self.replicas = replicas
+        self.nodes: Set[str] = set()
+        self._points: List[int] = []
+        self._owners: List[str] = []
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node: str):
+        if node not in self.nodes:
+            self.nodes.add(node)
+            self._rebuild()
+
+    def remove(self, node: str):
+        if node in self.nodes:
+            self.nodes.discard(node)
+            self._rebuild()
+
+    def _rebuild(self):
+        points = sorted((_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(self.replicas))
+        self._points = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    def node_for(self, key: str) -> Optional[str]:
+        """The node owning ``key``: the first virtual node clockwise from its hash"""
+        if not self._points:
+            return None
+        index = bisect.bisect(self._points, _hash(key))
+        return self._owners[index % len(self._owners)]
+
+
+def room_of(path: str) -> Optional[str]:
+    """Room id of a signaling or audio route, None for any other path"""
+    parts = path.split("?", 1)[0].strip("/").split("/")
+    if len(parts) == 3 and parts[0] == "ws":
+        return parts[2]
+    if len(parts) == 4 and parts[:2] == ["ws", "audio"]:
+        return parts[3]
+    return None
+
+
+def _sendable(code: Optional[int], fallback: int) -> int:
+    if code is None or code in UNSENDABLE_CLOSE_CODES:
+        return fallback
+    return code
+
+
+class ProxiedConnection:
+    """A client connection relayed to the node that owns its room"""
+    __slots__ = ("room_id", "node", "upstream", "wire", "moved")
+
+    def __init__(self, room_id: str, node: str, upstream, wire):
+        self.room_id = room_id
+        self.node = node
+        self.upstream = upstream
+        self.wire = wire
+        self.moved = False
+
+
+class RoomRouter:
+    """Front WebSocket server that sends each room to one node of the ring"""
+
+    def __init__(self, nodes: Iterable[str], mode: str = "proxy", replicas: int = VIRTUAL_NODES):
+        self.nodes: Set[str] = set(nodes)
+        self.ring = HashRing(self.nodes, replicas)
+        self.mode = mode
+        self.proxied: Dict[websockets.WebSocketServerProtocol, ProxiedConnection] = {}
+        # 暂时移出哈希环的节点及其重新加入的定时器
+        self._cooling: Dict[str, asyncio.TimerHandle] = {}
+        self._server = None
+
+    async def start(self, host: str, port: int):
+        self._server = await websockets.serve(
+            self.handle, host, port,
+            subprotocols=codec.SUBPROTOCOLS,
+            process_request=self.process_request,
+            max_size=None,
+            compression=None,
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"Room router listening on {host}:{self.port} ({self.mode}) for nodes {sorted(self.nodes)}")
+        return self._server
+
+    async def close(self):
+        for handle in self._cooling.values():
+            handle.cancel()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def process_request(self, path: str, headers):
+        if path.split("?", 1)[0] == "/healthz":
+            body = json.dumps({"nodes": sorted(self.ring.nodes), "cooling": sorted(self._cooling),
+                               "proxied": len(self.proxied)})
+            return 200, [("Content-Type", "application/json")], body.encode()
+        if room_of(path) is None:
+            return 404, [], b"unknown route\n"
+        return None
+
+    def set_nodes(self, nodes: Iterable[str]) -> int:
+        """Replace the configured nodes; returns how many proxied connections were moved"""
+        self.nodes = set(nodes)
+        for node in self.ring.nodes - self.nodes:
+            self.ring.remove(node)
+        for node in list(self._cooling):
+            if node not in self.nodes:
+                self._cooling.pop(node).cancel()
+        for node in self.nodes - self.ring.nodes - set(self._cooling):
+            self.ring.add(node)
+        return self.rebalance()
+
+    def mark_down(self, node: str):
+        """Take a node that refused a connection off the ring for NODE_COOLDOWN seconds"""
+        if node in self._cooling or node not in self.ring.nodes:
+            return
+        logger.warning(f"Node {node} unavailable, removing it from the ring for {NODE_COOLDOWN}s")
+        self.ring.remove(node)
+        self._cooling[node] = asyncio.get_running_loop().call_later(NODE_COOLDOWN, self._revive, node)
+        self.rebalance()
+
+    def _revive(self, node: str):
+        self._cooling.pop(node, None)
+        if node in self.nodes:
+            self.ring.add(node)
+            self.rebalance()
+
+    def rebalance(self) -> int:
+        """Send proxied clients of rooms that now belong to another node there"""
+        moved = [websocket for websocket, conn in self.proxied.items()
+                 if self.ring.node_for(conn.room_id) != conn.node]
+        for websocket in moved:
+            asyncio.create_task(self._move(websocket, self.proxied[websocket]))
+        if moved:
+            logger.info(f"Ring changed, moving {len(moved)} proxied connections")
+        return len(moved)
+
+    async def _move(self, websocket, conn: ProxiedConnection):
+        # 客户端按drain模式的提示立即重连，经路由器到新节点；在旧节点上按正常离开处理
+        conn.moved = True
+        try:
+            await websocket.send(conn.wire.dumps({"type": "reconnect", "url": None, "retry_after": 0}))
+            await websocket.close(code=1012)
+        except websockets.ConnectionClosed:
+            pass
+
+    async def handle(self, websocket, path: str = None):
+        room_id = room_of(websocket.path)
+        wire = codec.wire_for(websocket.subprotocol)
+        if self.mode == "redirect":
+            node = self.ring.node_for(room_id)
+            if node is None:
+                await websocket.close(code=1013, reason="no backend nodes")
+                return
+            # 与排空模式相同的重连提示，客户端直接连接房间所在节点
+            await websocket.send(wire.dumps({"type": "reconnect", "url": node, "retry_after": 0}))
+            await websocket.close(code=1000)
+            return
+
+        upstream = node = None
+        for _ in range(len(self.nodes)):
+            node = self.ring.node_for(room_id)
+            if node is None:
+                break
+            try:
+                upstream = await websockets.connect(
+                    node.rstrip("/") + websocket.path,
+                    subprotocols=[websocket.subprotocol] if websocket.subprotocol else None,
+                    open_timeout=5,
+                    max_size=None,
+                    compression=None,
+                )
+                break
+            except (OSError, asyncio.TimeoutError, websockets.InvalidHandshake) as e:
+                logger.warning(f"Cannot reach node {node} for room {room_id}: {e}")
+                # 房间随之迁移到环上的下一个节点
+                self.mark_down(node)
+        if upstream is None:
+            await websocket.close(code=1013, reason="no backend nodes")
+            return
+
+        conn = self.proxied[websocket] = ProxiedConnection(room_id, node, upstream, wire)
+        pumps = [asyncio.create_task(self._pump(websocket, upstream)),
+                 asyncio.create_task(self._pump(upstream, websocket))]
+        try:
+            await asyncio.wait(pumps, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for pump in pumps:
+                pump.cancel()
+            self.proxied.pop(websocket, None)
+            # 双向转发关闭码：后端据此区分客户端主动离开和网络中断
+            code = websocket.close_code
+            if conn.moved or code == 1005:
+                code = 1000
+            await upstream.close(code=_sendable(code, CLIENT_DROPPED))
+            await websocket.close(code=_sendable(upstream.close_code, 1011))
+            logger.debug(f"Proxied connection for room {conn.room_id} on {conn.node} closed")
+
+    @staticmethod
+    async def _pump(source, destination):
+        try:
+            async for message in source:
+                await destination.send(message)
+        except websockets.ConnectionClosed:
+            pass
+
+
+def read_nodes(spec: str = "", nodes_file: str = "") -> List[str]:
+    """Nodes from a comma-separated list and/or a file with one URL per line"""
+    nodes = [node.strip() for node in spec.split(",") if node.strip()]
+    if nodes_file:
+        with open(nodes_file, encoding="utf-8") as f:
+            nodes += [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    return nodes
+
+
+async def main(args: argparse.Namespace):
+    router = RoomRouter(read_nodes(args.nodes, args.nodes_file), args.mode, args.replicas)
+    server = await router.start(args.host, args.port)
+
+    def reload_nodes():
+        try:
+            nodes = read_nodes(args.nodes, args.nodes_file)
+        except OSError as e:
+            logger.error(f"Cannot reload nodes: {e}")
+            return
+        moved = router.set_nodes(nodes)
+        logger.info(f"Reloaded {len(nodes)} nodes, moved {moved} proxied connections")
+
+    try:
+        # kill -HUP <pid> 重新读取 --nodes-file
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, reload_nodes)
+    except (AttributeError, NotImplementedError):
+        logger.info("SIGHUP reload unavailable on this platform")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Route voice chat rooms to nodes by consistent hashing")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=DEFAULT_ROUTER_PORT)
+    parser.add_argument("--nodes", default="", help="comma-separated node URLs, e.g. ws://10.0.0.1:8001")
+    parser.add_argument("--nodes-file", default="", help="file with one node URL per line, re-read on SIGHUP")
+    parser.add_argument("--mode", default="proxy", choices=["proxy", "redirect"])
+    parser.add_argument("--replicas", type=int, default=VIRTUAL_NODES)
+    args = parser.parse_args()
+    if not read_nodes(args.nodes, args.nodes_file):
+        parser.error("no nodes given, use --nodes or --nodes-file")
+    asyncio.run(main(args))
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Production launcher for the voice chat signaling server.
+
+Starts N worker processes that each bind their own SO_REUSEPORT socket,
+so the kernel balances new connections across workers without a shared
+accept lock. Each worker is pinned to one core and uses uvloop and
+httptools when they are installed. WebSocket frame-size, queue, ping and
+compression settings are passed through to uvicorn. Each worker sets up
+its own logging and, with more than one worker, writes its own log file
+(``voice_chat_server.<index>.log``): a rotating file cannot be shared.
+
+Workers only share rooms through a room broker. ``--with-broker`` starts
+``local_broker.py`` alongside them and sets ROOM_BACKEND=broker; with
+more than one worker this is implied unless ROOM_BACKEND=broker already
+points the workers at your own broker (ROOM_BROKER_URL).
+
+Usage: python serve_voice_chat.py [--workers 4] [--port 8001] [--with-broker]
+"""
+
+import os
+import sys
+import time
+import signal
+import socket
+import asyncio
+import logging
+import argparse
+import importlib.util
+import multiprocessing
+from typing import List, Optional
+
+import uvicorn
+
+from log_config import setup_logging
+
+logger = logging.getLogger("serve_voice_chat")
+
+APP = "voice_chat_server:app"
+
+
+def fastest_loop() -> str:
+    return "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+
+
+def fastest_http() -> str:
+    return "httptools" if importlib.util.find_spec("httptools") else "h11"
+
+
+def reuseport_socket(host: str, port: int, backlog: int) -> socket.socket:
+    """Listening socket that other workers can bind to the same address"""
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def pin_to_core(core: Optional[int]):
+    if core is not None and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, {core})
+
+
+def worker_log_file(log_file: str, index: int, workers: int) -> Optional[str]:
+    """Log file of one worker: RotatingFileHandler cannot share a file across processes"""
+    if not log_file:
+        return None
+    if workers == 1:
+        return log_file
+    root, ext = os.path.splitext(log_file)
+    return f"{root}.{index}{ext}"
+
+
+def run_worker(index: int, core: Optional[int], args: argparse.Namespace):
+    """Worker process entry point: own socket, own event loop, own log file"""
+    pin_to_core(core)
+    setup_logging(worker_log_file(args.log_file, index, args.workers))
+    config = uvicorn.Config(
+        APP,
+        loop=args.loop,
+        http=args.http,
+        ws="websockets",
+        ws_max_size=args.ws_max_size,
+        ws_max_queue=args.ws_max_queue,
+        ws_ping_interval=args.ws_ping_interval or None,
+        ws_ping_timeout=args.ws_ping_timeout or None,
+        ws_per_message_deflate=args.ws_per_message_deflate,
+        backlog=args.backlog,
+        log_level=args.log_level,
+    )
+    server = uvicorn.Server(config)
+    sock = reuseport_socket(args.host, args.port, args.backlog)
+    logger.info(f"Worker {index} (pid {os.getpid()}) on core {core} serving {args.host}:{args.port}")
+    server.run(sockets=[sock])
+
+
+def run_broker(host: str, port: int):
+    import local_broker
+    asyncio.run(local_broker.main(host, port))
+
+
+def wait_for_port(host: str, port: int, timeout: float = 10.0):
+    """Block until something accepts connections on host:port"""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def worker_cores(workers: int) -> List[Optional[int]]:
+    if not hasattr(os, "sched_getaffinity"):
+        return [None] * workers
+    cores = sorted(os.sched_getaffinity(0))
+    return [cores[i % len(cores)] for i in range(workers)]
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run voice_chat_server with SO_REUSEPORT workers")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8001")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WORKERS", str(os.cpu_count() or 1))))
+    parser.add_argument("--loop", default=fastest_loop(), choices=["uvloop", "asyncio"])
+    parser.add_argument("--http", default=fastest_http(), choices=["httptools", "h11"])
+    parser.add_argument("--backlog", type=int, default=2048)
+    # 信令帧很小：默认限制单帧1MB，关闭逐消息压缩（小JSON压缩得不偿失）
+    parser.add_argument("--ws-max-size", type=int, default=int(os.getenv("WS_MAX_SIZE", str(1024 * 1024))))
+    parser.add_argument("--ws-max-queue", type=int, default=int(os.getenv("WS_MAX_QUEUE", "32")))
+    parser.add_argument("--ws-ping-interval", type=float, default=float(os.getenv("WS_PING_INTERVAL", "20")))
+    parser.add_argument("--ws-ping-timeout", type=float, default=float(os.getenv("WS_PING_TIMEOUT", "20")))
+    parser.add_argument("--ws-per-message-deflate", action="store_true",
+                        default=os.getenv("WS_PER_MESSAGE_DEFLATE", "0") == "1")
+    parser.add_argument("--with-broker", action="store_true",
+                        help="start local_broker.py and share rooms across workers through it "
+                             "(implied by --workers > 1 unless ROOM_BACKEND=broker)")
+    parser.add_argument("--broker-port", type=int, default=8790)
+    parser.add_argument("--log-level", default="warning")
+    parser.add_argument("--log-file", default=os.getenv("LOG_FILE", "voice_chat_server.log"),
+                        help="with several workers each writes <name>.<index>.log; empty logs to stderr only")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    args = parse_args(argv)
+    if not hasattr(socket, "SO_REUSEPORT"):
+        logger.warning("SO_REUSEPORT is not available on this platform, running a single worker")
+        args.workers = 1
+
+    if args.workers > 1 and not args.with_broker and os.getenv("ROOM_BACKEND", "memory") != "broker":
+        # 内存后端不跨worker共享房间：同一房间的成员落在不同worker上时互相收不到信令
+        logger.info(f"{args.workers} workers need a shared room backend, starting the local room broker")
+        args.with_broker = True
+
+    ctx = multiprocessing.get_context("spawn")
+    processes = []
+    if args.with_broker:
+        os.environ["ROOM_BACKEND"] = "broker"
+        os.environ["ROOM_BROKER_URL"] = f"tcp://localhost:{args.broker_port}"
+        broker = ctx.Process(target=run_broker, args=("localhost", args.broker_port), name="room-broker")
+        broker.start()
+        processes.append(broker)
+        # worker启动时就要连接broker
+        wait_for_port("localhost", args.broker_port)
+
+    logger.info(f"Starting {args.workers} workers on {args.host}:{args.port} "
+                f"(loop={args.loop}, http={args.http}, ws_max_size={args.ws_max_size})")
+    workers = []
+    for index, core in enumerate(worker_cores(args.workers)):
+        worker = ctx.Process(target=run_worker, args=(index, core, args), name=f"voice-chat-worker-{index}")
+        worker.start()
+        workers.append(worker)
+    processes.extend(workers)
+
+    stopping = []
+
+    def forward(signum, frame):
+        # SIGTERM和SIGUSR1（排空）转发给所有worker
+        for process in workers:
+            if process.is_alive():
+                os.kill(process.pid, signum)
+        if signum == signal.SIGTERM:
+            stopping.append(signum)
+
+    def interrupted(signum, frame):
+        # 终端的Ctrl+C会同时发给整个进程组，worker自己会退出
+        stopping.append(signum)
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, interrupted)
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, forward)
+
+    for worker in workers:
+        worker.join()
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+            process.join()
+    return 0 if stopping or all(worker.exitcode == 0 for worker in workers) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
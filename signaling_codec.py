@@ -0,0 +1,172 @@
+"""
+Codecs used on the signaling hot path.
+
+``dumps``/``loads`` are the JSON codec: orjson when it is installed and
+the standard library otherwise. Both produce compact UTF-8 JSON text,
+so peers cannot tell which one the server is running.
+
+WebSocket peers can also negotiate MessagePack through the
+``Sec-WebSocket-Protocol`` header (``voicechat.msgpack``). JSON stays
+the fallback for peers that offer no subprotocol or when msgpack is not
+installed. Both encodings carry the same records, see signaling_schema.py.
+"""
+
+import json
+import struct
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+try:
+    import orjson
+except ImportError:  # orjson是可选依赖
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # msgpack是可选依赖，缺失时只支持JSON
+    msgpack = None
+
+# orjson.JSONDecodeError是json.JSONDecodeError的子类，调用方统一捕获这个类型即可
+DecodeError = json.JSONDecodeError
+
+Encoded = Union[str, bytes]
+
+if orjson is not None:
+    CODEC_NAME = "orjson"
+
+    def dumps(obj: Any) -> str:
+        """Serialize ``obj`` to a compact JSON string"""
+        return orjson.dumps(obj).decode("utf-8")
+
+    def loads(data: Union[str, bytes]) -> Any:
+        """Parse a JSON text or UTF-8 bytes frame"""
+        return orjson.loads(data)
+else:
+    CODEC_NAME = "json"
+    _encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+    _decoder = json.JSONDecoder()
+
+    def dumps(obj: Any) -> str:
+        """Serialize ``obj`` to a compact JSON string"""
+        return _encoder.encode(obj)
+
+    def loads(data: Union[str, bytes]) -> Any:
+        """Parse a JSON text or UTF-8 bytes frame"""
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            data = bytes(data).decode("utf-8")
+        return _decoder.decode(data)
+
+
+class JsonWire:
+    """JSON text frames"""
+    subprotocol = "voicechat.json"
+    binary = False
+    # 合并帧的外层结构，内部消息已经是编码好的JSON，直接拼接
+    BATCH_PREFIX = '{"type":"batch","messages":['
+    BATCH_SUFFIX = ']}'
+
+    dumps = staticmethod(dumps)
+    loads = staticmethod(loads)
+
+    def batch(self, items: List[str]) -> str:
+        return self.BATCH_PREFIX + ",".join(items) + self.BATCH_SUFFIX
+
+
+class MsgpackWire:
+    """MessagePack binary frames with the same field names as JSON"""
+    subprotocol = "voicechat.msgpack"
+    binary = True
+
+    def __init__(self):
+        # 复用同一个Packer，避免每条消息创建新对象
+        self._packer = msgpack.Packer()
+        self._batch_prefix = self._packer.pack({"type": "batch", "messages": []})[:-1]
+
+    def dumps(self, obj: Any) -> bytes:
+        return self._packer.pack(obj)
+
+    def loads(self, data: bytes) -> Any:
+        try:
+            return msgpack.unpackb(data)
+        except Exception as e:
+            raise DecodeError(f"invalid msgpack frame: {e}", "", 0) from e
+
+    def batch(self, items: List[bytes]) -> bytes:
+        # 与JSON一样直接拼接已编码的消息，只需替换数组长度头
+        count = len(items)
+        header = bytes([0x90 | count]) if count < 16 else b"\xdc" + struct.pack(">H", count)
+        return self._batch_prefix + header + b"".join(items)
+
+
+JSON = JsonWire()
+MSGPACK = MsgpackWire() if msgpack is not None else None
+
+WIRE_FORMATS: Dict[str, Any] = {wire.subprotocol: wire for wire in (MSGPACK, JSON) if wire is not None}
+# 按服务器偏好排序，客户端连接时也按此顺序提供
+SUBPROTOCOLS: List[str] = list(WIRE_FORMATS)
+
+
+def negotiate(offered: Sequence[str]) -> Optional[str]:
+    """Pick the preferred subprotocol among those the peer offered, or None for plain JSON"""
+    for subprotocol in SUBPROTOCOLS:
+        if subprotocol in offered:
+            return subprotocol
+    return None
+
+
+def wire_for(subprotocol: Optional[str]):
+    """Wire format of a connection given its negotiated subprotocol"""
+    return WIRE_FORMATS.get(subprotocol, JSON)
+
+
+def decode(data: Encoded) -> Any:
+    """Decode a received frame: text frames are JSON, binary frames MessagePack"""
+    if isinstance(data, str) or MSGPACK is None:
+        return loads(data)
+    return MSGPACK.loads(data)
+
+
+class Frame:
+    """
+    One outgoing message, encoded at most once per wire format.
+
+    Broadcasts build a single Frame and every recipient takes the encoding
+    of its own connection. Frames published by other workers arrive as
+    JSON text and are only decoded if a local recipient needs msgpack.
+    """
+    __slots__ = ("_message", "_encoded")
+
+    def __init__(self, message: Optional[dict] = None, json_text: Optional[str] = None):
+        self._message = message
+        self._encoded: Dict[Any, Encoded] = {} if json_text is None else {JSON: json_text}
+
+    @classmethod
+    def of(cls, message: Union["Frame", dict, str]) -> "Frame":
+        if isinstance(message, Frame):
+            return message
+        if isinstance(message, str):
+            return cls(json_text=message)
+        return cls(message)
+
+    @property
+    def message(self) -> dict:
+        if self._message is None:
+            self._message = loads(self._encoded[JSON])
+        return self._message
+
+    @property
+    def json(self) -> str:
+        return self.encode(JSON)
+
+    def encode(self, wire) -> Encoded:
+        data = self._encoded.get(wire)
+        if data is None:
+            data = self._encoded[wire] = wire.dumps(self.message)
+        return data
+
+    def with_field(self, name: str, value: Any) -> "Frame":
+        """A copy with one more top-level field; relayed JSON text is spliced rather than decoded"""
+        if self._message is not None:
+            return Frame(dict(self._message, **{name: value}))
+        text = self._encoded[JSON]
+        rest = text[1:].lstrip()
+        return Frame(json_text=f'{{{dumps(name)}:{dumps(value)}{"," if rest[:1] != "}" else ""}{rest}')
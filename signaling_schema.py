@@ -0,0 +1,228 @@
+"""
+Message schema shared by the browser client, voice_chat_server.py and the chatbot servers.
+
+Every frame is a record with a ``type`` tag and the fields below, whether
+it travels as JSON or MessagePack (see signaling_codec.py). The records
+are TypedDicts, so decoding yields plain dicts with no per-message
+conversion cost while handlers still get typed access.
+
+With session resume enabled, every server message routed through a room
+also carries a ``room_seq`` field (see room_log.py).
+
+Client frames are checked against ``CLIENT_MESSAGES`` when they are
+decoded (``validate_client_message``): the ``type`` must be known and
+the required fields present with the declared types. Nested values and
+extra fields are not checked.
+"""
+
+from typing import Any, Dict, List, Optional, Tuple, TypedDict, Union, get_args, get_origin, get_type_hints
+
+try:
+    from typing import NotRequired
+except ImportError:  # Python < 3.11
+    from typing_extensions import NotRequired
+
+
+# 客户端 -> 信令服务器
+
+class Offer(TypedDict):
+    type: str
+    sdp: str
+    target: NotRequired[str]
+    sender: NotRequired[str]
+
+
+class Answer(TypedDict):
+    type: str
+    sdp: str
+    target: NotRequired[str]
+    sender: NotRequired[str]
+
+
+class IceCandidate(TypedDict):
+    type: str
+    candidate: Optional[Dict[str, Any]]
+    target: NotRequired[str]
+    sender: NotRequired[str]
+
+
+class AsrText(TypedDict):
+    type: str
+    text: str
+    client_id: NotRequired[str]
+    session_id: NotRequired[str]
+
+
+class GetUsers(TypedDict):
+    type: str
+    since_version: NotRequired[int]
+
+
+class Pong(TypedDict):
+    type: str
+
+
+# 信令服务器 -> 客户端
+
+class UserJoined(TypedDict):
+    type: str
+    client_id: str
+
+
+class UserLeft(TypedDict):
+    type: str
+    client_id: str
+
+
+class UsersList(TypedDict):
+    type: str
+    users: List[str]
+    version: Optional[int]
+
+
+class UsersDelta(TypedDict):
+    type: str
+    version: int
+    added: List[str]
+    removed: List[str]
+
+
+class UsersUnchanged(TypedDict):
+    type: str
+    version: int
+
+
+class Ping(TypedDict):
+    type: str
+
+
+class Session(TypedDict):
+    type: str
+    resume_token: str
+    room_seq: int
+    resumed: bool
+
+
+class Topology(TypedDict):
+    type: str
+    mode: str
+    peer: str
+
+
+class Reconnect(TypedDict):
+    type: str
+    url: Optional[str]
+    retry_after: float
+
+
+class Error(TypedDict):
+    type: str
+    message: str
+    code: NotRequired[str]
+    retry_after: NotRequired[float]
+    request_id: NotRequired[str]
+
+
+class BotResponse(TypedDict):
+    type: str
+    text: str
+    client_id: Optional[str]
+    session_id: Optional[str]
+    request_id: NotRequired[str]
+    seq: NotRequired[int]
+    final: NotRequired[bool]
+    audio_file: NotRequired[Optional[str]]
+    audio_pending: NotRequired[bool]
+
+
+class BotResponseDelta(TypedDict):
+    type: str
+    seq: int
+    text: str
+    client_id: Optional[str]
+    session_id: Optional[str]
+    request_id: NotRequired[str]
+
+
+# 流式回复的最终bot_response带audio_pending时，语音合成完成后再发送该帧
+class BotAudio(TypedDict):
+    type: str
+    audio_file: Optional[str]
+    client_id: Optional[str]
+    session_id: Optional[str]
+    request_id: NotRequired[str]
+
+
+class Batch(TypedDict):
+    type: str
+    messages: List[Dict[str, Any]]
+
+
+# 信令服务器 -> 聊天机器人：asr_text加上request_id和stream
+class ChatbotRequest(AsrText):
+    request_id: str
+    stream: NotRequired[bool]
+
+
+ClientMessage = Union[Offer, Answer, IceCandidate, AsrText, GetUsers, Pong]
+ServerMessage = Union[Offer, Answer, IceCandidate, UserJoined, UserLeft, UsersList, UsersDelta, UsersUnchanged,
+                      Ping, Session, Topology, Reconnect, Error, BotResponse, BotResponseDelta, Batch]
+ChatbotReply = Union[BotResponse, BotResponseDelta, BotAudio, Error]
+
+CLIENT_MESSAGES: Dict[str, type] = {
+    "offer": Offer,
+    "answer": Answer,
+    "ice_candidate": IceCandidate,
+    "asr_text": AsrText,
+    "get_users": GetUsers,
+    "pong": Pong,
+}
+
+
+def _accepted_types(hint: Any) -> Optional[Tuple[type, ...]]:
+    """Runtime types a field annotation allows; None when any value is allowed"""
+    if hint is Any:
+        return None
+    origin = get_origin(hint)
+    if origin is Union:
+        accepted: Tuple[type, ...] = ()
+        for arg in get_args(hint):
+            types = _accepted_types(arg)
+            if types is None:
+                return None
+            accepted += types
+        return accepted
+    if origin is not None:
+        # List[str] -> list, Dict[str, Any] -> dict
+        return (origin,)
+    if hint is float:
+        return (int, float)
+    return (hint,)
+
+
+# type -> [(字段名, 是否必需, 允许的类型)]，启动时从TypedDict生成一次
+_CLIENT_FIELDS: Dict[str, List[Tuple[str, bool, Optional[Tuple[type, ...]]]]] = {
+    msg_type: [(name, name in schema.__required_keys__, _accepted_types(hint))
+               for name, hint in get_type_hints(schema).items()]
+    for msg_type, schema in CLIENT_MESSAGES.items()
+}
+
+
+def validate_client_message(message: Any) -> Optional[str]:
+    """Check a decoded client frame against its schema; returns what is wrong, or None if it is valid"""
+    if not isinstance(message, dict):
+        return "frame is not an object"
+    msg_type = message.get("type")
+    fields = _CLIENT_FIELDS.get(msg_type) if isinstance(msg_type, str) else None
+    if fields is None:
+        return f"unknown message type {msg_type!r:.40}"
+    for name, required, types in fields:
+        if name not in message:
+            if required:
+                return f"{msg_type} is missing {name!r}"
+            continue
+        value = message[name]
+        # bool是int的子类，int字段不接受true/false
+        if types is not None and (not isinstance(value, types) or (isinstance(value, bool) and bool not in types)):
+            return f"{msg_type}.{name} has the wrong type {type(value).__name__}"
+    return None
@@ -0,0 +1,168 @@
+"""
+In-memory static assets for the browser clients.
+
+Files are read once at startup and kept together with gzip and (when
+the brotli package is installed) brotli variants compressed at the
+highest level, so serving one is a dict lookup. Every variant has a
+strong ETag derived from the content hash, and conditional requests
+get a 304.
+
+Entry pages (HTML) are served with ``no-cache``: browsers revalidate
+them and get a 304 while the file is unchanged. Stylesheets and scripts
+they reference are rewritten to content-hashed URLs
+(``script.3f9a1c2b7d4e.js``) served as ``immutable`` for a year, so
+repeat page loads never ask for them again.
+"""
+
+import os
+import re
+import gzip
+import hashlib
+import mimetypes
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+try:
+    import brotli
+except ImportError:  # brotli是可选依赖，缺失时只提供gzip
+    brotli = None
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+# 小于该大小的文件压缩后反而可能更大，直接发送原文
+MIN_COMPRESS_SIZE = 256
+# 服务端优先选择的编码顺序
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+# 页面中引用的同目录资源：href="styles.css"、src="script.js"
+REFERENCE = re.compile(r'''(\b(?:href|src)=["'])([\w.-]+)(["'])''')
+
+
+def _compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=11)
+    return gzip.compress(body, compresslevel=9, mtime=0)
+
+
+def accepted_encodings(header: str) -> Dict[str, float]:
+    """Parse Accept-Encoding into {coding: q}"""
+    accepted = {}
+    for item in header.split(","):
+        coding, _, params = item.strip().partition(";")
+        if not coding:
+            continue
+        q = 1.0
+        name, _, value = params.strip().partition("=")
+        if name.strip() == "q":
+            try:
+                q = float(value)
+            except ValueError:
+                q = 0.0
+        accepted[coding.strip().lower()] = q
+    return accepted
+
+
+class StaticAsset:
+    """One file with its precompressed variants and their ETags"""
+    __slots__ = ("content_type", "cache_control", "digest", "variants")
+
+    def __init__(self, body: bytes, content_type: str, cache_control: str = REVALIDATE):
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self.digest = hashlib.sha256(body).hexdigest()
+        # 编码 -> (内容, ETag)；同一文件不同编码的表示是不同的字节，强ETag也必须不同
+        self.variants: Dict[str, Tuple[bytes, str]] = {"identity": (body, f'"{self.digest[:32]}"')}
+        if len(body) >= MIN_COMPRESS_SIZE:
+            for encoding in ENCODINGS:
+                compressed = _compress(body, encoding)
+                if len(compressed) < len(body):
+                    self.variants[encoding] = (compressed, f'"{self.digest[:32]}-{encoding}"')
+
+    @property
+    def fingerprint(self) -> str:
+        return self.digest[:12]
+
+    def select(self, accept_encoding: str) -> str:
+        accepted = accepted_encodings(accept_encoding)
+        for encoding in ENCODINGS:
+            if encoding in self.variants and accepted.get(encoding, accepted.get("*", 0)) > 0:
+                return encoding
+        return "identity"
+
+    def matches(self, if_none_match: str) -> bool:
+        if if_none_match.strip() == "*":
+            return True
+        # If-None-Match使用弱比较；编码不同的ETag也算命中，内容没变
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return any(etag in tags for _, etag in self.variants.values())
+
+    def response(self, request: Request) -> Response:
+        encoding = self.select(request.headers.get("accept-encoding", ""))
+        body, etag = self.variants[encoding]
+        headers = {"ETag": etag, "Cache-Control": self.cache_control, "Vary": "Accept-Encoding"}
+        if self.matches(request.headers.get("if-none-match", "")):
+            return Response(status_code=304, headers=headers)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(body, media_type=self.content_type, headers=headers)
+
+
+class StaticAssets:
+    """URL path -> StaticAsset table built at startup"""
+
+    def __init__(self):
+        self.assets: Dict[str, StaticAsset] = {}
+
+    def add_page(self, path: str, urls: Iterable[str]):
+        """Serve one self-contained HTML file at ``urls``"""
+        with open(path, "rb") as f:
+            asset = StaticAsset(f.read(), "text/html; charset=utf-8")
+        for url in urls:
+            self.assets[url] = asset
+
+    def add_directory(self, directory: str, prefix: str, index: str = "index.html"):
+        """
+        Serve the HTML pages of ``directory`` under ``prefix`` together with the
+        files they reference, rewriting those references to immutable
+        content-hashed URLs. Other files (server.js, package.json) stay private.
+        """
+        pages: List[Tuple[str, str]] = []
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(".html"):
+                with open(os.path.join(directory, name), encoding="utf-8") as f:
+                    pages.append((name, f.read()))
+        referenced = {m.group(2) for _, html in pages for m in REFERENCE.finditer(html)}
+
+        fingerprinted: Dict[str, str] = {}
+        for name in sorted(referenced):
+            path = os.path.join(directory, name)
+            if name.endswith(".html") or not os.path.isfile(path):
+                continue
+            with open(path, "rb") as f:
+                body = f.read()
+            content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+            if content_type.startswith("text/") or content_type.endswith("javascript"):
+                content_type += "; charset=utf-8"
+            # 原文件名也可访问（需要重新验证），带指纹的文件名永久缓存
+            self.assets[prefix + name] = StaticAsset(body, content_type)
+            immutable = StaticAsset(body, content_type, IMMUTABLE)
+            stem, ext = os.path.splitext(name)
+            fingerprinted[name] = f"{stem}.{immutable.fingerprint}{ext}"
+            self.assets[prefix + fingerprinted[name]] = immutable
+
+        for name, html in pages:
+            html = REFERENCE.sub(lambda m: m.group(1) + fingerprinted.get(m.group(2), m.group(2)) + m.group(3), html)
+            asset = StaticAsset(html.encode("utf-8"), "text/html; charset=utf-8")
+            self.assets[prefix + name] = asset
+            if name == index:
+                self.assets[prefix] = asset
+
+    def get(self, url: str) -> Optional[StaticAsset]:
+        return self.assets.get(url)
+
+    def respond(self, request: Request) -> Response:
+        asset = self.assets.get(request.url.path)
+        if asset is None:
+            return Response("Not Found", status_code=404, media_type="text/plain")
+        return asset.response(request)
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test asr_text admission control: token buckets and the bounded admission queue.
+"""
+
+import asyncio
+
+from admission_control import AdmissionController, AdmissionRejected
+
+
+def test_token_buckets():
+    admission = AdmissionController(client_rate=(1, 2), room_rate=(10, 3), global_rate=None)
+
+    # 突发容量用完后被拒绝，并给出令牌恢复所需的时间
+    admission.check_rate("alice", "room_1")
+    admission.check_rate("alice", "room_1")
+    try:
+        admission.check_rate("alice", "room_1")
+        assert False, "third request should be rate limited"
+    except AdmissionRejected as e:
+        assert e.reason == "client_rate_limited"
+        assert 0 < e.retry_after <= 1
+
+    # 房间桶由房间内所有客户端共享；被拒绝的请求不消耗任何令牌
+    admission.check_rate("bob", "room_1")
+    try:
+        admission.check_rate("carol", "room_1")
+        assert False, "room bucket should be empty"
+    except AdmissionRejected as e:
+        assert e.reason == "room_rate_limited"
+    assert admission._client_buckets["carol"].tokens == 2
+    print("✓ Client and room token buckets reject with a retry-after hint")
+
+
+async def _run_admission_queue():
+    admission = AdmissionController(max_concurrent=1, max_queue=1, queue_timeout=1)
+    release = asyncio.Event()
+
+    async def call():
+        async with admission.slot():
+            await release.wait()
+
+    first = asyncio.create_task(call())
+    queued = asyncio.create_task(call())
+    await asyncio.sleep(0.01)
+    assert admission.running == 1 and admission.waiting == 1
+
+    # 并发和队列都已满时立即拒绝
+    try:
+        async with admission.slot():
+            assert False, "queue is full"
+    except AdmissionRejected as e:
+        assert e.reason == "overloaded" and e.retry_after > 0
+
+    release.set()
+    await asyncio.gather(first, queued)
+    assert admission.running == 0 and admission.waiting == 0
+    print("✓ Requests beyond the concurrency cap queue, and a full queue rejects immediately")
+
+
+def test_admission_queue():
+    asyncio.run(_run_admission_queue())
+
+
+if __name__ == "__main__":
+    test_token_buckets()
+    test_admission_queue()
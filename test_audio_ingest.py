@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test the PCM ring buffer behind the binary audio ingestion route.
+"""
+
+import struct
+import asyncio
+
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+from audio_ingest import FRAME_HEADER, PCMRingBuffer, AudioIngestManager
+from voice_chat_server import app, audio_ingest
+
+
+def make_frame(seq: int, samples) -> bytes:
+    return FRAME_HEADER.pack(seq, seq * 20.0) + struct.pack(f"<{len(samples)}h", *samples)
+
+
+def test_wraparound_and_overrun():
+    buffer = PCMRingBuffer(capacity_bytes=8)
+    out = memoryview(bytearray(8))
+
+    assert buffer.write_frame(make_frame(0, [1, 2, 3]))
+    assert buffer.readinto(out[:4]) == 4
+    # 写入跨越缓冲区末尾
+    assert buffer.write_frame(make_frame(1, [4, 5, 6]))
+    assert buffer.available == 8
+    assert buffer.readinto(out) == 8
+    assert struct.unpack("<4h", out) == (3, 4, 5, 6)
+
+    # 读者落后时覆盖最旧的音频
+    buffer.write_frame(make_frame(2, [7, 8, 9]))
+    buffer.write_frame(make_frame(3, [10, 11]))
+    assert buffer.overruns == 2
+    assert buffer.readinto(out) == 8
+    assert struct.unpack("<4h", out) == (8, 9, 10, 11)
+    print("✓ Ring buffer wraps around and overwrites the oldest audio")
+
+
+def test_sequence_gaps_and_malformed_frames():
+    buffer = PCMRingBuffer(capacity_bytes=64)
+    buffer.write_frame(make_frame(0, [0]))
+    buffer.write_frame(make_frame(3, [0]))
+    assert buffer.lost_chunks == 2
+    assert buffer.last_seq == 3 and buffer.last_timestamp == 60.0
+    assert not buffer.write_frame(b"\x00" * 5)
+    assert not buffer.write_frame(make_frame(4, [0]) + b"\x00")
+    print("✓ Sequence gaps are counted and malformed frames rejected")
+
+
+async def _run_frame_iterator():
+    ingest = AudioIngestManager(buffer_seconds=1.0)
+    received = []
+
+    async def recognizer():
+        async for frame in ingest.stream("client_1", frame_ms=1):
+            received.append(bytes(frame))
+
+    consumer = asyncio.create_task(recognizer())
+    await asyncio.sleep(0)
+    buffer = await ingest.open("client_1", sample_rate=8000)
+    # 1ms @ 8kHz = 8个采样
+    buffer.write_frame(make_frame(0, list(range(12))))
+    buffer.write_frame(make_frame(1, list(range(12, 16))))
+    await asyncio.sleep(0.01)
+    ingest.close("client_1", buffer)
+    await asyncio.wait_for(consumer, 1)
+
+    assert received == [struct.pack("<8h", *range(8)), struct.pack("<8h", *range(8, 16))]
+    assert "client_1" not in ingest.buffers
+    print("✓ Recognizer consumes fixed-size frames until the stream closes")
+
+
+def test_frame_iterator():
+    asyncio.run(_run_frame_iterator())
+
+
+async def _run_unsupported_sample_rate():
+    ingest = AudioIngestManager()
+    for sample_rate in (0, -16000, 10 ** 9):
+        try:
+            await ingest.open("client_1", sample_rate)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError(f"sample rate {sample_rate} accepted")
+    assert ingest.buffers == {}
+
+
+def test_unsupported_sample_rate():
+    asyncio.run(_run_unsupported_sample_rate())
+
+    # 音频路由在分配缓冲区之前以1003关闭连接
+    client = TestClient(app)
+    for sample_rate in (0, 10 ** 9):
+        with client.websocket_connect(f"/ws/audio/alice/room_1?sample_rate={sample_rate}") as ws:
+            try:
+                ws.receive_bytes()
+            except WebSocketDisconnect as e:
+                assert e.code == 1003
+            else:
+                raise AssertionError("audio stream accepted")
+    assert "alice" not in audio_ingest.buffers
+    print("✓ Unsupported sample rates are refused before any buffer is allocated")
+
+
+if __name__ == "__main__":
+    test_wraparound_and_overrun()
+    test_sequence_gaps_and_malformed_frames()
+    test_frame_iterator()
+    test_unsupported_sample_rate()
@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test the multiplexed chatbot channel and the shared chatbot connection pool.
+"""
+
+import asyncio
+import json
+import websockets
+
+from chatbot_channel import ChatbotChannel, ChatbotConnectionPool
+from fake_websocket import RecordingWebSocket
+from voice_chat_server import ConnectionManager
+
+
+async def _out_of_order_chatbot(websocket, path=None):
+    """Stand-in chatbot that answers later requests first"""
+    async def reply(data):
+        # 越短的文本越晚回复，制造乱序
+        await asyncio.sleep(0.05 * (5 - len(data["text"])))
+        await websocket.send(json.dumps({
+            "type": "bot_response",
+            "text": "echo:" + data["text"],
+            "client_id": data["client_id"],
+            "request_id": data["request_id"]
+        }, ensure_ascii=False))
+
+    async for message in websocket:
+        asyncio.create_task(reply(json.loads(message)))
+
+
+async def _streaming_chatbot(websocket, path=None):
+    """Stand-in chatbot that streams each word of the reply as a delta"""
+    async def reply(data):
+        words = data["text"].split()
+        for seq, word in enumerate(words):
+            await asyncio.sleep(0.01)
+            await websocket.send(json.dumps({
+                "type": "bot_response_delta", "seq": seq, "text": word, "request_id": data["request_id"]
+            }))
+        await websocket.send(json.dumps({
+            "type": "bot_response", "seq": len(words), "final": True,
+            "text": " ".join(words), "request_id": data["request_id"]
+        }))
+
+    async for message in websocket:
+        data = json.loads(message)
+        assert data["stream"] is True
+        asyncio.create_task(reply(data))
+
+
+async def _speaking_chatbot(websocket, path=None):
+    """Stand-in chatbot that sends the final text first and the synthesized speech afterwards"""
+    async for message in websocket:
+        data = json.loads(message)
+        await websocket.send(json.dumps({
+            "type": "bot_response_delta", "seq": 0, "text": data["text"], "request_id": data["request_id"]
+        }))
+        await websocket.send(json.dumps({
+            "type": "bot_response", "seq": 1, "final": True, "text": data["text"], "audio_pending": True,
+            "request_id": data["request_id"]
+        }))
+        await asyncio.sleep(0.1)
+        await websocket.send(json.dumps({
+            "type": "bot_audio", "audio_file": "/tmp/reply.wav", "request_id": data["request_id"]
+        }))
+
+
+async def _garbling_chatbot(websocket, path=None):
+    """Stand-in chatbot that sends malformed frames before every reply, and hangs up on "bye" """
+    async for message in websocket:
+        data = json.loads(message)
+        if data["text"] == "bye":
+            await websocket.close()
+            return
+        await websocket.send("[1, 2, 3]")
+        await websocket.send("not json")
+        await websocket.send(b"\xff\xfe\x00")
+        await websocket.send('"just a string"')
+        # 旧版聊天机器人：不回传request_id
+        await websocket.send(json.dumps({"type": "bot_response", "text": "echo:" + data["text"]}))
+
+
+async def _run_concurrent_requests():
+    async with websockets.serve(_out_of_order_chatbot, "localhost", 0) as server:
+        port = server.sockets[0].getsockname()[1]
+        channel = ChatbotChannel(f"ws://localhost:{port}")
+
+        texts = ["a", "bb", "ccc", "dddd"]
+        replies = await asyncio.gather(*[
+            channel.request({"type": "asr_text", "text": text, "client_id": f"client_{i}"})
+            for i, text in enumerate(texts)
+        ])
+
+        for i, (text, reply) in enumerate(zip(texts, replies)):
+            assert reply["text"] == "echo:" + text
+            assert reply["client_id"] == f"client_{i}"
+        assert channel.in_flight == 0
+
+        await channel.close()
+    print("✓ Concurrent chatbot requests were routed to the right callers")
+
+
+async def _run_pool_lifecycle():
+    async with websockets.serve(_out_of_order_chatbot, "localhost", 0) as server:
+        port = server.sockets[0].getsockname()[1]
+        pool = ChatbotConnectionPool(f"ws://localhost:{port}", min_size=1, max_size=2,
+                                     max_in_flight=1, idle_timeout=0.0, health_check_interval=3600)
+
+        # 预热连接在第一次请求之前就已建立
+        await pool.start()
+        assert pool.size == 1
+
+        # 并发请求超过单连接上限时扩容，但不超过max_size
+        await asyncio.gather(*[
+            pool.request({"type": "asr_text", "text": "x" * (i + 1), "client_id": f"client_{i}"})
+            for i in range(4)
+        ])
+        assert pool.size == 2
+
+        # 空闲连接被回收到min_size
+        await pool._reap_idle()
+        assert pool.size == 1
+
+        await pool.close()
+        assert pool.size == 0
+    print("✓ Chatbot pool warms up, stays bounded and reaps idle connections")
+
+
+async def _run_pool_locking():
+    handshake_delays = []
+
+    async def slow_handshake(path, headers):
+        # 按需拖慢下一次握手，模拟建连很慢的聊天机器人
+        if handshake_delays:
+            await asyncio.sleep(handshake_delays.pop())
+
+    async with websockets.serve(_out_of_order_chatbot, "localhost", 0, process_request=slow_handshake) as server:
+        port = server.sockets[0].getsockname()[1]
+        pool = ChatbotConnectionPool(f"ws://localhost:{port}", min_size=1, max_size=2,
+                                     max_in_flight=1, idle_timeout=0.0, health_check_interval=3600)
+        await pool.start()
+        message = {"type": "asr_text", "text": "hello", "client_id": "client_0"}
+
+        # 已分配的通道在请求登记之前就计入负载，下一个请求需要扩容
+        first = await pool.acquire()
+        assert first.in_flight == 1
+        handshake_delays.append(0.5)
+        growing = asyncio.create_task(pool.request(message))
+        await asyncio.sleep(0.05)
+        assert pool.size == 2 and not growing.done()
+
+        # 新通道建连期间，已打开的通道仍然可以分配
+        assert (await first.request(message, reserved=True))["text"] == "echo:hello"
+        reply = await asyncio.wait_for(pool.request(message), 0.2)
+        assert reply["text"] == "echo:hello" and not growing.done()
+        assert (await growing)["text"] == "echo:hello"
+
+        # 空闲回收不会关闭刚分配出去的通道
+        held = await pool.acquire()
+        await pool._reap_idle()
+        assert pool.size == 1 and pool._channels == [held] and held.is_open
+        assert (await held.request(message, reserved=True))["text"] == "echo:hello"
+
+        # 被连接池丢弃的通道不能在池外重新打开
+        await pool.close()
+        try:
+            await held.connect()
+        except ConnectionError:
+            pass
+        else:
+            raise AssertionError("a retired channel reconnected")
+        assert not held.is_open
+    print("✓ The pool connects new channels outside its lock and never closes or reopens a channel behind a caller")
+
+
+async def _run_streaming_requests():
+    async with websockets.serve(_streaming_chatbot, "localhost", 0) as server:
+        port = server.sockets[0].getsockname()[1]
+        channel = ChatbotChannel(f"ws://localhost:{port}")
+
+        async def collect(text):
+            return [frame async for frame in channel.stream({"type": "asr_text", "text": text})]
+
+        first, second = await asyncio.gather(collect("one two three"), collect("four five"))
+        assert [f["text"] for f in first] == ["one", "two", "three", "one two three"]
+        assert [f["seq"] for f in first] == [0, 1, 2, 3]
+        assert first[-1]["type"] == "bot_response" and second[-1]["text"] == "four five"
+        assert channel.in_flight == 0
+
+        await channel.close()
+    print("✓ Streamed deltas reach their own caller in order, followed by the final reply")
+
+
+async def _run_stream_release():
+    async with websockets.serve(_streaming_chatbot, "localhost", 0) as server:
+        port = server.sockets[0].getsockname()[1]
+        manager = ConnectionManager()
+        manager.chatbot_pool = ChatbotConnectionPool(f"ws://localhost:{port}", min_size=0)
+        await manager.connect(RecordingWebSocket(), "alice", "room_1")
+
+        # 最终回复返回时流已经结束，不等垃圾回收
+        final = await manager.stream_from_asr_chatbot("room_1", {"type": "asr_text", "text": "one two"})
+        assert final["text"] == "one two"
+        assert manager.chatbot_pool.in_flight == 0
+
+        # 中途取消同样立即释放
+        task = asyncio.create_task(manager.stream_from_asr_chatbot("room_1", {"type": "asr_text", "text": "a b c d e"}))
+        await asyncio.sleep(0.025)
+        assert manager.chatbot_pool.in_flight == 1
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        assert manager.chatbot_pool.in_flight == 0
+
+        manager.disconnect("alice")
+        await manager.chatbot_pool.close()
+    print("✓ A relayed stream releases its chatbot request as soon as it returns or is cancelled")
+
+
+async def _run_audio_after_final_text():
+    async with websockets.serve(_speaking_chatbot, "localhost", 0) as server:
+        port = server.sockets[0].getsockname()[1]
+        channel = ChatbotChannel(f"ws://localhost:{port}")
+        frames = [frame async for frame in channel.stream({"type": "asr_text", "text": "你好"})]
+        assert [f["type"] for f in frames] == ["bot_response_delta", "bot_response", "bot_audio"]
+        assert channel.in_flight == 0
+        await channel.close()
+
+        # 信令服务器在语音合成完成之前就拿到最终文本，音频随后交给机器人播放
+        class FakeBotMedia:
+            def __init__(self):
+                self.spoken = []
+
+            async def speak(self, room_id, audio_file):
+                self.spoken.append((room_id, audio_file))
+
+            async def remove_client(self, room_id, client_id):
+                pass
+
+            async def close_room(self, room_id):
+                pass
+
+        manager = ConnectionManager()
+        manager.chatbot_pool = ChatbotConnectionPool(f"ws://localhost:{port}", min_size=0)
+        manager.bot_media = FakeBotMedia()
+        await manager.connect(RecordingWebSocket(), "alice", "room_1")
+        final = await asyncio.wait_for(manager.stream_from_asr_chatbot("room_1", {"type": "asr_text", "text": "你好"}),
+                                       0.08)
+        assert final["type"] == "bot_response" and "audio_file" not in final
+        assert manager.bot_media.spoken == []
+        await asyncio.sleep(0.2)
+        assert manager.bot_media.spoken == [("room_1", "/tmp/reply.wav")]
+        assert not manager.tasks and manager.chatbot_pool.in_flight == 0
+
+        manager.disconnect("alice")
+        await manager.chatbot_pool.close()
+    print("✓ The final text arrives before speech synthesis ends; the audio follows on the same stream")
+
+
+async def _run_malformed_frames():
+    async with websockets.serve(_garbling_chatbot, "localhost", 0) as server:
+        port = server.sockets[0].getsockname()[1]
+        channel = ChatbotChannel(f"ws://localhost:{port}", request_timeout=1)
+
+        # 畸形帧被跳过，没有request_id的回复按顺序交给普通请求和流式请求
+        reply = await channel.request({"type": "asr_text", "text": "a"})
+        assert reply["text"] == "echo:a"
+        frames = [frame async for frame in channel.stream({"type": "asr_text", "text": "b"})]
+        assert [f["text"] for f in frames] == ["echo:b"]
+        assert channel.is_open
+
+        # 读取任务退出后通道标记为关闭，进行中的流式请求立即失败
+        stream = channel.stream({"type": "asr_text", "text": "bye"})
+        try:
+            await asyncio.wait_for(stream.__anext__(), 1)
+        except ConnectionError:
+            pass
+        else:
+            raise AssertionError("stream survived a closed channel")
+        assert not channel.is_open and channel.in_flight == 0
+        await channel.close()
+    print("✓ Malformed frames are skipped and a dead reader fails its requests and closes the channel")
+
+
+def test_concurrent_requests_are_demultiplexed():
+    asyncio.run(_run_concurrent_requests())
+
+
+def test_pool_warmup_cap_and_idle_reaping():
+    asyncio.run(_run_pool_lifecycle())
+
+
+def test_pool_locking():
+    asyncio.run(_run_pool_locking())
+
+
+def test_streaming_requests():
+    asyncio.run(_run_streaming_requests())
+
+
+def test_stream_release():
+    asyncio.run(_run_stream_release())
+
+
+def test_audio_after_final_text():
+    asyncio.run(_run_audio_after_final_text())
+
+
+def test_malformed_frames():
+    asyncio.run(_run_malformed_frames())
+
+
+if __name__ == "__main__":
+    test_concurrent_requests_are_demultiplexed()
+    test_pool_warmup_cap_and_idle_reaping()
+    test_pool_locking()
+    test_streaming_requests()
+    test_stream_release()
+    test_audio_after_final_text()
+    test_malformed_frames()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test the client->rooms reverse index and the cleanup of empty rooms on disconnect.
+"""
+
+import asyncio
+import logging
+
+from fake_websocket import RecordingWebSocket
+from voice_chat_server import ConnectionManager
+
+
+async def _run_index_and_cleanup():
+    manager = ConnectionManager()
+    manager.resume_window = 60
+    sockets = {}
+    for i in range(12):
+        sockets[f"client_{i}"] = RecordingWebSocket()
+        await manager.connect(sockets[f"client_{i}"], f"client_{i}", f"room_{i % 4}")
+    # 同一client_id未续传就重连到另一个房间：离开原来的房间，只属于新房间
+    await manager.connect(RecordingWebSocket(), "client_0", "room_extra")
+    await asyncio.sleep(0.01)
+
+    assert set(manager.rooms) == {"room_0", "room_1", "room_2", "room_3", "room_extra"}
+    assert manager.clients["client_0"].rooms == {"room_extra"}
+    assert manager.rooms["room_0"] == {"client_4", "client_8"}
+    assert [m["client_id"] for m in sockets["client_4"].of_type("user_left")] == ["client_0"]
+    assert set(manager.backend._presence["room_0"].members) == {"client_4", "client_8"}
+    # 反向索引与房间成员表一致
+    for client_id, record in manager.clients.items():
+        for room_id in record.rooms:
+            assert client_id in manager.rooms[room_id]
+    for room_id, members in manager.rooms.items():
+        for client_id in members:
+            assert room_id in manager.clients[client_id].rooms
+
+    # 给房间留下快照、消息日志和限流状态，断开后都应随房间一起释放
+    for room_id, members in list(manager.rooms.items()):
+        member = next(iter(members))
+        await manager.send_presence(room_id, member)
+        manager.admission.check_rate(member, room_id)
+    assert manager._snapshots and manager.room_logs and manager.admission._room_buckets
+
+    manager.disconnect("client_0")
+    assert "room_extra" not in manager.rooms
+    for i in range(1, 12):
+        manager.disconnect(f"client_{i}")
+    await asyncio.sleep(0.01)
+
+    assert manager.rooms == {} and manager.clients == {}
+    assert manager._snapshots == {} and manager.room_logs == {} and manager.backend._presence == {}
+    assert manager.admission._room_buckets == {} and manager.admission._client_buckets == {}
+    print("✓ The client->rooms index stays consistent, switching rooms leaves the old one, empty rooms are dropped")
+
+
+def test_index_and_cleanup():
+    asyncio.run(_run_index_and_cleanup())
+
+
+async def _run_background_tasks():
+    manager = ConnectionManager()
+    await manager.connect(RecordingWebSocket(), "alice", "room_1")
+    await manager.connect(RecordingWebSocket(), "bob", "room_1")
+    manager.disconnect("bob")
+    manager.on_backend_message("room_1", None, None, '{"type":"user_joined","client_id":"carol"}')
+    # 后台任务在完成前一直被引用，不会被垃圾回收
+    assert len(manager.tasks) == 2
+
+    failures = []
+    handler = logging.Handler()
+    handler.emit = failures.append
+    server_logger = logging.getLogger("voice_chat_server")
+    server_logger.addHandler(handler)
+    # 直接运行本文件时__main__关闭了日志
+    disabled = logging.root.manager.disable
+    logging.disable(logging.NOTSET)
+    try:
+        async def broken():
+            raise RuntimeError("boom")
+        manager.spawn(broken())
+        await asyncio.sleep(0.01)
+    finally:
+        logging.disable(disabled)
+        server_logger.removeHandler(handler)
+    assert not manager.tasks
+    assert [record.exc_info[1].args for record in failures] == [("boom",)]
+    manager.disconnect("alice")
+    print("✓ Fire-and-forget work runs as tracked tasks whose failures are logged")
+
+
+def test_background_tasks():
+    asyncio.run(_run_background_tasks())
+
+
+if __name__ == "__main__":
+    logging.disable(logging.CRITICAL)
+    test_index_and_cleanup()
+    test_background_tasks()
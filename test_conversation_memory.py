@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test the per-session conversation memory store used by the chatbot servers.
+"""
+
+import logging
+
+from conversation_memory import ConversationStore
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_sessions_are_separate():
+    store = ConversationStore(clock=FakeClock())
+    store.append("room-a", "你好", "你好！")
+    store.append("room-b", "天气怎么样", "晴天")
+    store.append("room-a", "再见", "再见！")
+    assert store.turns("room-a") == [("你好", "你好！"), ("再见", "再见！")]
+    assert store.turns("room-b") == [("天气怎么样", "晴天")]
+    assert store.turns("room-c") == []
+
+    assert store.clear("room-a") and not store.clear("room-a")
+    assert store.turns("room-a") == [] and store.turns("room-b") == [("天气怎么样", "晴天")]
+    assert store.bytes == len("天气怎么样晴天".encode("utf-8"))
+    print("✓ each session keeps its own turns and reset clears only that session")
+
+
+def test_turn_limit():
+    store = ConversationStore(max_turns=3, clock=FakeClock())
+    for i in range(5):
+        store.append("room", f"q{i}", f"a{i}")
+    assert store.turns("room") == [("q2", "a2"), ("q3", "a3"), ("q4", "a4")]
+    assert store.bytes == 12
+    print("✓ older turns drop off once a session reaches max_turns")
+
+
+def test_turn_limit_validation():
+    try:
+        ConversationStore(max_turns=0)
+        assert False, "max_turns=0 was accepted"
+    except ValueError:
+        pass
+    store = ConversationStore(max_turns=1, clock=FakeClock())
+    store.append("room", "q0", "a0")
+    store.append("room", "q1", "a1")
+    assert store.turns("room") == [("q1", "a1")] and store.bytes == 4
+    print("✓ max_turns below 1 is rejected and a one-turn store keeps only the latest turn")
+
+
+def test_lru_eviction():
+    store = ConversationStore(max_sessions=2, clock=FakeClock())
+    store.append("a", "q", "a")
+    store.append("b", "q", "a")
+    # 读取a使其成为最近使用，新会话挤掉b
+    store.turns("a")
+    store.append("c", "q", "a")
+    assert list(store.sessions) == ["a", "c"]
+    assert store.evictions["lru"] == 1 and store.bytes == 4
+    print("✓ the least recently used session is evicted past max_sessions")
+
+
+def test_byte_limit():
+    store = ConversationStore(max_bytes=10, clock=FakeClock())
+    store.append("a", "1234", "5678")
+    store.append("b", "abc", "def")
+    assert list(store.sessions) == ["b"] and store.bytes == 6
+    assert store.evictions["bytes"] == 1
+
+    # 单个会话超出上限时丢弃它最早的轮次
+    store.append("b", "ghi", "jkl")
+    assert store.turns("b") == [("ghi", "jkl")] and store.bytes == 6
+    store.append("b", "x" * 20, "y")
+    assert store.turns("b") == [] and store.bytes == 0
+    print("✓ byte limit evicts other sessions first, then the oldest turns")
+
+
+def test_idle_ttl():
+    clock = FakeClock()
+    store = ConversationStore(idle_ttl=60, clock=clock)
+    store.append("a", "q", "a")
+    clock.now = 30
+    store.append("b", "q", "a")
+    clock.now = 70
+    assert store.turns("b") == [("q", "a")]
+    assert "a" not in store.sessions and store.evictions["ttl"] == 1
+    clock.now = 200
+    assert store.turns("b") == [] and len(store) == 0 and store.bytes == 0
+    print("✓ sessions idle longer than the TTL are dropped")
+
+
+if __name__ == "__main__":
+    logging.disable(logging.CRITICAL)
+    test_sessions_are_separate()
+    test_turn_limit()
+    test_turn_limit_validation()
+    test_lru_eviction()
+    test_byte_limit()
+    test_idle_ttl()
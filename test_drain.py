@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test drain mode: in-flight chatbot requests finish before clients get a reconnect hint.
+"""
+
+import asyncio
+import logging
+
+from fastapi.testclient import TestClient
+
+import voice_chat_server
+from fake_websocket import RecordingWebSocket
+from voice_chat_server import ConnectionManager, app
+
+
+async def _run_drain():
+    manager = ConnectionManager()
+    alice = RecordingWebSocket()
+    await manager.connect(alice, "alice", "room_1")
+
+    async def slow_chatbot_call():
+        async with manager.admission.slot():
+            await asyncio.sleep(0.3)
+            await manager.broadcast_to_room("room_1", {"type": "bot_response", "text": "done"})
+
+    in_flight = asyncio.create_task(slow_chatbot_call())
+    await asyncio.sleep(0.01)
+    await manager.drain(deadline=5, reconnect_url="ws://standby:8001")
+    await in_flight
+
+    # 进行中的回复先送达，然后才是重连提示
+    types = [m["type"] for m in alice.received]
+    assert types.index("bot_response") < types.index("reconnect")
+    assert alice.received[-1] == {"type": "reconnect", "url": "ws://standby:8001", "retry_after": 1.0}
+    assert alice.close_code == 1012
+
+    # 排空期间拒绝新房间，已有房间仍可加入
+    assert manager.connection_rejection("bob", "room_2") == "draining"
+    assert manager.connection_rejection("bob", "room_1") is None
+    manager.disconnect("alice")
+    print("✓ Drain waits for in-flight chatbot replies, then sends a reconnect hint and closes")
+
+
+def test_drain():
+    asyncio.run(_run_drain())
+
+
+def test_admin_drain_requires_token():
+    started = []
+    start_drain, token = voice_chat_server.start_drain, voice_chat_server.ADMIN_TOKEN
+    # 不真正排空：start_drain最后会向本进程发送SIGTERM
+    voice_chat_server.start_drain = lambda reconnect_url="": started.append(reconnect_url) or True
+    client = TestClient(app)
+    try:
+        # 未配置ADMIN_TOKEN时接口关闭，任何请求都被拒绝
+        voice_chat_server.ADMIN_TOKEN = ""
+        assert client.post("/admin/drain").status_code == 403
+        assert client.post("/admin/drain", headers={"X-Admin-Token": ""}).status_code == 403
+
+        voice_chat_server.ADMIN_TOKEN = "s3cret"
+        assert client.post("/admin/drain", headers={"X-Admin-Token": "wrong"}).status_code == 403
+        assert not started
+        response = client.post("/admin/drain", headers={"X-Admin-Token": "s3cret"})
+        assert response.status_code == 200 and response.json()["started"] is True
+        assert len(started) == 1
+    finally:
+        voice_chat_server.start_drain, voice_chat_server.ADMIN_TOKEN = start_drain, token
+    print("✓ /admin/drain is closed without ADMIN_TOKEN and only accepts the configured token")
+
+
+if __name__ == "__main__":
+    logging.disable(logging.CRITICAL)
+    test_drain()
+    test_admin_drain_requires_token()
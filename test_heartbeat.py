@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test heartbeat reaping: idle clients are pinged, silent ones are evicted with user_left.
+"""
+
+import asyncio
+import logging
+
+import voice_chat_server
+from fake_websocket import RecordingWebSocket, ScriptedWebSocket
+from voice_chat_server import ConnectionManager, websocket_endpoint
+
+
+async def _run_zombie_reaping():
+    manager = ConnectionManager()
+    alive, zombie = RecordingWebSocket(), RecordingWebSocket()
+    alive_record = await manager.connect(alive, "alive", "room_1")
+    await manager.connect(zombie, "zombie", "room_1")
+    manager.start_heartbeat(interval=0.05, missed_pongs=3)
+
+    # 在线客户端回应ping（接收循环会更新last_seen），半开连接没有任何响应
+    loop = asyncio.get_running_loop()
+    for _ in range(6):
+        await asyncio.sleep(0.05)
+        if any(m["type"] == "ping" for m in alive.received):
+            alive_record.last_seen = loop.time()
+
+    assert {"type": "ping"} in zombie.received
+    assert "zombie" not in manager.clients
+    assert manager.rooms["room_1"] == {"alive"}
+    assert zombie.close_code == 1001
+    assert {"type": "user_left", "client_id": "zombie"} in alive.received
+    assert "alive" in manager.clients
+
+    manager.stop_heartbeat()
+    manager.disconnect("alive")
+    print("✓ Silent connections are pinged, then evicted with user_left; responsive ones stay")
+
+
+def test_zombie_reaping():
+    asyncio.run(_run_zombie_reaping())
+
+
+async def _run_slow_chatbot_outlives_heartbeat():
+    manager = voice_chat_server.manager
+
+    async def slow_chatbot(room_id, message):
+        # 回复耗时远超心跳窗口（2个间隔）
+        await asyncio.sleep(0.4)
+        return {"type": "bot_response", "text": "想了很久的回复"}
+
+    manager.stream_from_asr_chatbot = manager.send_to_asr_chatbot = slow_chatbot
+    alice = ScriptedWebSocket(pong=True)
+    endpoint = asyncio.create_task(websocket_endpoint(alice, "alice", "slow_room"))
+    try:
+        await asyncio.sleep(0.01)
+        manager.start_heartbeat(interval=0.05, missed_pongs=2)
+        alice.push({"type": "asr_text", "text": "你好"})
+        await asyncio.sleep(0.6)
+
+        # 等待回复期间接收循环仍在读取pong，客户端没有被当作半开连接清理
+        assert alice.of_type("ping")
+        assert alice.close_code is None and "alice" in manager.clients
+        assert alice.of_type("bot_response")[0]["text"] == "想了很久的回复"
+    finally:
+        manager.stop_heartbeat()
+        del manager.stream_from_asr_chatbot, manager.send_to_asr_chatbot
+        await alice.close()
+        await endpoint
+    assert "alice" not in manager.clients
+
+
+def test_slow_chatbot_outlives_heartbeat():
+    asyncio.run(_run_slow_chatbot_outlives_heartbeat())
+    print("✓ A client waiting on a slow chatbot reply keeps answering pings and is not evicted")
+
+
+if __name__ == "__main__":
+    logging.disable(logging.CRITICAL)
+    test_zombie_reaping()
+    test_slow_chatbot_outlives_heartbeat()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test the load generator's latency bookkeeping and report aggregation.
+"""
+
+import io
+import time
+import asyncio
+import logging
+import contextlib
+
+from load_generator import SDP_STAMP, LoadGenerator, LoadStats, SimulatedClient, parse_args, percentile
+
+
+class RecordingClient(SimulatedClient):
+    """SimulatedClient without a socket: records what it would send"""
+
+    def __init__(self, generator, client_id, room_id):
+        super().__init__(generator, client_id, room_id)
+        self.outbox = []
+
+    async def send(self, message: dict):
+        self.outbox.append(message)
+
+
+def test_percentile():
+    values = [i / 1000 for i in range(1, 101)]
+    # 返回毫秒
+    assert percentile(values, 0.5) == 51.0
+    assert percentile(values, 0.95) == 96.0
+    assert percentile(values, 0.99) == 100.0
+    assert percentile(list(reversed(values)), 0.5) == 51.0
+    assert percentile([0.002], 0.99) == 2.0
+    assert percentile([], 0.5) == 0.0
+    print("✓ percentile sorts the samples, returns milliseconds and handles empty and single samples")
+
+
+def test_report():
+    stats = LoadStats()
+    for i in range(1, 101):
+        stats.observe("offer", i / 1000)
+    stats.observe("bot_response", 0.25)
+    stats.connects, stats.connect_failures = 12, 2
+    stats.errors.update({"rate_limited": 3, "chatbot_unavailable": 1})
+
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        stats.report(elapsed=30.0, ramp_seconds=0.5, initial_clients=10)
+    lines = out.getvalue().splitlines()
+    assert lines[0] == "Connections: 10 opened in 0.50s (20/s), 12 total, 2 failed"
+    assert lines[1] == "Test phase: 30.0s"
+    # 消息类型按名称排序，每行：数量、p50、p95、p99、最大值
+    rows = {line.split()[0]: line.split()[1:] for line in lines[4:-1]}
+    assert list(rows) == ["bot_response", "offer"]
+    assert rows["offer"] == ["100", "51.00", "96.00", "100.00", "100.00"]
+    assert rows["bot_response"] == ["1", "250.00", "250.00", "250.00", "250.00"]
+    # 错误按次数从多到少
+    assert lines[-1] == "errors: rate_limited=3, chatbot_unavailable=1"
+
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        LoadStats().report(elapsed=1.0, ramp_seconds=0.0, initial_clients=0)
+    assert "(0/s)" in out.getvalue() and "errors" not in out.getvalue()
+    print("✓ The report aggregates samples per message type, connection counters and error codes")
+
+
+async def _run_client_bookkeeping():
+    generator = LoadGenerator(parse_args([]))
+    alice = RecordingClient(generator, "alice", "room")
+    bob = RecordingClient(generator, "bob", "room")
+    stats = generator.stats
+
+    alice.pending_users.append(time.perf_counter())
+    generator.join_started["bob"] = time.perf_counter()
+    await alice._handle({"type": "users_list", "users": ["alice", "carol"]})
+    await alice._handle({"type": "user_joined", "client_id": "bob"})
+    # 新加入的成员向已有成员发offer
+    assert alice.peers == {"carol", "bob"} and [m["target"] for m in alice.outbox] == ["carol"]
+
+    offer = alice.outbox[0]
+    await bob._handle({"type": "offer", "sender": "alice", "sdp": offer["sdp"]})
+    assert bob.outbox[-1]["type"] == "answer" and SDP_STAMP in bob.outbox[-1]["sdp"]
+    await alice._handle({"type": "answer", "sender": "bob", "sdp": bob.outbox[-1]["sdp"]})
+    await alice._handle({"type": "ice_candidate", "candidate": {"sent_at": time.perf_counter()}})
+    await alice._handle({"type": "ice_candidate", "candidate": {}})
+
+    # 只统计第一个delta，以及发给自己的回复
+    await alice.send_asr_text()
+    await alice._handle({"type": "bot_response_delta", "client_id": "alice", "seq": 0})
+    await alice._handle({"type": "bot_response_delta", "client_id": "alice", "seq": 1})
+    await alice._handle({"type": "bot_response", "client_id": "bob"})
+    await alice._handle({"type": "bot_response", "client_id": "alice"})
+    # 被拒绝的请求计入errors并不再等待回复
+    await alice.send_asr_text()
+    await alice._handle({"type": "error", "code": "rate_limited"})
+    assert not alice.pending_asr
+
+    generator.leave_started["carol"] = time.perf_counter()
+    await alice._handle({"type": "user_left", "client_id": "carol"})
+    await alice._handle({"type": "ping"})
+    assert alice.peers == {"bob"} and alice.outbox[-1] == {"type": "pong"}
+
+    counts = {msg_type: len(values) for msg_type, values in stats.latencies.items()}
+    assert counts == {"users_list": 1, "user_joined": 1, "offer": 1, "answer": 1, "ice_candidate": 1,
+                      "bot_response_delta": 1, "bot_response": 1, "user_left": 1}
+    assert all(value >= 0 for values in stats.latencies.values() for value in values)
+    assert stats.errors == {"rate_limited": 1}
+    print("✓ Simulated clients record one latency sample per measured message and count error frames")
+
+
+def test_client_bookkeeping():
+    asyncio.run(_run_client_bookkeeping())
+
+
+if __name__ == "__main__":
+    logging.disable(logging.CRITICAL)
+    test_percentile()
+    test_report()
+    test_client_bookkeeping()
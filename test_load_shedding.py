@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test event-loop-lag load shedding: tier hysteresis, deferred presence, rejected asr_text and refused connections.
+"""
+
+import json
+import time
+import asyncio
+import logging
+
+from fastapi.testclient import TestClient
+
+import voice_chat_server
+from fake_websocket import RecordingWebSocket
+from load_shedding import LoadShedder, ShedLevel, parse_tiers, websockets_shedding_handler
+from voice_chat_server import ConnectionManager, app
+
+
+def test_tier_hysteresis():
+    shedder = LoadShedder(parse_tiers("defer=0.1:0.05,reject=0.25:0.1,refuse=0.5:0.2"), hold=1.0)
+    assert shedder.update(0.3, 0) == ShedLevel.REJECT
+    # 低于进入阈值但高于退出阈值：保持
+    assert shedder.update(0.2, 5) == ShedLevel.REJECT
+    # 低于退出阈值，但进入后不足hold秒：保持
+    shedder.update(0.6, 10)
+    assert shedder.update(0.01, 10.5) == ShedLevel.REFUSE
+    # 之后每次只降一级，每级都要保持hold秒
+    assert shedder.update(0.01, 11) == ShedLevel.REJECT
+    assert shedder.update(0.01, 11.5) == ShedLevel.REJECT
+    assert shedder.update(0.01, 12) == ShedLevel.DEFER
+    assert shedder.update(0.07, 13) == ShedLevel.DEFER
+    assert shedder.update(0.01, 14) == ShedLevel.NORMAL
+
+    # 只配置了部分级别时，跳过未配置的级别
+    shedder = LoadShedder(parse_tiers("refuse=0.5:0.2"), hold=0)
+    assert shedder.update(0.3, 0) == ShedLevel.NORMAL
+    assert shedder.update(0.6, 1) == ShedLevel.REFUSE
+    assert shedder.update(0.1, 2) == ShedLevel.NORMAL
+    print("✓ Tiers are entered at their thresholds and left one at a time below their exit thresholds")
+
+
+async def _run_lag_monitor():
+    shedder = LoadShedder(parse_tiers("defer=0.05:0.02"), interval=0.02, hold=0)
+    shedder.start()
+    await asyncio.sleep(0.05)
+    # 阻塞事件循环模拟过载
+    time.sleep(0.12)
+    await asyncio.sleep(0.01)
+    assert shedder.lag > 0.05 and shedder.level == ShedLevel.DEFER
+    await asyncio.sleep(0.1)
+    assert shedder.level == ShedLevel.NORMAL
+    shedder.stop()
+
+
+def test_lag_monitor():
+    asyncio.run(_run_lag_monitor())
+    print("✓ The monitor measures a blocked loop and recovers once it catches up")
+
+
+async def _run_deferred_presence():
+    manager = ConnectionManager()
+    alice = RecordingWebSocket()
+    await manager.connect(alice, "alice", "room_1")
+    manager.shedder.hold = 0
+    manager.shedder.update(0.15, 0)
+    assert manager.shedder.level == ShedLevel.DEFER
+
+    # 过载时get_users被推迟，同一客户端重复请求只回复一次
+    await manager.send_presence("room_1", "alice")
+    await manager.send_presence("room_1", "alice")
+    await asyncio.sleep(0.01)
+    assert not any(m["type"] == "users_list" for m in alice.received)
+    assert manager.shedder.deferred == 1
+
+    manager.shedder.update(0.01, 1)
+    await asyncio.sleep(0.01)
+    assert [m["type"] for m in alice.received].count("users_list") == 1
+
+    # 拒绝新连接，但已连接客户端的重连不受影响
+    manager.shedder.update(0.6, 2)
+    assert manager.connection_rejection("bob", "room_1") == "overloaded"
+    assert manager.connection_rejection("alice", "room_1") is None
+    manager.disconnect("alice")
+
+
+def test_deferred_presence():
+    asyncio.run(_run_deferred_presence())
+    print("✓ get_users is deferred and coalesced under lag; new connections are refused at the top tier")
+
+
+def test_asr_text_rejected():
+    shedder = voice_chat_server.manager.shedder
+    client = TestClient(app)
+    try:
+        with client.websocket_connect("/ws/alice/shed_room") as alice:
+            shedder.level = ShedLevel.REJECT
+            alice.send_text(json.dumps({"type": "asr_text", "text": "你好"}))
+            error = alice.receive_json()
+            assert error["type"] == "error" and error["code"] == "overloaded" and error["retry_after"] > 0
+    finally:
+        shedder.level = ShedLevel.NORMAL
+    print("✓ asr_text is rejected with an overloaded error at the reject tier")
+
+
+async def _run_websockets_handler():
+    async def metrics(path, headers):
+        return (200, [], b"metrics") if path == "/metrics" else None
+
+    shedder = LoadShedder(parse_tiers("refuse=0.5:0.2"))
+    handler = websockets_shedding_handler(shedder, metrics)
+    assert await handler("/", {}) is None
+    shedder.update(0.6, 0)
+    assert (await handler("/", {}))[0] == 503
+    assert (await handler("/metrics", {}))[2] == b"metrics"
+
+
+def test_websockets_handler():
+    asyncio.run(_run_websockets_handler())
+    print("✓ Chatbot servers refuse new WebSocket connections with 503 but keep serving metrics")
+
+
+if __name__ == "__main__":
+    logging.disable(logging.CRITICAL)
+    test_tier_hysteresis()
+    test_lag_monitor()
+    test_deferred_presence()
+    test_asr_text_rejected()
+    test_websockets_handler()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test the queue-based structured logging helpers.
+"""
+
+import os
+import logging
+import tempfile
+
+from log_config import MessageLogPolicy, log_event, setup_logging, stop_logging
+
+
+def test_sampling_and_levels():
+    policy = MessageLogPolicy({"ice_candidate": (logging.DEBUG, 10), "offer": (logging.INFO, 1)})
+    levels = [policy.level_for("ice_candidate") for _ in range(30)]
+    # 每10条ice_candidate只记录1条
+    assert levels.count(logging.DEBUG) == 3 and levels.count(None) == 27
+    assert policy.level_for("offer") == logging.INFO
+    assert policy.level_for("unknown") == logging.INFO
+    print("✓ Message types get their own level and high-rate types are sampled")
+
+
+def test_background_rotating_writer():
+    with tempfile.TemporaryDirectory() as tmp:
+        log_file = os.path.join(tmp, "server.log")
+        listener = setup_logging(log_file, level="INFO", max_bytes=2000, backup_count=2)
+        logger = logging.getLogger("test_log_config")
+
+        log_event(logger, logging.INFO, "message_received", type="offer", sdp="v=0 " + "x" * 5000)
+        log_event(logger, logging.DEBUG, "skipped", type="ice_candidate")
+        for i in range(40):
+            log_event(logger, logging.INFO, "filler", n=i)
+        stop_logging(listener)
+        logging.getLogger().handlers.clear()
+
+        # 超过大小上限后轮转
+        assert sorted(os.listdir(tmp)) == ["server.log", "server.log.1"]
+        with open(log_file + ".1", encoding="utf-8") as f:
+            first = f.readline()
+            rest = f.read()
+        # 长字段被截断，DEBUG事件未写入
+        assert "message_received type=offer" in first and "chars)" in first and len(first) < 400
+        assert "skipped" not in rest
+    print("✓ Records are written off-thread, truncated and rotated by size")
+
+
+def test_stderr_only():
+    listener = setup_logging(None, level="INFO")
+    try:
+        assert [type(handler) for handler in listener.handlers] == [logging.StreamHandler]
+    finally:
+        stop_logging(listener)
+        logging.getLogger().handlers.clear()
+    print("✓ Without a log file records only go to stderr")
+
+
+if __name__ == "__main__":
+    test_sampling_and_levels()
+    test_background_rotating_writer()
+    test_stderr_only()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test targeted offers, the mesh-to-relay topology switch and the aiortc forwarding peer.
+"""
+
+import asyncio
+import logging
+
+from aiortc import RTCPeerConnection, RTCSessionDescription
+from aiortc.mediastreams import AudioStreamTrack
+
+import voice_chat_server
+from fake_websocket import RecordingWebSocket
+from media_relay import RelayMediaManager
+from voice_chat_server import ConnectionManager
+
+
+async def _run_topology_switch():
+    voice_chat_server.RELAY_ROOM_THRESHOLD = 2
+    manager = ConnectionManager()
+    manager.relay_media = RelayMediaManager(manager.send_signal)
+    sockets = {name: RecordingWebSocket() for name in ("a", "b", "c", "d")}
+
+    await manager.connect(sockets["a"], "a", "room_1")
+    await manager.connect(sockets["b"], "b", "room_1")
+    await asyncio.sleep(0.01)
+    assert not any(m["type"] == "topology" for m in sockets["a"].received)
+
+    # 超过阈值时整个房间切换为中继拓扑，之后加入的成员直接收到拓扑消息
+    await manager.connect(sockets["c"], "c", "room_1")
+    await manager.connect(sockets["d"], "d", "room_1")
+    await asyncio.sleep(0.01)
+    topology = {"type": "topology", "mode": "relay", "peer": "relay"}
+    for name in ("a", "b", "c", "d"):
+        assert topology in sockets[name].received, name
+    assert manager.relay_rooms == {"room_1"}
+
+    for name in sockets:
+        manager.disconnect(name)
+    await asyncio.sleep(0.01)
+    assert manager.relay_rooms == set()
+    print("✓ Rooms above the threshold switch to relay topology until they empty")
+
+
+def _answering_relay(clients):
+    """RelayMediaManager whose renegotiation offers are answered by the clients' peer connections"""
+    relay = None
+
+    async def send_signal(client_id, message):
+        # 客户端应答中继发起的重新协商；浏览器会把它排在初始应答之后处理
+        pc = clients[client_id]
+        while pc.signalingState != "stable":
+            await asyncio.sleep(0.01)
+        await pc.setRemoteDescription(RTCSessionDescription(sdp=message["sdp"], type="offer"))
+        await pc.setLocalDescription(await pc.createAnswer())
+        relay.handle_answer("room_1", client_id, pc.localDescription.sdp)
+
+    relay = RelayMediaManager(send_signal)
+    return relay
+
+
+async def _join_relay(relay, clients, received, name):
+    pc = clients[name] = RTCPeerConnection()
+    pc.addTrack(AudioStreamTrack())
+    received[name] = []
+    pc.on("track", received[name].append)
+    await pc.setLocalDescription(await pc.createOffer())
+    answer = await relay.handle_offer("room_1", name, pc.localDescription.sdp)
+    await pc.setRemoteDescription(RTCSessionDescription(sdp=answer, type="answer"))
+
+
+async def _wait_for(condition):
+    for _ in range(50):
+        if condition():
+            return
+        await asyncio.sleep(0.1)
+
+
+def _sending(pc):
+    return [t for t in pc.getTransceivers() if t.sender.track is not None]
+
+
+async def _run_relay_forwarding():
+    clients = {}
+    relay = _answering_relay(clients)
+    received = {}
+    for name in ("a", "b", "c"):
+        await _join_relay(relay, clients, received, name)
+
+    await _wait_for(lambda: all(len(tracks) == 2 for tracks in received.values()))
+
+    # 每个成员只有一路上行，却收到其他两个成员的音频
+    assert {name: len(tracks) for name, tracks in received.items()} == {"a": 2, "b": 2, "c": 2}
+    frame = await asyncio.wait_for(received["a"][0].recv(), 5)
+    assert frame.samples > 0
+
+    await relay.close()
+    for pc in clients.values():
+        await pc.close()
+    print("✓ The relay forwards each member's single upstream to every other member")
+
+
+async def _run_relay_member_leaves():
+    clients = {}
+    relay = _answering_relay(clients)
+    received = {}
+    for name in ("a", "b", "c"):
+        await _join_relay(relay, clients, received, name)
+    members = relay.rooms["room_1"].members
+    await _wait_for(lambda: all(len(_sending(m.pc)) == 2 and m.answer is None for m in members.values()))
+    transceivers = {name: len(members[name].pc.getTransceivers()) for name in ("a", "b")}
+
+    # c离开后，其他成员连接上转发c的发送器停止，并重新协商让客户端知道
+    await relay.remove_client("room_1", "c")
+    await clients.pop("c").close()
+    await _wait_for(lambda: all(len(_sending(m.pc)) == 1 and m.answer is None for m in members.values()))
+    for name in ("a", "b"):
+        member = members[name]
+        assert list(member.forwarded) == [{"a": "b", "b": "a"}[name]]
+        assert len(_sending(member.pc)) == 1
+        idle = [t for t in member.pc.getTransceivers() if t.sender.track is None]
+        assert [t.currentDirection for t in idle] == ["inactive"]
+        assert clients[name].getTransceivers()[-1].currentDirection == "inactive"
+
+    # 之后加入的成员复用空出的收发器，SDP不会随进出次数增长
+    await _join_relay(relay, clients, received, "d")
+    await _wait_for(lambda: all(len(_sending(m.pc)) == 2 and m.answer is None for m in members.values()))
+    assert {name: len(members[name].pc.getTransceivers()) for name in ("a", "b")} == transceivers
+    assert all(sorted(members[name].forwarded) == sorted({"a", "b", "d"} - {name}) for name in members)
+
+    await relay.close()
+    for pc in clients.values():
+        await pc.close()
+    print("✓ A leaving member's forwarded tracks stop and their transceivers are reused by the next member")
+
+
+def test_topology_switch():
+    asyncio.run(_run_topology_switch())
+
+
+def test_relay_forwarding():
+    asyncio.run(_run_relay_forwarding())
+
+
+def test_relay_member_leaves():
+    asyncio.run(_run_relay_member_leaves())
+
+
+if __name__ == "__main__":
+    logging.disable(logging.CRITICAL)
+    test_topology_switch()
+    test_relay_forwarding()
+    test_relay_member_leaves()
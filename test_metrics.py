@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test the metrics registry: exposition format, recording and the websockets /metrics hook.
+"""
+
+import asyncio
+import urllib.request
+
+import websockets
+
+from metrics import MetricsRegistry, websockets_metrics_handler
+
+
+def test_exposition_format():
+    registry = MetricsRegistry()
+    messages = registry.counter("messages_total", "Messages received", ["type"])
+    rtt = registry.histogram("rtt_seconds", "Round trip", buckets=(0.1, 1.0))
+    connections = {"a", "b"}
+    registry.gauge("connections", "Open connections", lambda: len(connections))
+
+    messages.labels("offer").inc()
+    messages.labels("offer").inc()
+    messages.labels('bad"type').inc()
+    for value in (0.05, 0.5, 5):
+        rtt.observe(value)
+    assert registry.counter("messages_total", "Messages received", ["type"]) is messages
+
+    text = registry.render()
+    assert '# TYPE messages_total counter' in text
+    assert 'messages_total{type="offer"} 2' in text
+    assert 'messages_total{type="bad\\"type"} 1' in text
+    # 直方图分桶是累计值
+    assert 'rtt_seconds_bucket{le="0.1"} 1' in text
+    assert 'rtt_seconds_bucket{le="1.0"} 2' in text
+    assert 'rtt_seconds_bucket{le="+Inf"} 3' in text
+    assert 'rtt_seconds_count 3' in text and 'rtt_seconds_sum 5.55' in text
+    assert 'connections 2' in text
+    print("✓ Counters, histograms and callback gauges render in the text exposition format")
+
+
+def test_recording():
+    # 记录开销的测量见bench_metrics.py；这里只检查记录的结果
+    registry = MetricsRegistry()
+    messages = registry.counter("messages_total", "Messages received", ["type"])
+    offers = messages.labels("offer")
+    # 同一组标签总是返回同一个子指标，热路径可以缓存它
+    assert messages.labels("offer") is offers
+    for _ in range(1000):
+        offers.inc()
+    offers.inc(2.5)
+    assert offers.value == 1002.5
+    try:
+        messages.labels("offer", "extra")
+        assert False, "labels() accepted the wrong number of label values"
+    except ValueError:
+        pass
+
+    rtt = registry.histogram("rtt_seconds", "Round trip", buckets=(0.1, 1.0))
+    # 等于上界的样本计入该分桶（le即小于等于）
+    for value in (0.1, 0.1000001, 1.0, 7.0):
+        rtt.observe(value)
+    child = rtt.labels()
+    assert child.counts == [1, 2, 1] and child.count == 4
+    assert 'rtt_seconds_bucket{le="0.1"} 1' in registry.render()
+    print("✓ Counter children are cached per label set and histogram samples land in inclusive buckets")
+
+
+async def _run_websockets_endpoint():
+    registry = MetricsRegistry()
+    registry.counter("requests_total", "Requests").inc()
+
+    async def echo(websocket, path):
+        async for message in websocket:
+            await websocket.send(message)
+
+    async with websockets.serve(echo, "localhost", 0, process_request=websockets_metrics_handler(registry)) as server:
+        port = server.sockets[0].getsockname()[1]
+        body = await asyncio.to_thread(lambda: urllib.request.urlopen(f"http://localhost:{port}/metrics").read())
+        assert b"requests_total 1" in body
+
+        # WebSocket连接不受影响
+        async with websockets.connect(f"ws://localhost:{port}/") as client:
+            await client.send("ping")
+            assert await client.recv() == "ping"
+    print("✓ The chatbot server's WebSocket port also serves GET /metrics")
+
+
+def test_websockets_endpoint():
+    asyncio.run(_run_websockets_endpoint())
+
+
+if __name__ == "__main__":
+    test_exposition_format()
+    test_recording()
+    test_websockets_endpoint()
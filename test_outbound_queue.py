@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test per-connection outbound queues: slow clients are isolated and overflow policies apply.
+"""
+
+import json
+import asyncio
+
+from fake_websocket import RecordingWebSocket
+from outbound_queue import OutboundQueue, OverflowPolicy
+
+
+async def _run_slow_client_isolation():
+    slow, fast = RecordingWebSocket(delay=10), RecordingWebSocket()
+    queues = [OutboundQueue(slow, "slow"), OutboundQueue(fast, "fast")]
+    for queue in queues:
+        queue.start()
+
+    for i in range(3):
+        for queue in queues:
+            queue.put_nowait(f"msg_{i}")
+    await asyncio.sleep(0.01)
+
+    # 慢客户端卡住时，快客户端已经收到全部消息
+    assert fast.sent == ["msg_0", "msg_1", "msg_2"]
+    assert slow.sent == []
+    for queue in queues:
+        queue.close()
+    print("✓ A stalled client does not delay the rest of the room")
+
+
+async def _run_overflow_policies():
+    stalled = RecordingWebSocket(delay=10)
+    queue = OutboundQueue(stalled, "drop", maxsize=2, policy=OverflowPolicy.DROP_OLDEST)
+    for i in range(5):
+        assert queue.put_nowait(f"msg_{i}")
+    assert queue.depth == 2 and queue.dropped == 3
+
+    stalled = RecordingWebSocket(delay=10)
+    queue = OutboundQueue(stalled, "disconnect", maxsize=2, policy=OverflowPolicy.DISCONNECT)
+    assert queue.put_nowait("a") and queue.put_nowait("b")
+    assert not queue.put_nowait("c")
+    await asyncio.sleep(0)
+    assert queue.closed and stalled.close_code == 1013
+
+    stalled = RecordingWebSocket(delay=10)
+    queue = OutboundQueue(stalled, "block", maxsize=1, policy=OverflowPolicy.BLOCK)
+    await queue.put("a")
+    blocked = asyncio.create_task(queue.put("b"))
+    await asyncio.sleep(0.01)
+    assert not blocked.done()
+    blocked.cancel()
+    print("✓ drop_oldest, disconnect and block overflow policies behave as configured")
+
+
+async def _run_close_wakes_blocked_put():
+    stalled = RecordingWebSocket(delay=10)
+    queue = OutboundQueue(stalled, "block", maxsize=1, policy=OverflowPolicy.BLOCK)
+    await queue.put("a")
+    blocked = [asyncio.create_task(queue.put(f"msg_{i}")) for i in range(2)]
+    await asyncio.sleep(0.01)
+    assert not any(task.done() for task in blocked)
+
+    # 慢客户端断开：阻塞中的发送者立即返回False，而不是永远等待
+    queue.close()
+    assert await asyncio.wait_for(asyncio.gather(*blocked), 1) == [False, False]
+    assert not await queue.put("c")
+
+    # 调用方自己被取消时，取消照常传播
+    queue = OutboundQueue(stalled, "block", maxsize=1, policy=OverflowPolicy.BLOCK)
+    await queue.put("a")
+    blocked = asyncio.create_task(queue.put("b"))
+    await asyncio.sleep(0.01)
+    blocked.cancel()
+    await asyncio.gather(blocked, return_exceptions=True)
+    assert blocked.cancelled() and queue.depth == 1
+    print("✓ Closing a full block-policy queue releases the senders waiting on it")
+
+
+async def _run_coalescing():
+    ws = RecordingWebSocket()
+    queue = OutboundQueue(ws, "batch")
+    queue.start()
+    for i in range(3):
+        queue.put_batched(json.dumps({"type": "ice_candidate", "n": i}), 0.02)
+    await asyncio.sleep(0.005)
+    assert ws.sent == []
+    await asyncio.sleep(0.03)
+
+    # 窗口内的候选合并为一个batch帧
+    assert len(ws.sent) == 1
+    batch = json.loads(ws.sent[0])
+    assert batch["type"] == "batch" and [m["n"] for m in batch["messages"]] == [0, 1, 2]
+
+    # 非合并消息会先冲刷待发送的batch，保证顺序
+    queue.put_batched('{"n":3}', 1.0)
+    queue.put_nowait('{"n":4}')
+    await asyncio.sleep(0.01)
+    assert ws.sent[1:] == ['{"n":3}', '{"n":4}']
+    queue.close()
+    print("✓ Batched frames are coalesced within the window and keep their order")
+
+
+def test_slow_client_isolation():
+    asyncio.run(_run_slow_client_isolation())
+
+
+def test_overflow_policies():
+    asyncio.run(_run_overflow_policies())
+
+
+def test_close_wakes_blocked_put():
+    asyncio.run(_run_close_wakes_blocked_put())
+
+
+def test_coalescing():
+    asyncio.run(_run_coalescing())
+
+
+if __name__ == "__main__":
+    test_slow_client_isolation()
+    test_overflow_policies()
+    test_close_wakes_blocked_put()
+    test_coalescing()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test versioned presence snapshots and get_users delta sync.
+"""
+
+import json
+import asyncio
+import logging
+
+from fake_websocket import RecordingWebSocket
+from local_broker import LocalBroker
+from presence import VersionedMembers
+from room_backend import BrokerRoomBackend
+from voice_chat_server import ConnectionManager
+
+
+def test_versioned_members():
+    members = VersionedMembers(history=4)
+    members.add("alice")
+    members.add("bob")
+    first_seen = seen = members.version
+    assert not members.add("bob") and members.version == seen
+
+    members.add("carol")
+    members.discard("alice")
+    delta = members.since(seen)
+    assert delta.members is None and delta.added == ["carol"] and delta.removed == ["alice"]
+    assert members.since(members.version).unchanged
+
+    # 只报告每个成员最后一次变化
+    seen = members.version
+    members.discard("bob")
+    members.add("bob")
+    members.add("dave")
+    members.discard("dave")
+    delta = members.since(seen)
+    assert delta.added == ["bob"] and delta.removed == ["dave"]
+
+    # 超出变更记录或未知的版本返回完整列表
+    for since in (None, 0, first_seen, members.version + 1):
+        delta = members.since(since)
+        assert delta.members is not None and sorted(delta.members) == ["bob", "carol"]
+    print("✓ Versioned members answer deltas within their history and full lists otherwise")
+
+
+async def _run_get_users_sync(backend=None):
+    manager = ConnectionManager(backend)
+    if backend is not None:
+        await backend.start(manager.on_backend_message)
+    alice, bob = RecordingWebSocket(), RecordingWebSocket()
+    await manager.connect(alice, "alice", "room_1")
+
+    full = json.loads((await manager.presence_reply("room_1")).json)
+    assert full["type"] == "users_list" and full["users"] == ["alice"]
+    version = full["version"]
+    assert json.loads((await manager.presence_reply("room_1", version)).json) == {
+        "type": "users_unchanged", "version": version}
+
+    await manager.connect(bob, "bob", "room_1")
+    delta = json.loads((await manager.presence_reply("room_1", version)).json)
+    assert delta["type"] == "users_delta" and delta["added"] == ["bob"] and delta["removed"] == []
+    assert delta["version"] > version
+
+    # 同一版本的完整列表只编码一次
+    assert await manager.presence_reply("room_1") is await manager.presence_reply("room_1")
+
+    manager.disconnect("bob")
+    await asyncio.sleep(0.05)
+    delta = json.loads((await manager.presence_reply("room_1", delta["version"])).json)
+    assert delta["type"] == "users_delta" and delta["removed"] == ["bob"]
+
+    manager.disconnect("alice")
+    await asyncio.sleep(0.05)
+    if backend is not None:
+        await backend.close()
+
+
+def test_get_users_sync():
+    asyncio.run(_run_get_users_sync())
+    print("✓ get_users answers full, delta and unchanged replies from the in-memory backend")
+
+
+async def _run_broker_get_users_sync():
+    broker = LocalBroker()
+    await broker.start("localhost", 0)
+    await _run_get_users_sync(BrokerRoomBackend(f"tcp://localhost:{broker.port}"))
+    await broker.close()
+
+
+def test_broker_get_users_sync():
+    asyncio.run(_run_broker_get_users_sync())
+    print("✓ get_users deltas also come from the broker's versioned sets")
+
+
+if __name__ == "__main__":
+    logging.disable(logging.CRITICAL)
+    test_versioned_members()
+    test_get_users_sync()
+    test_broker_get_users_sync()
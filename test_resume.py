@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test reconnect-and-resume: sequenced room logs, suspended sessions and replay.
+"""
+
+import json
+import asyncio
+import logging
+
+from room_log import RoomLog
+from signaling_codec import Frame
+from fastapi.testclient import TestClient
+
+import voice_chat_server
+from fake_websocket import RecordingWebSocket
+from voice_chat_server import ConnectionManager, app
+
+
+def test_room_log():
+    log = RoomLog(size=4)
+    log.append(Frame({"type": "user_joined", "client_id": "bob"}), exclude="bob")
+    log.append(Frame({"type": "offer", "sender": "bob"}), target="alice")
+    # 其他worker转发的JSON文本不解码，直接插入序号
+    relayed = log.append(Frame(json_text='{"type":"bot_response","text":"好"}'))
+    assert json.loads(relayed.json) == {"type": "bot_response", "text": "好", "room_seq": 3}
+
+    assert [f.message["room_seq"] for f in log.replay("alice", 0)] == [1, 2, 3]
+    assert [f.message["room_seq"] for f in log.replay("bob", 0)] == [3]
+    assert [f.message["room_seq"] for f in log.replay("carol", 1)] == [3]
+    assert log.replay("alice", 3) == []
+
+    # 缓冲区覆盖不到的序号，以及来自其他worker或旧房间的序号，都无法续传
+    for i in range(4):
+        log.append(Frame({"type": "ice_candidate", "n": i}))
+    assert log.replay("alice", 2) is None
+    assert len(log.replay("alice", 3)) == 4
+    assert log.replay("alice", 99) is None
+    print("✓ Room logs stamp room_seq, replay per recipient and detect gaps")
+
+
+def test_room_log_without_buffer():
+    log = RoomLog(size=0)
+    assert log.replay("alice", 0) == []
+    log.append(Frame({"type": "offer", "sender": "bob"}), target="alice")
+    # 没有缓冲的帧可补发：错过消息的客户端只能重新加入
+    assert log.replay("alice", 0) is None
+    assert log.replay("alice", 1) == []
+    print("✓ A room log without a buffer reports a gap instead of failing")
+
+
+async def _connect(manager, client_id, room_id="room_1", **resume):
+    websocket = RecordingWebSocket()
+    await manager.connect(websocket, client_id, room_id, **resume)
+    await asyncio.sleep(0.01)
+    return websocket
+
+
+async def _run_resume():
+    manager = ConnectionManager()
+    manager.resume_window = 5
+    alice = await _connect(manager, "alice")
+    bob = await _connect(manager, "bob")
+    session = bob.of_type("session")[0]
+    assert session["resumed"] is False and session["room_seq"] == 1
+
+    # bob的网络中断：会话保留，其他成员收不到user_left
+    manager.suspend("bob", bob)
+    await manager.broadcast_to_room("room_1", {"type": "bot_response", "text": "你好"})
+    await manager.send_personal_message({"type": "offer", "sender": "alice", "sdp": "v=0"}, "bob")
+    await manager.broadcast_to_room("room_1", {"type": "ice_candidate", "sender": "bob"}, exclude_client="bob")
+    await asyncio.sleep(0.01)
+    assert "bob" in manager.rooms["room_1"] and not alice.of_type("user_left")
+
+    resumed = await _connect(manager, "bob", resume_token=session["resume_token"], last_seq=session["room_seq"])
+    assert resumed.received[0]["type"] == "session" and resumed.received[0]["resumed"] is True
+    assert [(m["type"], m["room_seq"]) for m in resumed.received[1:]] == [("bot_response", 3), ("offer", 4)]
+    assert len(alice.of_type("user_joined")) == 1
+
+    # 旧令牌在续传后失效，按重新加入处理
+    again = await _connect(manager, "bob", resume_token=session["resume_token"], last_seq=4)
+    assert again.of_type("session")[0]["resumed"] is False
+    assert len(alice.of_type("user_joined")) == 2
+
+    manager.disconnect("alice")
+    manager.disconnect("bob")
+    print("✓ A suspended client resumes with its token and gets exactly the frames it missed")
+
+
+def test_resume():
+    asyncio.run(_run_resume())
+
+
+async def _run_resume_expiry_and_gap():
+    manager = ConnectionManager()
+    manager.resume_window = 0.05
+    alice = await _connect(manager, "alice")
+    bob = await _connect(manager, "bob")
+    manager.suspend("bob", bob)
+    await asyncio.sleep(0.1)
+    assert "bob" not in manager.clients
+    assert alice.of_type("user_left") == [{"type": "user_left", "client_id": "bob", "room_seq": 3}]
+
+    # 断开期间的消息超出缓冲区，只能重新加入
+    manager.resume_window = 5
+    carol = await _connect(manager, "carol")
+    session = carol.of_type("session")[0]
+    manager.suspend("carol", carol)
+    for i in range(manager.room_logs["room_1"].entries.maxlen + 1):
+        await manager.broadcast_to_room("room_1", {"type": "ice_candidate", "n": i})
+    rejoined = await _connect(manager, "carol", resume_token=session["resume_token"], last_seq=session["room_seq"])
+    assert rejoined.of_type("session")[0]["resumed"] is False
+    assert alice.of_type("user_joined")[-1]["client_id"] == "carol"
+
+    manager.disconnect("alice")
+    manager.disconnect("carol")
+    print("✓ Suspended sessions expire with user_left; resumes past the buffer fall back to a fresh join")
+
+
+def test_resume_expiry_and_gap():
+    asyncio.run(_run_resume_expiry_and_gap())
+
+
+async def _run_resume_without_buffer():
+    manager = ConnectionManager()
+    manager.resume_window = 5
+    buffer_size, voice_chat_server.RESUME_BUFFER_SIZE = voice_chat_server.RESUME_BUFFER_SIZE, 0
+    try:
+        alice = await _connect(manager, "alice")
+        bob = await _connect(manager, "bob")
+        session = bob.of_type("session")[0]
+        manager.suspend("bob", bob)
+        await manager.broadcast_to_room("room_1", {"type": "bot_response", "text": "你好"})
+        rejoined = await _connect(manager, "bob", resume_token=session["resume_token"], last_seq=session["room_seq"])
+        assert rejoined.of_type("session")[0]["resumed"] is False
+        assert "bob" in manager.clients and alice.close_code is None
+    finally:
+        voice_chat_server.RESUME_BUFFER_SIZE = buffer_size
+    manager.disconnect("alice")
+    manager.disconnect("bob")
+    print("✓ With RESUME_BUFFER_SIZE=0 a resume after missed frames falls back to a fresh join")
+
+
+def test_resume_without_buffer():
+    asyncio.run(_run_resume_without_buffer())
+
+
+def test_endpoint_resume():
+    manager = voice_chat_server.manager
+    manager.resume_window = 5
+    client = TestClient(app)
+    try:
+        with client.websocket_connect("/ws/alice/resume_room") as alice:
+            session = alice.receive_json()
+            # 非正常关闭码：会话保留
+            alice.close(code=4000)
+        assert manager.clients["alice"].suspended
+        url = f"/ws/alice/resume_room?resume_token={session['resume_token']}&last_seq={session['room_seq']}"
+        with client.websocket_connect(url) as alice:
+            assert alice.receive_json()["resumed"] is True
+        # 正常关闭直接离开房间
+        assert "alice" not in manager.clients
+    finally:
+        manager.resume_window = voice_chat_server.RESUME_WINDOW
+    print("✓ The endpoint suspends sessions on abnormal closes and resumes them from query parameters")
+
+
+if __name__ == "__main__":
+    logging.disable(logging.CRITICAL)
+    test_room_log()
+    test_room_log_without_buffer()
+    test_resume()
+    test_resume_expiry_and_gap()
+    test_resume_without_buffer()
+    test_endpoint_resume()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test that two voice chat workers share rooms through the local broker.
+"""
+
+import json
+import asyncio
+import logging
+
+from fake_websocket import RecordingWebSocket
+from local_broker import LocalBroker
+from room_backend import BrokerRoomBackend
+from voice_chat_server import ConnectionManager
+
+
+async def _run_cross_worker_routing():
+    broker = LocalBroker()
+    await broker.start("localhost", 0)
+    url = f"tcp://localhost:{broker.port}"
+
+    # 两个worker进程的ConnectionManager，各自连接同一个broker
+    worker_a = ConnectionManager(BrokerRoomBackend(url))
+    worker_b = ConnectionManager(BrokerRoomBackend(url))
+    for worker in (worker_a, worker_b):
+        await worker.backend.start(worker.on_backend_message)
+
+    alice, bob = RecordingWebSocket(), RecordingWebSocket()
+    await worker_a.connect(alice, "alice", "room_1")
+    await worker_b.connect(bob, "bob", "room_1")
+    await asyncio.sleep(0.05)
+
+    # 成员列表包含另一个worker上的客户端
+    assert await worker_a.room_members("room_1") == {"alice", "bob"}
+    assert {"type": "user_joined", "client_id": "bob"} in alice.received
+
+    # 房间广播和定向消息都能跨worker送达
+    await worker_a.broadcast_to_room("room_1", {"type": "ice_candidate", "sender": "alice"}, exclude_client="alice")
+    await worker_b.send_personal_message(json.dumps({"type": "answer", "sender": "bob"}), "alice")
+    await asyncio.sleep(0.05)
+    assert {"type": "ice_candidate", "sender": "alice"} in bob.received
+    assert {"type": "answer", "sender": "bob"} in alice.received
+    assert not any(m.get("sender") == "alice" for m in alice.received)
+
+    worker_b.disconnect("bob")
+    await asyncio.sleep(0.05)
+    assert await worker_a.room_members("room_1") == {"alice"}
+    assert {"type": "user_left", "client_id": "bob"} in alice.received
+
+    worker_a.disconnect("alice")
+    await asyncio.sleep(0.05)
+    for worker in (worker_a, worker_b):
+        await worker.backend.close()
+    await broker.close()
+    print("✓ Rooms, broadcasts and targeted messages span workers")
+
+
+def test_cross_worker_routing():
+    logging.disable(logging.INFO)
+    asyncio.run(_run_cross_worker_routing())
+
+
+async def _run_broker_outage():
+    broker = LocalBroker()
+    await broker.start("localhost", 0)
+    port = broker.port
+    url = f"tcp://localhost:{port}"
+
+    worker_a = ConnectionManager(BrokerRoomBackend(url, call_timeout=0.5, reconnect_delay=0.05))
+    worker_b = ConnectionManager(BrokerRoomBackend(url, call_timeout=0.5, reconnect_delay=0.05))
+    for worker in (worker_a, worker_b):
+        await worker.backend.start(worker.on_backend_message)
+    alice, bob = RecordingWebSocket(), RecordingWebSocket()
+    await worker_a.connect(alice, "alice", "room_1")
+    await worker_b.connect(bob, "bob", "room_1")
+
+    # broker挂掉：之后的连接、成员查询和发布立即返回，只覆盖本worker的成员
+    await broker.close()
+    await asyncio.sleep(0.05)
+    assert not worker_a.backend.connected
+    carol = RecordingWebSocket()
+    await asyncio.wait_for(worker_a.connect(carol, "carol", "room_1"), 0.2)
+    assert await asyncio.wait_for(worker_a.room_members("room_1"), 0.2) == {"alice", "carol"}
+    assert {"type": "user_joined", "client_id": "carol"} in alice.received
+    await asyncio.wait_for(worker_a.broadcast_to_room("room_1", {"type": "ice_candidate", "sender": "carol"}), 0.2)
+
+    # broker恢复后两个worker自动重连并重新注册成员和订阅
+    broker = LocalBroker()
+    await broker.start("localhost", port)
+    for _ in range(50):
+        await asyncio.sleep(0.05)
+        if worker_a.backend.connected and worker_b.backend.connected:
+            break
+    await asyncio.sleep(0.05)
+    assert await worker_b.room_members("room_1") == {"alice", "bob", "carol"}
+    await worker_b.broadcast_to_room("room_1", {"type": "ice_candidate", "sender": "bob"}, exclude_client="bob")
+    await asyncio.sleep(0.05)
+    assert {"type": "ice_candidate", "sender": "bob"} in carol.received
+
+    for worker in (worker_a, worker_b):
+        for client_id in list(worker.clients):
+            worker.disconnect(client_id)
+    await asyncio.sleep(0.05)
+    for worker in (worker_a, worker_b):
+        await worker.backend.close()
+    await broker.close()
+    print("✓ Workers keep serving local members while the broker is down and re-register once it is back")
+
+
+async def _run_broker_timeout():
+    # 接受连接但从不应答的broker
+    async def silent(reader, writer):
+        await reader.read()
+
+    server = await asyncio.start_server(silent, "localhost", 0)
+    backend = BrokerRoomBackend(f"tcp://localhost:{server.sockets[0].getsockname()[1]}", call_timeout=0.1)
+    await backend.start(lambda *args: None)
+    await asyncio.wait_for(backend.join("room_1", "alice"), 1)
+    assert await asyncio.wait_for(backend.members("room_1", ["alice"]), 1) == {"alice"}
+    await backend.close()
+    server.close()
+    await server.wait_closed()
+    print("✓ Broker calls time out instead of hanging")
+
+
+def test_broker_outage():
+    logging.disable(logging.CRITICAL)
+    asyncio.run(_run_broker_outage())
+    asyncio.run(_run_broker_timeout())
+
+
+if __name__ == "__main__":
+    test_cross_worker_routing()
+    test_broker_outage()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test the consistent-hash room router: ring balance, minimal movement, proxying and redirects.
+"""
+
+import json
+import socket
+import asyncio
+import logging
+
+import msgpack
+import websockets
+
+from room_router import HashRing, RoomRouter, room_of
+
+ROOMS = [f"room_{i}" for i in range(10000)]
+
+
+def test_hash_ring():
+    nodes = [f"ws://10.0.0.{i}:8001" for i in range(1, 5)]
+    ring = HashRing(nodes)
+    before = {room: ring.node_for(room) for room in ROOMS}
+    counts = [list(before.values()).count(node) for node in nodes]
+    assert max(counts) < 1.25 * len(ROOMS) / len(nodes) and min(counts) > 0.75 * len(ROOMS) / len(nodes)
+
+    # 新节点只接手约1/N的房间，其余房间不动
+    ring.add("ws://10.0.0.5:8001")
+    after = {room: ring.node_for(room) for room in ROOMS}
+    moved = [room for room in ROOMS if after[room] != before[room]]
+    assert all(after[room] == "ws://10.0.0.5:8001" for room in moved)
+    assert 0.12 < len(moved) / len(ROOMS) < 0.28
+
+    # 移除节点只影响它原有的房间
+    ring.remove("ws://10.0.0.2:8001")
+    removed = {room: ring.node_for(room) for room in ROOMS}
+    assert all(removed[room] == after[room] for room in ROOMS if after[room] != "ws://10.0.0.2:8001")
+
+    assert room_of("/ws/alice/room_1?resume_token=x") == "room_1"
+    assert room_of("/ws/audio/alice/room_1") == "room_1"
+    assert room_of("/metrics") is None
+    print(f"✓ Rooms spread evenly and adding a fifth node moves {len(moved) / len(ROOMS):.0%} of them")
+
+
+async def _backend(name: str):
+    """Stand-in voice server node that greets with its name and echoes frames"""
+    closes = []
+
+    async def handler(websocket, path=None):
+        await websocket.send(json.dumps({"node": name, "path": websocket.path, "protocol": websocket.subprotocol}))
+        try:
+            async for message in websocket:
+                await websocket.send(message)
+        finally:
+            closes.append(websocket.close_code)
+
+    server = await websockets.serve(handler, "localhost", 0, subprotocols=["voicechat.msgpack", "voicechat.json"])
+    return server, f"ws://localhost:{server.sockets[0].getsockname()[1]}", closes
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+async def _run_proxy():
+    (server_a, node_a, closes_a), (server_b, node_b, closes_b) = await _backend("a"), await _backend("b")
+    router = RoomRouter([node_a, node_b])
+    await router.start("localhost", 0)
+    url = f"ws://localhost:{router.port}"
+
+    # 同一房间的成员落在同一节点，子协议和二进制帧原样转发
+    room = ROOMS[0]
+    async with websockets.connect(f"{url}/ws/alice/{room}", subprotocols=["voicechat.msgpack"]) as alice, \
+            websockets.connect(f"{url}/ws/bob/{room}") as bob:
+        greet_alice, greet_bob = json.loads(await alice.recv()), json.loads(await bob.recv())
+        assert greet_alice["node"] == greet_bob["node"] == ("a" if router.ring.node_for(room) == node_a else "b")
+        assert greet_alice["path"] == f"/ws/alice/{room}" and greet_alice["protocol"] == "voicechat.msgpack"
+        await alice.send(msgpack.packb({"type": "pong"}))
+        assert msgpack.unpackb(await alice.recv()) == {"type": "pong"}
+
+        # 节点下线后，房间迁移：客户端收到重连提示，旧节点看到正常离开
+        router.set_nodes([node_a if greet_alice["node"] == "b" else node_b])
+        assert msgpack.unpackb(await alice.recv()) == {"type": "reconnect", "url": None, "retry_after": 0}
+        assert json.loads(await bob.recv())["type"] == "reconnect"
+        await asyncio.sleep(0.05)
+        assert alice.close_code == 1012
+        assert (closes_a if greet_alice["node"] == "a" else closes_b) == [1000, 1000]
+
+    # 连接不上的节点被移出哈希环，房间转到下一个节点
+    dead = f"ws://localhost:{_free_port()}"
+    router.set_nodes([node_a, dead])
+    room = next(r for r in ROOMS if router.ring.node_for(r) == dead)
+    async with websockets.connect(f"{url}/ws/carol/{room}") as carol:
+        assert json.loads(await carol.recv())["node"] == "a"
+        assert dead not in router.ring.nodes
+
+    await router.close()
+    for server in (server_a, server_b):
+        server.close()
+        await server.wait_closed()
+    print("✓ Proxied rooms stay on one node, move on ring changes and skip unreachable nodes")
+
+
+def test_proxy():
+    asyncio.run(_run_proxy())
+
+
+async def _run_redirect():
+    router = RoomRouter(["ws://10.0.0.1:8001", "ws://10.0.0.2:8001"], mode="redirect")
+    await router.start("localhost", 0)
+    async with websockets.connect(f"ws://localhost:{router.port}/ws/alice/room_1") as alice:
+        hint = json.loads(await alice.recv())
+        assert hint == {"type": "reconnect", "url": router.ring.node_for("room_1"), "retry_after": 0}
+    await router.close()
+    print("✓ Redirect mode points clients at their room's node with a reconnect hint")
+
+
+def test_redirect():
+    asyncio.run(_run_redirect())
+
+
+if __name__ == "__main__":
+    logging.disable(logging.CRITICAL)
+    test_hash_ring()
+    test_proxy()
+    test_redirect()
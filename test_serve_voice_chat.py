@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test the production launcher: arguments and environment, SO_REUSEPORT sockets and worker startup.
+"""
+
+import os
+import sys
+import signal
+import socket
+import logging
+import tempfile
+import subprocess
+from types import SimpleNamespace
+
+import serve_voice_chat
+from serve_voice_chat import parse_args, reuseport_socket, worker_cores, worker_log_file
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+LAUNCHER_ENV = ("HOST", "PORT", "WORKERS", "WS_MAX_SIZE", "WS_MAX_QUEUE", "WS_PING_INTERVAL",
+                "WS_PING_TIMEOUT", "WS_PER_MESSAGE_DEFLATE", "ROOM_BACKEND", "ROOM_BROKER_URL")
+
+
+class FakeProcess:
+    """multiprocessing.Process stand-in that records what it would run"""
+
+    def __init__(self, started, target=None, args=(), name=None):
+        self.started = started
+        self.target = target
+        self.args = args
+        self.name = name
+        self.pid = None
+        self.env = None
+        self.exitcode = None
+
+    def start(self):
+        self.env = dict(os.environ)
+        self.started.append(self)
+        self.exitcode = 0
+
+    def join(self):
+        pass
+
+    def is_alive(self):
+        return False
+
+    def terminate(self):
+        pass
+
+
+def _run_main(argv, env=None):
+    """Run serve_voice_chat.main without starting processes; returns the exit code and the fake processes"""
+    started = []
+    context = SimpleNamespace(Process=lambda **kwargs: FakeProcess(started, **kwargs))
+    saved_env = {name: os.environ.get(name) for name in LAUNCHER_ENV}
+    saved_signals = {signum: signal.getsignal(signum) for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGUSR1)}
+    saved = serve_voice_chat.multiprocessing, serve_voice_chat.wait_for_port
+    serve_voice_chat.multiprocessing = SimpleNamespace(get_context=lambda method: context)
+    serve_voice_chat.wait_for_port = lambda host, port, timeout=10.0: None
+    try:
+        os.environ.update(env or {})
+        return serve_voice_chat.main(argv), started
+    finally:
+        serve_voice_chat.multiprocessing, serve_voice_chat.wait_for_port = saved
+        for signum, handler in saved_signals.items():
+            signal.signal(signum, handler)
+        for name, value in saved_env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def test_args_and_env():
+    saved_env = {name: os.environ.pop(name, None) for name in LAUNCHER_ENV}
+    try:
+        args = parse_args([])
+        assert (args.host, args.port, args.workers) == ("0.0.0.0", 8001, os.cpu_count() or 1)
+        assert args.ws_max_size == 1024 * 1024 and args.ws_max_queue == 32
+        assert args.ws_ping_interval == 20 and not args.ws_per_message_deflate and not args.with_broker
+
+        os.environ.update(HOST="127.0.0.1", PORT="9100", WORKERS="3", WS_MAX_SIZE="4096",
+                          WS_PING_INTERVAL="0", WS_PER_MESSAGE_DEFLATE="1")
+        args = parse_args([])
+        assert (args.host, args.port, args.workers) == ("127.0.0.1", 9100, 3)
+        assert args.ws_max_size == 4096 and args.ws_ping_interval == 0 and args.ws_per_message_deflate
+        # 命令行参数优先于环境变量
+        args = parse_args(["--workers", "5", "--port", "9200", "--loop", "asyncio", "--http", "h11"])
+        assert (args.port, args.workers, args.loop, args.http) == (9200, 5, "asyncio", "h11")
+    finally:
+        for name, value in saved_env.items():
+            os.environ.pop(name, None)
+            if value is not None:
+                os.environ[name] = value
+    print("✓ Launcher settings come from the environment and command-line flags override them")
+
+
+def test_worker_cores():
+    cores = sorted(os.sched_getaffinity(0))
+    assigned = worker_cores(len(cores) * 2 + 1)
+    assert len(assigned) == len(cores) * 2 + 1
+    # 核数不够时按顺序轮流分配
+    assert assigned[:len(cores)] == cores and assigned[len(cores):2 * len(cores)] == cores
+    assert assigned[-1] == cores[0]
+    print("✓ Workers are pinned to the available cores round-robin")
+
+
+def test_reuseport_socket():
+    first = reuseport_socket("127.0.0.1", 0, 16)
+    port = first.getsockname()[1]
+    # 第二个worker可以绑定同一个地址
+    second = reuseport_socket("127.0.0.1", port, 16)
+    try:
+        assert second.getsockname()[1] == port
+        for sock in (first, second):
+            assert sock.getsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT) == 1
+            assert sock.get_inheritable()
+        socket.create_connection(("127.0.0.1", port), timeout=1).close()
+    finally:
+        first.close()
+        second.close()
+
+    # 没有SO_REUSEPORT的普通套接字不能绑定已被占用的端口
+    first = reuseport_socket("127.0.0.1", 0, 16)
+    plain = socket.socket()
+    try:
+        plain.bind(("127.0.0.1", first.getsockname()[1]))
+        assert False, "plain socket bound a port taken by a SO_REUSEPORT listener"
+    except OSError:
+        pass
+    finally:
+        plain.close()
+        first.close()
+    print("✓ Every worker binds its own SO_REUSEPORT listener on the shared port")
+
+
+def test_worker_logging():
+    assert worker_log_file("voice_chat_server.log", 0, 1) == "voice_chat_server.log"
+    # 多个worker各写自己的文件，RotatingFileHandler不能跨进程共享
+    assert [worker_log_file("logs/server.log", i, 3) for i in range(3)] == \
+        ["logs/server.0.log", "logs/server.1.log", "logs/server.2.log"]
+    assert worker_log_file("", 2, 4) is None
+    assert parse_args(["--log-file", ""]).log_file == ""
+
+    # 导入服务器模块不配置日志，也不创建日志文件
+    with tempfile.TemporaryDirectory() as tmp:
+        output = subprocess.run(
+            [sys.executable, "-c", "import logging, voice_chat_server; print(len(logging.getLogger().handlers))"],
+            cwd=tmp, env=dict(os.environ, PYTHONPATH=REPO_DIR), capture_output=True, text=True, check=True
+        ).stdout
+        assert output.strip() == "0" and os.listdir(tmp) == []
+    print("✓ Each worker gets its own log file and importing the server has no logging side effects")
+
+
+def test_main_starts_workers():
+    code, started = _run_main(["--workers", "3", "--port", "9300"],
+                              {"ROOM_BACKEND": "broker", "ROOM_BROKER_URL": "tcp://broker.internal:8790"})
+    assert code == 0 and [p.name for p in started] == [f"voice-chat-worker-{i}" for i in range(3)]
+    assert all(p.target is serve_voice_chat.run_worker for p in started)
+    assert [p.args[0] for p in started] == [0, 1, 2]
+    assert [p.args[1] for p in started] == worker_cores(3)
+    assert started[0].args[2].port == 9300
+    # 已配置外部broker时不启动本地broker
+    assert started[0].env["ROOM_BROKER_URL"] == "tcp://broker.internal:8790"
+    print("✓ main starts one pinned worker per --workers")
+
+
+def test_workers_imply_broker():
+    # 多个worker使用内存后端时房间不共享，自动启动本地broker
+    code, started = _run_main(["--workers", "2", "--broker-port", "9790"], {"ROOM_BACKEND": "memory"})
+    assert code == 0 and [p.name for p in started] == ["room-broker", "voice-chat-worker-0", "voice-chat-worker-1"]
+    assert all(p.env["ROOM_BACKEND"] == "broker" for p in started[1:])
+
+    code, started = _run_main(["--workers", "1"], {"ROOM_BACKEND": "memory"})
+    assert [p.name for p in started] == ["voice-chat-worker-0"] and started[0].env["ROOM_BACKEND"] == "memory"
+    print("✓ More than one worker starts the room broker unless ROOM_BACKEND=broker is already set")
+
+
+def test_main_with_broker():
+    code, started = _run_main(["--workers", "2", "--with-broker", "--broker-port", "9791"])
+    assert code == 0 and [p.name for p in started] == ["room-broker", "voice-chat-worker-0", "voice-chat-worker-1"]
+    assert started[0].target is serve_voice_chat.run_broker and started[0].args == ("localhost", 9791)
+    # spawn出来的worker继承启动时的环境变量
+    for process in started[1:]:
+        assert process.env["ROOM_BACKEND"] == "broker"
+        assert process.env["ROOM_BROKER_URL"] == "tcp://localhost:9791"
+    print("✓ --with-broker starts the room broker first and points the workers at it")
+
+
+def test_main_without_reuseport():
+    reuseport = socket.SO_REUSEPORT
+    del socket.SO_REUSEPORT
+    try:
+        code, started = _run_main(["--workers", "4"])
+    finally:
+        socket.SO_REUSEPORT = reuseport
+    assert code == 0 and [p.name for p in started] == ["voice-chat-worker-0"]
+    print("✓ Without SO_REUSEPORT the launcher falls back to a single worker")
+
+
+if __name__ == "__main__":
+    logging.disable(logging.CRITICAL)
+    test_args_and_env()
+    test_worker_cores()
+    test_reuseport_socket()
+    test_worker_logging()
+    test_main_starts_workers()
+    test_workers_imply_broker()
+    test_main_with_broker()
+    test_main_without_reuseport()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test the negotiated msgpack/JSON wire formats on the signaling and chatbot hops.
+"""
+
+import json
+import asyncio
+import logging
+
+import msgpack
+import websockets
+from fastapi.testclient import TestClient
+
+import signaling_codec as codec
+from chatbot_channel import ChatbotChannel
+from fake_websocket import RecordingWebSocket
+from signaling_codec import Frame
+from signaling_schema import validate_client_message
+from voice_chat_server import ConnectionManager, app
+
+ICE = {
+    "type": "ice_candidate",
+    "sender": "alice",
+    "candidate": {"candidate": "candidate:1 1 udp 2122260223 192.168.1.7 50000 typ host", "sdpMid": "0",
+                  "sdpMLineIndex": 0}
+}
+
+
+def test_wire_formats():
+    for wire in (codec.JSON, codec.MSGPACK):
+        items = [wire.dumps(dict(ICE, n=i)) for i in range(20)]
+        assert wire.loads(items[0]) == dict(ICE, n=0)
+        # 合并帧直接拼接已编码的消息，解码结果与逐条编码一致
+        assert wire.loads(wire.batch(items)) == {"type": "batch", "messages": [dict(ICE, n=i) for i in range(20)]}
+        assert wire.loads(wire.batch(items[:3]))["messages"][2]["n"] == 2
+    assert len(codec.MSGPACK.dumps(ICE)) < len(codec.JSON.dumps(ICE).encode())
+
+    assert codec.negotiate(["voicechat.json", "voicechat.msgpack"]) == "voicechat.msgpack"
+    assert codec.negotiate(["voicechat.json"]) == "voicechat.json"
+    assert codec.negotiate([]) is None and codec.wire_for(None) is codec.JSON
+
+    # 每种编码只序列化一次；来自其他worker的JSON帧按需才解码
+    frame = Frame(ICE)
+    assert frame.encode(codec.MSGPACK) is frame.encode(codec.MSGPACK)
+    relayed = Frame(json_text=frame.json)
+    assert relayed.encode(codec.JSON) is frame.json and relayed._message is None
+    assert codec.decode(relayed.encode(codec.MSGPACK)) == ICE
+    print("✓ JSON and msgpack frames, batches and lazily encoded broadcasts round-trip")
+
+
+async def _run_mixed_room():
+    manager = ConnectionManager()
+    packed, plain = RecordingWebSocket(), RecordingWebSocket()
+    await manager.connect(packed, "alice", "room_1", "voicechat.msgpack")
+    await manager.connect(plain, "bob", "room_1")
+    assert packed.subprotocol == "voicechat.msgpack" and plain.subprotocol is None
+
+    # 同一条广播按各自协商的编码送达
+    await manager.broadcast_to_room("room_1", {"type": "bot_response", "text": "你好"})
+    manager.on_backend_message("room_1", None, None, codec.dumps({"type": "user_joined", "client_id": "carol"}))
+    await asyncio.sleep(0.05)
+    assert ("bytes", {"type": "bot_response", "text": "你好"}) in packed.frames
+    assert ("text", {"type": "bot_response", "text": "你好"}) in plain.frames
+    assert ("bytes", {"type": "user_joined", "client_id": "carol"}) in packed.frames
+    assert ("text", {"type": "user_joined", "client_id": "carol"}) in plain.frames
+
+    manager.disconnect("alice")
+    manager.disconnect("bob")
+    print("✓ One broadcast reaches msgpack and JSON clients of the same room in their own encoding")
+
+
+def test_mixed_room():
+    asyncio.run(_run_mixed_room())
+
+
+def test_endpoint_negotiation():
+    client = TestClient(app)
+    with client.websocket_connect("/ws/alice/codec_room", subprotocols=["voicechat.msgpack", "voicechat.json"]) as alice:
+        assert alice.accepted_subprotocol == "voicechat.msgpack"
+        # 收到users_list说明alice已经加入房间
+        alice.send_bytes(msgpack.packb({"type": "get_users"}))
+        users_list = msgpack.unpackb(alice.receive_bytes())
+        assert users_list["type"] == "users_list" and users_list["users"] == ["alice"]
+        with client.websocket_connect("/ws/bob/codec_room") as bob:
+            assert msgpack.unpackb(alice.receive_bytes()) == {"type": "user_joined", "client_id": "bob"}
+
+            # msgpack客户端发送二进制帧，JSON客户端收到文本帧
+            alice.send_bytes(msgpack.packb({"type": "ice_candidate", "target": "bob", "candidate": ICE["candidate"]}))
+            assert json.loads(bob.receive_text()) == dict(ICE, sender="alice")
+            bob.send_text(json.dumps({"type": "offer", "target": "alice", "sdp": "v=0"}))
+            assert msgpack.unpackb(alice.receive_bytes()) == {"type": "offer", "sender": "bob", "sdp": "v=0"}
+    print("✓ The signaling endpoint negotiates msgpack through Sec-WebSocket-Protocol, JSON otherwise")
+
+
+def test_schema_validation():
+    assert validate_client_message({"type": "offer", "target": "bob", "sdp": "v=0"}) is None
+    assert validate_client_message(ICE) is None
+    assert validate_client_message({"type": "ice_candidate", "candidate": None}) is None
+    assert validate_client_message({"type": "get_users", "since_version": 3}) is None
+    # 未声明的字段不做检查
+    assert validate_client_message({"type": "pong", "sent_at": 1.5}) is None
+
+    assert validate_client_message(["offer"]) == "frame is not an object"
+    assert validate_client_message({"sdp": "v=0"}) == "unknown message type None"
+    assert validate_client_message({"type": "subscribe"}) == "unknown message type 'subscribe'"
+    assert validate_client_message({"type": "offer", "target": "bob"}) == "offer is missing 'sdp'"
+    assert validate_client_message({"type": "asr_text", "text": 42}) == "asr_text.text has the wrong type int"
+    assert validate_client_message({"type": "ice_candidate", "candidate": "x"}) is not None
+    assert validate_client_message({"type": "offer", "sdp": "v=0", "target": ["bob"]}) is not None
+    assert validate_client_message({"type": "get_users", "since_version": True}) is not None
+    print("✓ Client frames are checked for a known type and the required, typed fields of their schema")
+
+
+def test_endpoint_rejects_invalid_frames():
+    client = TestClient(app)
+    with client.websocket_connect("/ws/alice/schema_room") as alice:
+        with client.websocket_connect("/ws/bob/schema_room") as bob:
+            assert json.loads(alice.receive_text()) == {"type": "user_joined", "client_id": "bob"}
+            for frame in ("not json", json.dumps([1, 2]), json.dumps({"type": "subscribe"}),
+                          json.dumps({"type": "offer", "target": "alice"})):
+                bob.send_text(frame)
+                error = json.loads(bob.receive_text())
+                assert error["type"] == "error" and error["code"] == "invalid_message"
+            bob.send_bytes(b"\xc1")
+            assert json.loads(bob.receive_text())["code"] == "invalid_message"
+
+            # 无效帧不会被转发，连接也保持可用
+            bob.send_text(json.dumps({"type": "offer", "target": "alice", "sdp": "v=0"}))
+            assert json.loads(alice.receive_text()) == {"type": "offer", "sender": "bob", "sdp": "v=0"}
+    print("✓ The endpoint answers undecodable and schema-violating frames with an error and keeps the connection")
+
+
+async def _run_chatbot_negotiation():
+    received = []
+
+    async def chatbot(websocket, path=None):
+        async for raw in websocket:
+            received.append(raw)
+            request = codec.decode(raw)
+            reply = {"type": "bot_response", "text": "好的", "request_id": request["request_id"]}
+            await websocket.send(codec.wire_for(websocket.subprotocol).dumps(reply))
+
+    for subprotocols, kind in ((codec.SUBPROTOCOLS, bytes), (None, str)):
+        # 不支持子协议协商的旧版聊天机器人回退到JSON
+        async with websockets.serve(chatbot, "localhost", 0, subprotocols=subprotocols) as server:
+            channel = ChatbotChannel(f"ws://localhost:{server.sockets[0].getsockname()[1]}")
+            reply = await channel.request({"type": "asr_text", "text": "你好"})
+            assert reply["text"] == "好的"
+            assert isinstance(received[-1], kind)
+            await channel.close()
+    print("✓ The chatbot hop uses msgpack when the chatbot offers it and falls back to JSON")
+
+
+def test_chatbot_negotiation():
+    asyncio.run(_run_chatbot_negotiation())
+
+
+if __name__ == "__main__":
+    logging.disable(logging.CRITICAL)
+    test_wire_formats()
+    test_mixed_room()
+    test_endpoint_negotiation()
+    test_schema_validation()
+    test_endpoint_rejects_invalid_frames()
+    test_chatbot_negotiation()
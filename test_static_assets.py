@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test static client serving: precompressed variants, ETag revalidation and immutable fingerprinted assets.
+"""
+
+import gzip
+import logging
+
+from fastapi.testclient import TestClient
+
+from static_assets import IMMUTABLE, REVALIDATE, accepted_encodings
+from voice_chat_server import app, static_assets
+
+
+def test_client_page():
+    client = TestClient(app)
+    page = client.get("/", headers={"Accept-Encoding": "gzip"})
+    assert page.status_code == 200 and page.headers["content-type"].startswith("text/html")
+    assert page.headers["content-encoding"] == "gzip" and page.headers["cache-control"] == REVALIDATE
+    raw = static_assets.get("/").variants["identity"][0]
+    assert page.content == raw
+    assert len(static_assets.get("/").variants["gzip"][0]) < len(raw) / 2
+
+    # 再次加载只需要304
+    again = client.get("/", headers={"Accept-Encoding": "gzip", "If-None-Match": page.headers["etag"]})
+    assert again.status_code == 304 and not again.content
+
+    # 不接受压缩的客户端拿到原文，ETag与压缩版本不同
+    plain = client.get("/", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in plain.headers and plain.headers["etag"] != page.headers["etag"]
+    assert client.get("/health").json() == {"message": "Real-time Voice Chat Server is running"}
+    print(f"✓ The client page is served gzip-compressed ({len(page.content)} -> "
+          f"{len(static_assets.get('/').variants['gzip'][0])} bytes) and revalidates with 304")
+
+
+def test_fingerprinted_assets():
+    client = TestClient(app)
+    index = client.get("/chat-ui/")
+    assert index.status_code == 200
+    script = next(url for url in static_assets.assets if url.startswith("/chat-ui/script.") and url != "/chat-ui/script.js")
+    assert script.rsplit("/", 1)[1] in index.text and 'src="script.js"' not in index.text
+
+    asset = client.get(script)
+    assert asset.headers["cache-control"] == IMMUTABLE
+    assert asset.headers["content-type"].startswith("text/javascript")
+    assert client.get("/chat-ui/script.js").headers["cache-control"] == REVALIDATE
+    assert client.get("/chat-ui/server.js").status_code == 404
+    print("✓ chat-ui references are rewritten to immutable content-hashed URLs")
+
+
+def test_accept_encoding():
+    assert accepted_encodings("gzip, deflate, br;q=0") == {"gzip": 1.0, "deflate": 1.0, "br": 0.0}
+    page = static_assets.get("/")
+    assert page.select("br;q=0, gzip;q=0.5") == "gzip"
+    assert page.select("*") == ("br" if "br" in page.variants else "gzip")
+    assert page.select("gzip;q=0") == "identity"
+    assert page.matches('W/' + page.variants["gzip"][1]) and page.matches("*") and not page.matches('"other"')
+    raw = page.variants["identity"][0]
+    assert gzip.decompress(page.variants["gzip"][0]) == raw
+    print("✓ Accept-Encoding q-values and If-None-Match pick the right variant")
+
+
+if __name__ == "__main__":
+    logging.disable(logging.CRITICAL)
+    test_client_page()
+    test_fingerprinted_assets()
+    test_accept_encoding()
@@ -45,7 +45,7 @@ class VoiceChatSystemTest:
 
         try:
             # Test voice chat server
-            response = requests.get("http://localhost:8001/", timeout=5)
+            response = requests.get("http://localhost:8001/health", timeout=5)
             print(f"Voice chat server status: {response.status_code}")
 
             # Test if ports are open
@@ -1,24 +1,57 @@
-from fastapi import FastAPI, WebSocket, HTTPException
+from fastapi import FastAPI, Request, WebSocket, HTTPException, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response
 import uvicorn
-import json
+import os
+import time
 import uuid
+import signal
+import secrets
 import logging
-from typing import Dict, Set
+from typing import Dict, Optional, Set, Tuple, Union
 import asyncio
-import websockets as ws_client
-
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('voice_chat_server.log'),
-        logging.StreamHandler()
-    ]
-)
+import signaling_codec as codec
+from signaling_codec import Frame
+from signaling_schema import validate_client_message
+from audio_ingest import SUPPORTED_SAMPLE_RATES, AudioIngestManager
+from chatbot_channel import AUDIO_TYPE, DELTA_TYPE, ChatbotConnectionPool, DEFAULT_CHATBOT_URI
+from log_config import MessageLogPolicy, log_event, setup_logging
+from metrics import CONTENT_TYPE, REGISTRY
+from admission_control import AdmissionController, AdmissionRejected
+import load_shedding
+from load_shedding import OVERLOAD_RETRY_AFTER, ShedLevel
+from outbound_queue import OutboundQueue, OverflowPolicy
+from room_backend import RoomBackend, create_room_backend
+from room_log import RoomLog
+from static_assets import StaticAssets
+
+# 日志在入口处配置（本文件的__main__或serve_voice_chat.py的每个worker），导入本模块没有副作用
+LOG_FILE = 'voice_chat_server.log'
 logger = logging.getLogger(__name__)
 
+# 各类信令消息的日志级别和采样率（每N条记录1条）
+message_log = MessageLogPolicy.from_env({
+    "offer": (logging.INFO, 1),
+    "answer": (logging.INFO, 1),
+    "ice_candidate": (logging.DEBUG, 20),
+    "get_users": (logging.DEBUG, 1),
+    "pong": (logging.DEBUG, 1),
+    "asr_text": (logging.INFO, 1),
+})
+
+# 指标：热路径上只做计数和直方图分桶，连接数、队列深度等在抓取时计算
+MESSAGES_RECEIVED = REGISTRY.counter("signaling_messages_received_total", "Signaling messages received", ["type"])
+REQUESTS_REJECTED = REGISTRY.counter("signaling_rejections_total", "Connections and asr_text requests rejected", ["reason"])
+CHATBOT_RTT = REGISTRY.histogram("chatbot_round_trip_seconds", "Round-trip time of chatbot requests")
+CHATBOT_FIRST_TEXT = REGISTRY.histogram("chatbot_first_text_seconds", "Time to the first streamed bot_response_delta")
+CHATBOT_ERRORS = REGISTRY.counter("chatbot_request_errors_total", "Chatbot requests that failed")
+HEARTBEAT_EVICTIONS = REGISTRY.counter("signaling_heartbeat_evictions_total", "Connections evicted after missed pongs")
+PRESENCE_REPLIES = REGISTRY.counter("signaling_presence_replies_total", "get_users replies by kind", ["kind"])
+DEFERRED_REPLIES = REGISTRY.counter("signaling_deferred_replies_total", "Low-priority replies deferred by load shedding",
+                                    ["type"])
+SESSION_RESUMES = REGISTRY.counter("signaling_session_resumes_total", "Reconnects with a resume token by outcome",
+                                   ["outcome"])
+
 app = FastAPI(title="Real-time Voice Chat Server")
 
 # 添加CORS中间件
@@ -30,23 +63,232 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 聊天机器人服务地址及连接池配置
+CHATBOT_URI = os.getenv("CHATBOT_URI", DEFAULT_CHATBOT_URI)
+CHATBOT_POOL_MIN_SIZE = int(os.getenv("CHATBOT_POOL_MIN_SIZE", "2"))
+CHATBOT_POOL_MAX_SIZE = int(os.getenv("CHATBOT_POOL_MAX_SIZE", "8"))
+CHATBOT_POOL_IDLE_TIMEOUT = float(os.getenv("CHATBOT_POOL_IDLE_TIMEOUT", "300"))
+# 流式回复：聊天机器人每生成一段文本就以bot_response_delta转发给房间
+CHATBOT_STREAMING = os.getenv("CHATBOT_STREAMING", "1") == "1"
+
+# 每个连接的发送队列配置
+OUTBOUND_QUEUE_SIZE = int(os.getenv("OUTBOUND_QUEUE_SIZE", "256"))
+OUTBOUND_OVERFLOW_POLICY = OverflowPolicy(os.getenv("OUTBOUND_OVERFLOW_POLICY", OverflowPolicy.DROP_OLDEST.value))
+
+# 信令合并窗口（毫秒），按消息类型配置，例如 "ice_candidate=20,user_joined=30,user_left=30"
+# 窗口内发给同一接收者的同类消息合并为一个batch帧；未配置的类型立即发送
+COALESCE_WINDOWS = {
+    msg_type.strip(): float(ms) / 1000
+    for msg_type, _, ms in (item.partition("=") for item in os.getenv("COALESCE_WINDOWS", "").split(",") if item)
+}
+
+# asr_text准入控制：令牌桶格式为 "每秒请求数:突发容量"，设为0关闭该级限流
+def _rate_from_env(name: str, default: str):
+    rate, _, burst = os.getenv(name, default).partition(":")
+    return (float(rate), float(burst or 1)) if float(rate) > 0 else None
+
+ASR_RATE_PER_CLIENT = _rate_from_env("ASR_RATE_PER_CLIENT", "0.5:3")
+ASR_RATE_PER_ROOM = _rate_from_env("ASR_RATE_PER_ROOM", "1:5")
+ASR_RATE_GLOBAL = _rate_from_env("ASR_RATE_GLOBAL", "20:40")
+# 同时进行的聊天机器人请求上限，以及等待队列长度和最长等待时间
+ASR_MAX_CONCURRENT = int(os.getenv("ASR_MAX_CONCURRENT", str(CHATBOT_POOL_MAX_SIZE)))
+ASR_MAX_QUEUE = int(os.getenv("ASR_MAX_QUEUE", "32"))
+ASR_QUEUE_TIMEOUT = float(os.getenv("ASR_QUEUE_TIMEOUT", "10"))
+ASR_REJECTION_MESSAGES = {
+    "draining": "服务器正在重启，请稍后再试",
+    "overloaded": "服务器繁忙，请稍后再试",
+}
+
+# 连接数上限（0表示不限制），被拒绝的连接收到带retry_after的error帧
+MAX_CONNECTIONS = int(os.getenv("MAX_CONNECTIONS", "0"))
+MAX_CONNECTIONS_PER_ROOM = int(os.getenv("MAX_CONNECTIONS_PER_ROOM", "0"))
+CONNECTION_RETRY_AFTER = float(os.getenv("CONNECTION_RETRY_AFTER", "5"))
+CONNECTION_REJECTION_MESSAGES = {
+    "server_full": "服务器连接数已满",
+    "room_full": "房间人数已满",
+    "draining": "服务器正在重启，请连接其他节点",
+    "overloaded": "服务器繁忙，请稍后再试",
+}
+
+# 排空模式（滚动发布）：SIGUSR1或POST /admin/drain触发，等待进行中的聊天机器人请求
+# 最多DRAIN_DEADLINE秒，然后通知客户端重连到DRAIN_RECONNECT_URL并退出
+DRAIN_DEADLINE = float(os.getenv("DRAIN_DEADLINE", "30"))
+DRAIN_RECONNECT_URL = os.getenv("DRAIN_RECONNECT_URL", "")
+DRAIN_RECONNECT_DELAY = float(os.getenv("DRAIN_RECONNECT_DELAY", "1"))
+# /admin/drain需要X-Admin-Token请求头；未设置ADMIN_TOKEN时该接口关闭（CORS允许任意来源，不能不鉴权）
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# 按事件循环延迟分级降载（LOAD_SHED_TIERS，见load_shedding.py）：先推迟get_users等低优先级回复，
+# 再拒绝新的asr_text，最后拒绝新连接；已建立的会话始终正常收发信令
+
+# 心跳：客户端空闲超过HEARTBEAT_INTERVAL秒时服务器发送ping，连续HEARTBEAT_MISSED_PONGS个
+# 间隔没有任何消息（包括pong）的连接视为半开连接并被清理；间隔设为0关闭心跳
+HEARTBEAT_INTERVAL = float(os.getenv("HEARTBEAT_INTERVAL", "15"))
+HEARTBEAT_MISSED_PONGS = int(os.getenv("HEARTBEAT_MISSED_PONGS", "2"))
+
+# 断线续传：意外断开的客户端在RESUME_WINDOW秒内保留房间成员身份，带resume_token和最后收到的
+# room_seq重连即可补发错过的消息，WebRTC通话不需要重新协商；每个房间保留最近RESUME_BUFFER_SIZE帧，
+# 为0时不补发，断开期间错过任何消息的客户端重新加入
+RESUME_WINDOW = float(os.getenv("RESUME_WINDOW", "0"))
+RESUME_BUFFER_SIZE = int(os.getenv("RESUME_BUFFER_SIZE", "256"))
+# 客户端主动关闭（正常关闭、离开页面、未带状态码）时直接离开房间，不保留会话
+LEAVE_CLOSE_CODES = {1000, 1001, 1005}
+
+# 房间状态后端：memory为单进程，broker为多worker共享（见local_broker.py）
+ROOM_BACKEND = os.getenv("ROOM_BACKEND", "memory")
+ROOM_BROKER_URL = os.getenv("ROOM_BROKER_URL", "tcp://localhost:8790")
+
+# 服务器以机器人身份作为媒体端加入房间（需要aiortc）
+BOT_MEDIA_PEER = os.getenv("BOT_MEDIA_PEER", "0") == "1"
+BOT_PEER_ID = "bot"
+if BOT_MEDIA_PEER:
+    from media_peer import BotMediaManager
+
+# 房间人数超过该值时从全互联切换为中继拓扑：每个成员只与服务器的转发端建立一个连接（需要aiortc，0表示关闭）
+RELAY_ROOM_THRESHOLD = int(os.getenv("RELAY_ROOM_THRESHOLD", "0"))
+RELAY_PEER_ID = "relay"
+if RELAY_ROOM_THRESHOLD:
+    from media_relay import RelayMediaManager
+
+class ClientRecord:
+    """
+    Compact per-connection record; ``rooms`` is the client->rooms reverse index,
+    ``last_seen`` the loop time of the last frame received from the client,
+    ``wire`` the encoding negotiated for its socket, ``room_id`` the room of
+    that socket and ``resume_token``/``expiry`` the resumable session kept
+    while the socket is gone.
+    """
+    __slots__ = ("client_id", "websocket", "wire", "rooms", "outbox", "last_seen", "room_id", "resume_token",
+                 "expiry")
+
+    def __init__(self, client_id: str, websocket: WebSocket, wire=codec.JSON):
+        self.client_id = client_id
+        self.websocket = websocket
+        self.wire = wire
+        self.rooms: Set[str] = set()
+        self.room_id: Optional[str] = None
+        self.resume_token: Optional[str] = None
+        self.expiry: Optional[asyncio.TimerHandle] = None
+        self.outbox = self._open_outbox(websocket)
+        self.last_seen = asyncio.get_running_loop().time()
+
+    def _open_outbox(self, websocket: WebSocket) -> OutboundQueue:
+        outbox = OutboundQueue(websocket, self.client_id, OUTBOUND_QUEUE_SIZE, OUTBOUND_OVERFLOW_POLICY, self.wire)
+        outbox.start()
+        return outbox
+
+    @property
+    def suspended(self) -> bool:
+        return self.expiry is not None
+
+    def replace_websocket(self, websocket: WebSocket, wire=codec.JSON):
+        if self.expiry is not None:
+            self.expiry.cancel()
+            self.expiry = None
+        self.outbox.close()
+        self.websocket = websocket
+        self.wire = wire
+        self.outbox = self._open_outbox(websocket)
+        self.last_seen = asyncio.get_running_loop().time()
+
 # 存储连接的客户端
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
+    def __init__(self, backend: RoomBackend = None):
+        # clients和rooms只包含连接到本进程的客户端，跨进程的成员和路由由backend负责
+        self.clients: Dict[str, ClientRecord] = {}
         self.rooms: Dict[str, Set[str]] = {}
-        self.asr_chatbot_connections: Dict[str, ws_client.WebSocketClientProtocol] = {}
+        self.backend = backend or create_room_backend("memory", ROOM_BROKER_URL)
+        # 所有房间共享的聊天机器人连接池
+        self.chatbot_pool = ChatbotConnectionPool(
+            CHATBOT_URI,
+            min_size=CHATBOT_POOL_MIN_SIZE,
+            max_size=CHATBOT_POOL_MAX_SIZE,
+            idle_timeout=CHATBOT_POOL_IDLE_TIMEOUT
+        )
+        # 聊天机器人请求的限流与并发控制
+        self.admission = AdmissionController(
+            client_rate=ASR_RATE_PER_CLIENT,
+            room_rate=ASR_RATE_PER_ROOM,
+            global_rate=ASR_RATE_GLOBAL,
+            max_concurrent=ASR_MAX_CONCURRENT,
+            max_queue=ASR_MAX_QUEUE,
+            queue_timeout=ASR_QUEUE_TIMEOUT
+        )
+        # 机器人媒体端，仅在BOT_MEDIA_PEER模式下启用
+        self.bot_media = None
+        # 中继转发端及已切换为中继拓扑的房间，仅在设置RELAY_ROOM_THRESHOLD时启用
+        self.relay_media = None
+        self.relay_rooms: Set[str] = set()
+        # 排空模式下不再接受新房间和新的聊天机器人请求
+        self.draining = False
+        # 事件循环延迟监控及降载级别
+        self.shedder = load_shedding.from_env()
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        # 每个房间最新版本的users_list帧，版本不变时直接复用
+        self._snapshots: Dict[str, Tuple[int, Frame]] = {}
+        # 断线续传：每个房间的消息序号和最近消息的环形缓冲区，resume_window为0时关闭
+        self.resume_window = RESUME_WINDOW
+        self.room_logs: Dict[str, RoomLog] = {}
+        # 在接收循环之外运行的请求处理任务（asr_text），保持引用直到完成
+        self.tasks: Set[asyncio.Task] = set()
 
-    async def connect(self, websocket: WebSocket, client_id: str, room_id: str):
-        await websocket.accept()
-        self.active_connections[client_id] = websocket
+    def connection_rejection(self, client_id: str, room_id: str) -> Optional[str]:
+        """Reason a new connection would exceed the caps, or None to admit it"""
+        if client_id in self.clients:
+            # 重连沿用原有名额
+            return None
+        if self.draining and room_id not in self.rooms:
+            return "draining"
+        if self.shedder.level >= ShedLevel.REFUSE:
+            return "overloaded"
+        if MAX_CONNECTIONS and len(self.clients) >= MAX_CONNECTIONS:
+            return "server_full"
+        if MAX_CONNECTIONS_PER_ROOM and len(self.rooms.get(room_id, ())) >= MAX_CONNECTIONS_PER_ROOM:
+            return "room_full"
+        return None
+
+    async def connect(self, websocket: WebSocket, client_id: str, room_id: str,
+                      subprotocol: Optional[str] = None, resume_token: Optional[str] = None,
+                      last_seq: Optional[int] = None) -> ClientRecord:
+        if subprotocol:
+            await websocket.accept(subprotocol)
+        else:
+            await websocket.accept()
+        wire = codec.wire_for(subprotocol)
+        record = self.clients.get(client_id)
+        missed = None
+        if record is None:
+            record = self.clients[client_id] = ClientRecord(client_id, websocket, wire)
+        else:
+            if resume_token:
+                missed = self._resumable(record, room_id, resume_token, last_seq)
+            # 同一client_id重连时沿用房间索引，替换为新的连接
+            record.replace_websocket(websocket, wire)
+        record.room_id = room_id
+
+        if missed is not None:
+            # 续传：仍是房间成员，只补发断开期间错过的消息，其他成员不会收到user_joined
+            self._start_session(record, room_id, last_seq)
+            for frame in missed:
+                record.outbox.put_nowait(frame.encode(record.wire))
+            log_event(logger, logging.INFO, "client_resumed", client_id=client_id, room_id=room_id,
+                      replayed=len(missed))
+            return record
+        if resume_token:
+            SESSION_RESUMES.labels("rejected").inc()
+
+        if record.rooms - {room_id}:
+            # 同一client_id未续传就换到另一个房间：先离开原来的房间，旧房间的广播和成员列表不再包含它
+            self._leave_rooms(record, keep=room_id)
 
         # 加入房间
-        if room_id not in self.rooms:
-            self.rooms[room_id] = set()
-        self.rooms[room_id].add(client_id)
+        self.rooms.setdefault(room_id, set()).add(client_id)
+        record.rooms.add(room_id)
+        await self.backend.join(room_id, client_id)
 
-        logger.info(f"Client {client_id} connected to room {room_id}")
+        log_event(logger, logging.INFO, "client_connected", client_id=client_id, room_id=room_id)
+        if self.resume_window:
+            self._start_session(record, room_id)
 
         # 通知房间内其他用户有新用户加入
         await self.broadcast_to_room(room_id, {
@@ -54,159 +296,773 @@ class ConnectionManager:
             "client_id": client_id
         }, exclude_client=client_id)
 
-    def disconnect(self, client_id: str):
-        if client_id in self.active_connections:
-            del self.active_connections[client_id]
+        if self.bot_media is not None:
+            # 机器人始终在房间中，新用户需要与它建立连接
+            await record.outbox.put(record.wire.dumps({
+                "type": "user_joined",
+                "client_id": BOT_PEER_ID
+            }))
+        if self.relay_media is not None:
+            await self._update_topology(room_id, record)
+        return record
+
+    def _resumable(self, record: ClientRecord, room_id: str, resume_token: str,
+                   last_seq: Optional[int]) -> Optional[list]:
+        """Frames to replay if the token resumes ``record`` in ``room_id``, else None"""
+        if (not self.resume_window or last_seq is None or record.resume_token is None
+                or not secrets.compare_digest(record.resume_token, resume_token)
+                or record.room_id != room_id or room_id not in self.rooms):
+            return None
+        missed = self._room_log(room_id).replay(record.client_id, last_seq)
+        if missed is None:
+            # 缓冲区已经覆盖不到断开期间的消息
+            SESSION_RESUMES.labels("gap").inc()
+            return None
+        SESSION_RESUMES.labels("resumed").inc()
+        return missed
+
+    def _start_session(self, record: ClientRecord, room_id: str, last_seq: Optional[int] = None):
+        """Issue a fresh resume token; ``room_seq`` is where the frames that follow pick up"""
+        record.resume_token = secrets.token_urlsafe(16)
+        room_log = self.room_logs.get(room_id)
+        record.outbox.put_nowait(record.wire.dumps({
+            "type": "session",
+            "resume_token": record.resume_token,
+            "room_seq": last_seq if last_seq is not None else (room_log.seq if room_log is not None else 0),
+            "resumed": last_seq is not None
+        }))
 
-        # 从所有房间中移除
-        for room_id, clients in self.rooms.items():
-            if client_id in clients:
-                clients.remove(client_id)
-                # 通知房间内其他用户该用户离开
-                asyncio.create_task(self.broadcast_to_room(room_id, {
-                    "type": "user_left",
-                    "client_id": client_id
-                }, exclude_client=client_id))
+    def suspend(self, client_id: str, websocket: WebSocket):
+        """
+        A client's socket dropped unexpectedly: keep its room membership for
+        ``resume_window`` seconds so it can resume, then disconnect it.
+        """
+        record = self.clients.get(client_id)
+        if not self.resume_window or self.draining or record is None or record.resume_token is None:
+            self.disconnect(client_id, websocket)
+            return
+        if record.websocket is not websocket or record.suspended:
+            return
+        record.outbox.close()
+        record.expiry = asyncio.get_running_loop().call_later(self.resume_window, self.disconnect, client_id,
+                                                              websocket)
+        log_event(logger, logging.INFO, "client_suspended", client_id=client_id, room_id=record.room_id,
+                  window=self.resume_window)
 
-    async def send_personal_message(self, message: str, client_id: str):
-        if client_id in self.active_connections:
-            await self.active_connections[client_id].send_text(message)
+    async def _update_topology(self, room_id: str, record: ClientRecord):
+        """Move a room to relay topology once it outgrows the mesh threshold"""
+        topology = {"type": "topology", "mode": "relay", "peer": RELAY_PEER_ID}
+        if room_id in self.relay_rooms:
+            # 房间已经是中继拓扑，新成员直接连接中继
+            await record.outbox.put(record.wire.dumps(topology))
+        elif len(self.rooms[room_id]) > RELAY_ROOM_THRESHOLD:
+            # 切换后不再回到全互联，直到房间清空，避免人数在阈值附近时反复重新协商
+            self.relay_rooms.add(room_id)
+            log_event(logger, logging.INFO, "topology_switched", room_id=room_id, mode="relay",
+                      members=len(self.rooms[room_id]))
+            await self.broadcast_to_room(room_id, topology)
+
+    def disconnect(self, client_id: str, websocket: WebSocket = None):
+        record = self.clients.get(client_id)
+        if record is None:
+            return
+        if websocket is not None and record.websocket is not websocket:
+            # 该client_id已经用新连接重新加入，旧连接的清理不能移除它
+            return
+        del self.clients[client_id]
+        if record.expiry is not None:
+            record.expiry.cancel()
+            record.expiry = None
+        record.outbox.close()
+        self.admission.forget_client(client_id)
+
+        self._leave_rooms(record)
+
+    def _leave_rooms(self, record: ClientRecord, keep: Optional[str] = None):
+        """Take the client out of its rooms, except ``keep``, and tell the remaining members"""
+        client_id = record.client_id
+        # 只遍历该用户所在的房间，而不是所有房间
+        for room_id in list(record.rooms):
+            if room_id == keep:
+                continue
+            record.rooms.discard(room_id)
+            members = self.rooms.get(room_id)
+            if members is None:
+                continue
+            members.discard(client_id)
+            if self.bot_media is not None:
+                self.spawn(self.bot_media.remove_client(room_id, client_id))
+            if self.relay_media is not None:
+                self.spawn(self.relay_media.remove_client(room_id, client_id))
+            # 通知房间内其他用户（包括其他worker上的）该用户离开
+            self.spawn(self._leave_room(room_id, client_id))
+            if not members:
+                self._close_room(room_id)
+
+    async def _leave_room(self, room_id: str, client_id: str):
+        try:
+            await self.backend.leave(room_id, client_id)
+        except Exception as e:
+            logger.error(f"Room backend failed to remove client {client_id} from room {room_id}: {e}")
+        await self.broadcast_to_room(room_id, {
+            "type": "user_left",
+            "client_id": client_id
+        }, exclude_client=client_id)
+
+    def _close_room(self, room_id: str):
+        """Drop an empty room and everything held for it"""
+        self.rooms.pop(room_id, None)
+        self._snapshots.pop(room_id, None)
+        self.room_logs.pop(room_id, None)
+        self.admission.forget_room(room_id)
+        if self.bot_media is not None:
+            self.spawn(self.bot_media.close_room(room_id))
+        if room_id in self.relay_rooms:
+            self.relay_rooms.discard(room_id)
+            self.spawn(self.relay_media.close_room(room_id))
+        log_event(logger, logging.INFO, "room_removed", room_id=room_id)
+
+    def spawn(self, coro) -> asyncio.Task:
+        """
+        Run ``coro`` in the background: request handlers beside the client's receive
+        loop, and the fire-and-forget cleanup and delivery work. The task is kept
+        referenced until it finishes, its failure is logged and shutdown cancels it.
+        """
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self._task_done)
+        return task
+
+    def _task_done(self, task: asyncio.Task):
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Background task failed: {task.exception()}", exc_info=task.exception())
+
+    def start_heartbeat(self, interval: float = HEARTBEAT_INTERVAL, missed_pongs: int = HEARTBEAT_MISSED_PONGS):
+        if interval > 0 and self._heartbeat_task is None:
+            self._heartbeat_task = asyncio.create_task(self._heartbeat_loop(interval, missed_pongs))
+
+    def stop_heartbeat(self):
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
+
+    async def _heartbeat_loop(self, interval: float, missed_pongs: int):
+        loop = asyncio.get_running_loop()
+        ping = Frame({"type": "ping"})
+        while True:
+            await asyncio.sleep(interval)
+            if self.shedder.level >= ShedLevel.DEFER:
+                # 事件循环积压时pong可能还没被读到，这时清理会误杀正常连接
+                continue
+            now = loop.time()
+            for record in list(self.clients.values()):
+                if record.suspended:
+                    # 断开的会话由续传窗口负责清理
+                    continue
+                idle = now - record.last_seen
+                if idle >= interval * missed_pongs:
+                    self._evict(record, idle)
+                elif idle >= interval:
+                    # 只ping空闲的连接，活跃连接的消息本身就证明它还在线
+                    record.outbox.put_nowait(ping.encode(record.wire))
+
+    def _evict(self, record: ClientRecord, idle: float):
+        """Drop a half-open connection as if it had disconnected"""
+        HEARTBEAT_EVICTIONS.inc()
+        log_event(logger, logging.WARNING, "client_evicted", client_id=record.client_id, idle=round(idle, 1))
+        websocket = record.websocket
+        # 半开连接多半是网络中断，开启续传时保留会话等待客户端重连
+        self.suspend(record.client_id, websocket)
+        self.spawn(self._close_quietly(websocket))
+
+    @staticmethod
+    async def _close_quietly(websocket: WebSocket):
+        try:
+            # 1001: Going Away；半开连接上关闭帧可能永远发不出去
+            await asyncio.wait_for(websocket.close(code=1001), 5)
+        except Exception:
+            pass
+
+    async def drain(self, deadline: float, reconnect_url: str = ""):
+        """
+        Stop admitting work, let in-flight chatbot requests finish within
+        ``deadline`` seconds, then send every client a reconnect hint and close.
+        """
+        self.draining = True
+        loop = asyncio.get_running_loop()
+        give_up_at = loop.time() + deadline
+        log_event(logger, logging.WARNING, "drain_started", clients=len(self.clients),
+                  in_flight=self.admission.running + self.admission.waiting, deadline=deadline)
+
+        while (self.admission.running or self.admission.waiting) and loop.time() < give_up_at:
+            await asyncio.sleep(0.1)
+        abandoned = self.admission.running + self.admission.waiting
+
+        hint = Frame({
+            "type": "reconnect",
+            "url": reconnect_url or None,
+            "retry_after": DRAIN_RECONNECT_DELAY
+        })
+        records = list(self.clients.values())
+        for record in records:
+            record.outbox.put_nowait(hint.encode(record.wire))
+        # 等待发送队列清空，确保回复和重连提示都已送达
+        flush_until = loop.time() + 2
+        while any(record.outbox.depth for record in records) and loop.time() < flush_until:
+            await asyncio.sleep(0.05)
+        for record in records:
+            try:
+                # 1012: Service Restart
+                await record.websocket.close(code=1012)
+            except Exception:
+                pass
+        log_event(logger, logging.WARNING, "drain_finished", clients=len(records), abandoned=abandoned)
+
+    async def send_signal(self, client_id: str, message: dict):
+        """Send a signaling message on behalf of a server-side peer"""
+        await self.send_personal_message(message, client_id)
+
+    async def send_personal_message(self, message: Union[dict, str, Frame], client_id: str):
+        """Send to one client; ``message`` is a record, pre-encoded JSON text or a Frame"""
+        frame = Frame.of(message)
+        record = self.clients.get(client_id)
+        if record is not None:
+            frame = self._log_for(record, frame)
+            await record.outbox.put(frame.encode(record.wire))
+        else:
+            # 目标客户端可能连接在其他worker上，worker之间统一用JSON
+            await self.backend.publish_client(client_id, frame.json)
 
     async def broadcast_to_room(self, room_id: str, message: dict, exclude_client: str = None):
+        # 每种编码只序列化一次，使用同一编码的接收者共享同一个帧
+        frame = Frame(message)
+        await self._deliver_to_room(room_id, frame, exclude_client, COALESCE_WINDOWS.get(message.get("type")))
+        await self.backend.publish_room(room_id, frame.json, exclude_client)
+
+    def _log_for(self, record: ClientRecord, frame: Frame) -> Frame:
+        """Sequence a message targeted at one client in the room it would resume into"""
+        if self.resume_window and record.room_id in self.rooms:
+            return self._room_log(record.room_id).append(frame, target=record.client_id)
+        return frame
+
+    def _room_log(self, room_id: str) -> RoomLog:
+        room_log = self.room_logs.get(room_id)
+        if room_log is None:
+            room_log = self.room_logs[room_id] = RoomLog(RESUME_BUFFER_SIZE)
+        return room_log
+
+    async def _deliver_to_room(self, room_id: str, frame: Frame, exclude_client: str = None, window: float = None):
         if room_id in self.rooms:
+            if self.resume_window:
+                # 其他worker发布的是未编号的帧，各worker按本地的房间序号编号
+                frame = self._room_log(room_id).append(frame, exclude=exclude_client)
+            # 只是把消息放入各连接的发送队列，由各自的写任务发送，慢客户端不会拖慢整个房间
+            blocked = []
             for client_id in self.rooms[room_id]:
-                if client_id != exclude_client and client_id in self.active_connections:
-                    try:
-                        await self.active_connections[client_id].send_text(json.dumps(message))
-                    except Exception as e:
-                        logger.error(f"Error sending message to client {client_id}: {e}")
-
-    async def connect_to_asr_chatbot(self, room_id: str):
-        """Connect to ASR chatbot server for a specific room"""
-        if room_id not in self.asr_chatbot_connections:
-            try:
-                chatbot_ws = await ws_client.connect("ws://localhost:8765")
-                self.asr_chatbot_connections[room_id] = chatbot_ws
-                logger.info(f"Connected to ASR chatbot for room {room_id}")
-                return chatbot_ws
-            except Exception as e:
-                logger.error(f"Failed to connect to ASR chatbot for room {room_id}: {e}")
-                return None
-        return self.asr_chatbot_connections[room_id]
+                record = self.clients.get(client_id)
+                if client_id != exclude_client and record is not None:
+                    data = frame.encode(record.wire)
+                    if window:
+                        record.outbox.put_batched(data, window)
+                    elif record.outbox.policy is OverflowPolicy.BLOCK:
+                        blocked.append(record.outbox.put(data))
+                    else:
+                        record.outbox.put_nowait(data)
+            if blocked:
+                await asyncio.gather(*blocked)
+
+    def on_backend_message(self, room_id: str, client_id: str, exclude_client: str, data: str):
+        """Deliver a frame published by another worker to local clients"""
+        frame = Frame(json_text=data)
+        if room_id is not None:
+            self.spawn(self._deliver_to_room(room_id, frame, exclude_client))
+            return
+        record = self.clients.get(client_id)
+        if record is not None:
+            record.outbox.put_nowait(self._log_for(record, frame).encode(record.wire))
+
+    async def presence_reply(self, room_id: str, since_version: Optional[int] = None) -> Frame:
+        """
+        Answer get_users: the full ``users_list`` (a cached snapshot per version),
+        ``users_delta`` with the changes since ``since_version``, or ``users_unchanged``.
+        """
+        delta = await self.backend.presence(room_id, since_version, self.rooms.get(room_id, ()))
+        if delta.members is None and delta.unchanged:
+            PRESENCE_REPLIES.labels("unchanged").inc()
+            return Frame({"type": "users_unchanged", "version": delta.version})
+        if delta.members is None:
+            PRESENCE_REPLIES.labels("delta").inc()
+            return Frame({"type": "users_delta", "version": delta.version, "added": delta.added,
+                          "removed": delta.removed})
+
+        PRESENCE_REPLIES.labels("full").inc()
+        cached = self._snapshots.get(room_id)
+        if delta.version is not None and cached is not None and cached[0] == delta.version:
+            return cached[1]
+        users = delta.members
+        if self.bot_media is not None:
+            users.append(BOT_PEER_ID)
+        snapshot = Frame({"type": "users_list", "users": users, "version": delta.version})
+        if delta.version is not None and room_id in self.rooms:
+            self._snapshots[room_id] = (delta.version, snapshot)
+        return snapshot
+
+    async def send_presence(self, room_id: str, client_id: str, since_version: Optional[int] = None):
+        """Answer get_users now, or once the loop catches up when low-priority work is deferred"""
+        async def reply():
+            if room_id in self.rooms and client_id in self.clients:
+                await self.send_personal_message(await self.presence_reply(room_id, since_version), client_id)
+
+        if self.shedder.level >= ShedLevel.DEFER:
+            # 同一客户端重复的get_users只保留最新的一个
+            DEFERRED_REPLIES.labels("get_users").inc()
+            self.shedder.defer(("get_users", client_id), reply)
+        else:
+            await reply()
+
+    async def room_members(self, room_id: str) -> Set[str]:
+        """Members of a room across all workers"""
+        return await self.backend.members(room_id, self.rooms.get(room_id, ()))
 
     async def send_to_asr_chatbot(self, room_id: str, message: dict):
         """Send message to ASR chatbot and return response"""
-        logger.info(f"Sending message to ASR chatbot for room {room_id}: {message}")
-        chatbot_ws = await self.connect_to_asr_chatbot(room_id)
-        if chatbot_ws:
-            try:
-                await chatbot_ws.send(json.dumps(message, ensure_ascii=False))
-                logger.info("Message sent to ASR chatbot, waiting for response...")
-                response = await chatbot_ws.recv()
-                logger.info(f"Received response from ASR chatbot: {response}")
-                return json.loads(response)
-            except Exception as e:
-                logger.error(f"Error communicating with ASR chatbot for room {room_id}: {e}", exc_info=True)
-        else:
-            logger.error(f"Failed to establish connection to ASR chatbot for room {room_id}")
+        log_event(logger, logging.DEBUG, "chatbot_request", room_id=room_id, client_id=message.get("client_id"))
+        try:
+            # 多路复用：并发请求通过request_id匹配各自的响应
+            start = time.perf_counter()
+            response = await self.chatbot_pool.request(message)
+            CHATBOT_RTT.observe(time.perf_counter() - start)
+            log_event(logger, logging.DEBUG, "chatbot_reply", room_id=room_id, type=response.get("type"))
+            return response
+        except Exception as e:
+            CHATBOT_ERRORS.inc()
+            logger.error(f"Error communicating with ASR chatbot for room {room_id}: {e}", exc_info=True)
         return None
 
-manager = ConnectionManager()
+    async def stream_from_asr_chatbot(self, room_id: str, message: dict):
+        """Stream a chatbot request, relaying each delta to the room; returns the final reply"""
+        log_event(logger, logging.DEBUG, "chatbot_request", room_id=room_id, client_id=message.get("client_id"),
+                  stream=True)
+        start = time.perf_counter()
+        deltas = 0
+        frames = self.chatbot_pool.stream(message)
+        handed_off = False
+        try:
+            async for frame in frames:
+                if frame.get("type") != DELTA_TYPE:
+                    CHATBOT_RTT.observe(time.perf_counter() - start)
+                    log_event(logger, logging.DEBUG, "chatbot_reply", room_id=room_id, type=frame.get("type"),
+                              deltas=deltas)
+                    if frame.get("audio_pending"):
+                        # 语音还在合成：文本回复立即交给房间，音频到达后再由机器人播放
+                        self.spawn(self._follow_audio(room_id, frames))
+                        handed_off = True
+                    return frame
+                if not deltas:
+                    CHATBOT_FIRST_TEXT.observe(time.perf_counter() - start)
+                deltas += 1
+                await self.broadcast_to_room(room_id, {
+                    "type": DELTA_TYPE,
+                    "seq": frame.get("seq"),
+                    "text": frame.get("text", ""),
+                    "client_id": message.get("client_id"),
+                    "session_id": room_id
+                })
+        except Exception as e:
+            CHATBOT_ERRORS.inc()
+            logger.error(f"Error streaming from ASR chatbot for room {room_id}: {e}", exc_info=True)
+        finally:
+            # 立即结束流，请求不再计入通道负载，不用等异步生成器被垃圾回收
+            if not handed_off:
+                await frames.aclose()
+        return None
+
+    async def _follow_audio(self, room_id: str, frames):
+        """Play the speech of a streamed reply once the chatbot has synthesized it"""
+        try:
+            async for frame in frames:
+                if frame.get("type") == AUDIO_TYPE and frame.get("audio_file") and self.bot_media is not None:
+                    await self.bot_media.speak(room_id, frame["audio_file"])
+        except Exception as e:
+            logger.warning(f"No speech for the streamed reply in room {room_id}: {e}")
+        finally:
+            await frames.aclose()
+
+manager = ConnectionManager(create_room_backend(ROOM_BACKEND, ROOM_BROKER_URL))
+# 服务器端识别使用的每客户端PCM环形缓冲区
+audio_ingest = AudioIngestManager()
+if BOT_MEDIA_PEER:
+    manager.bot_media = BotMediaManager(audio_ingest)
+if RELAY_ROOM_THRESHOLD:
+    manager.relay_media = RelayMediaManager(manager.send_signal, RELAY_PEER_ID)
+
+REGISTRY.gauge("signaling_connections", "Open signaling WebSocket connections", lambda: len(manager.clients))
+REGISTRY.gauge("signaling_rooms", "Rooms with members on this worker", lambda: len(manager.rooms))
+REGISTRY.gauge("signaling_relay_rooms", "Rooms switched to relay topology", lambda: len(manager.relay_rooms))
+REGISTRY.gauge("outbound_queue_depth", "Frames waiting in per-connection send queues",
+               lambda: sum(record.outbox.depth for record in manager.clients.values()))
+REGISTRY.gauge("outbound_queue_dropped", "Frames dropped by full send queues of open connections",
+               lambda: sum(record.outbox.dropped for record in manager.clients.values()))
+REGISTRY.gauge("chatbot_requests_running", "asr_text requests holding a chatbot slot",
+               lambda: manager.admission.running)
+REGISTRY.gauge("chatbot_requests_queued", "asr_text requests waiting in the admission queue",
+               lambda: manager.admission.waiting)
+REGISTRY.gauge("chatbot_pool_connections", "Open connections in the chatbot pool", lambda: manager.chatbot_pool.size)
+REGISTRY.gauge("chatbot_pool_in_flight", "Requests in flight on the chatbot pool", lambda: manager.chatbot_pool.in_flight)
+REGISTRY.gauge("event_loop_lag_seconds", "Latest event loop lag sample", lambda: manager.shedder.lag)
+REGISTRY.gauge("load_shed_level", "Load shedding tier: 0 normal, 1 defer, 2 reject asr_text, 3 refuse connections",
+               lambda: int(manager.shedder.level))
+REGISTRY.gauge("load_shed_deferred", "Low-priority replies waiting for the loop to catch up",
+               lambda: manager.shedder.deferred)
+REGISTRY.gauge("audio_ingest_streams", "Open server-side ASR audio streams", lambda: len(audio_ingest.buffers))
+
+async def drain_and_exit(reconnect_url: str = DRAIN_RECONNECT_URL):
+    """Drain this worker, then stop uvicorn so the shutdown hooks run"""
+    await manager.drain(DRAIN_DEADLINE, reconnect_url)
+    os.kill(os.getpid(), signal.SIGTERM)
+
+def start_drain(reconnect_url: str = DRAIN_RECONNECT_URL) -> bool:
+    if manager.draining:
+        return False
+    manager.draining = True
+    manager.spawn(drain_and_exit(reconnect_url))
+    return True
+
+@app.on_event("startup")
+async def startup():
+    await manager.backend.start(manager.on_backend_message)
+    # 预热聊天机器人连接，避免新房间的第一句话承担建连开销
+    await manager.chatbot_pool.start()
+    manager.start_heartbeat()
+    manager.shedder.start()
+    try:
+        # kill -USR1 <pid> 触发排空后退出
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, start_drain)
+    except (AttributeError, NotImplementedError, RuntimeError):
+        # Windows或非主线程的事件循环不支持信号，只能通过 /admin/drain 触发
+        logger.info("SIGUSR1 drain trigger unavailable, use POST /admin/drain")
+
+@app.on_event("shutdown")
+async def shutdown():
+    manager.stop_heartbeat()
+    for task in list(manager.tasks):
+        task.cancel()
+    manager.shedder.stop()
+    await manager.chatbot_pool.close()
+    await manager.backend.close()
+    if manager.bot_media is not None:
+        await manager.bot_media.close()
+    if manager.relay_media is not None:
+        await manager.relay_media.close()
+
+# 浏览器客户端：启动时读入内存并预压缩，首页和chat-ui页面用ETag重新验证，带指纹的资源永久缓存
+STATIC_ROOT = os.path.dirname(os.path.abspath(__file__))
+static_assets = StaticAssets()
+static_assets.add_page(os.path.join(STATIC_ROOT, "voice_chat_client.html"), ["/", "/voice_chat_client.html"])
+if os.path.isdir(os.path.join(STATIC_ROOT, "chat-ui")):
+    static_assets.add_directory(os.path.join(STATIC_ROOT, "chat-ui"), "/chat-ui/")
 
 @app.get("/")
-async def root():
+async def root(request: Request):
+    return static_assets.respond(request)
+
+@app.get("/health")
+async def health():
     return {"message": "Real-time Voice Chat Server is running"}
 
+@app.get("/voice_chat_client.html")
+async def voice_chat_client(request: Request):
+    return static_assets.respond(request)
+
+@app.get("/chat-ui/{name:path}")
+async def chat_ui(request: Request, name: str):
+    return static_assets.respond(request)
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text exposition of this worker's metrics"""
+    return Response(REGISTRY.render(), headers={"Content-Type": CONTENT_TYPE})
+
+@app.post("/admin/drain")
+async def admin_drain(x_admin_token: str = Header(""), reconnect_url: str = DRAIN_RECONNECT_URL):
+    """Put this worker into drain mode ahead of a restart"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="admin endpoint disabled, set ADMIN_TOKEN")
+    if not secrets.compare_digest(x_admin_token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="invalid admin token")
+    started = start_drain(reconnect_url)
+    return {"status": "draining", "started": started, "deadline": DRAIN_DEADLINE}
+
+async def handle_asr_text(client_id: str, room_id: str, message: dict):
+    """Forward one asr_text to the chatbot and relay the reply; runs outside the receive loop"""
+    # 处理ASR文本消息
+    asr_text = message.get("text", "")
+    log_event(logger, logging.DEBUG, "asr_text", client_id=client_id, text=asr_text)
+
+    if asr_text and asr_text.strip():
+        # 转发ASR文本到聊天机器人
+        chatbot_message = {
+            "type": "asr_text",
+            "text": asr_text,
+            "client_id": client_id,
+            "session_id": room_id
+        }
+
+        try:
+            # 超出限流或排队已满时立即拒绝，而不是让聊天机器人后端过载
+            if manager.draining:
+                raise AdmissionRejected("draining", DRAIN_RECONNECT_DELAY)
+            if manager.shedder.level >= ShedLevel.REJECT:
+                raise AdmissionRejected("overloaded", OVERLOAD_RETRY_AFTER)
+            manager.admission.check_rate(client_id, room_id)
+            async with manager.admission.slot():
+                if CHATBOT_STREAMING:
+                    response = await manager.stream_from_asr_chatbot(room_id, chatbot_message)
+                else:
+                    response = await manager.send_to_asr_chatbot(room_id, chatbot_message)
+        except AdmissionRejected as e:
+            REQUESTS_REJECTED.labels(e.reason).inc()
+            log_event(logger, logging.WARNING, "asr_text_rejected", client_id=client_id,
+                      room_id=room_id, reason=e.reason, retry_after=round(e.retry_after, 2))
+            await manager.send_personal_message({
+                "type": "error",
+                "code": e.reason,
+                "message": ASR_REJECTION_MESSAGES.get(e.reason, "请求过多，请稍后再试"),
+                "retry_after": round(e.retry_after, 2)
+            }, client_id)
+            return
+
+        if response and response.get("type") == "error":
+            # 聊天机器人自身过载或出错，原样告知发送者（保留code和retry_after）
+            error = {"type": "error", "message": response.get("message") or "无法从聊天机器人获取响应"}
+            for field in ("code", "retry_after"):
+                if field in response:
+                    error[field] = response[field]
+            await manager.send_personal_message(error, client_id)
+        elif response:
+            log_event(logger, logging.INFO, "bot_response", room_id=room_id,
+                      client_id=client_id, length=len(response.get("text") or ""))
+            # 将聊天机器人响应广播到房间
+            await manager.broadcast_to_room(room_id, {
+                "type": "bot_response",
+                "text": response.get("text", ""),
+                "client_id": client_id,
+                "session_id": room_id
+            })
+            if manager.bot_media is not None and response.get("audio_file"):
+                # 通过机器人的音频轨道播放合成语音
+                manager.spawn(manager.bot_media.speak(room_id, response["audio_file"]))
+        else:
+            logger.error("Failed to get response from chatbot")
+            await manager.send_personal_message({
+                "type": "error",
+                "message": "无法从聊天机器人获取响应"
+            }, client_id)
+    else:
+        logger.warning("Received empty ASR text")
+        await manager.send_personal_message({
+            "type": "error",
+            "message": "收到空的ASR文本"
+        }, client_id)
+
 @app.websocket("/ws/{client_id}/{room_id}")
-async def websocket_endpoint(websocket: WebSocket, client_id: str, room_id: str):
-    await manager.connect(websocket, client_id, room_id)
+async def websocket_endpoint(websocket: WebSocket, client_id: str, room_id: str, resume_token: str = "",
+                             last_seq: Optional[int] = None):
+    # Sec-WebSocket-Protocol协商编码：voicechat.msgpack或JSON（默认）
+    subprotocol = codec.negotiate(websocket.scope.get("subprotocols", ()))
+    rejection = manager.connection_rejection(client_id, room_id)
+    if rejection:
+        REQUESTS_REJECTED.labels(rejection).inc()
+        log_event(logger, logging.WARNING, "connection_rejected", client_id=client_id, room_id=room_id,
+                  reason=rejection)
+        await websocket.accept(subprotocol)
+        error = codec.wire_for(subprotocol).dumps({
+            "type": "error",
+            "code": rejection,
+            "message": CONNECTION_REJECTION_MESSAGES[rejection],
+            "retry_after": DRAIN_RECONNECT_DELAY if rejection == "draining" else CONNECTION_RETRY_AFTER
+        })
+        if isinstance(error, str):
+            await websocket.send_text(error)
+        else:
+            await websocket.send_bytes(error)
+        await websocket.close(code=1013)
+        return
+
+    record = await manager.connect(websocket, client_id, room_id, subprotocol, resume_token, last_seq)
+    loop = asyncio.get_running_loop()
+    # 未收到关闭码的异常断开按网络中断处理
+    close_code = None
     try:
         while True:
-            # 接收来自客户端的消息
-            data = await websocket.receive_text()
-            message = json.loads(data)
+            # 接收来自客户端的消息：文本帧是JSON，二进制帧是msgpack
+            received = await websocket.receive()
+            if received["type"] == "websocket.disconnect":
+                close_code = received.get("code", 1000)
+                break
+            data = received.get("text")
+            if data is None:
+                data = received.get("bytes")
+            record.last_seen = loop.time()
+            try:
+                message = codec.decode(data)
+            except (codec.DecodeError, ValueError) as e:
+                message = None
+                problem = f"undecodable frame: {e}"
+            else:
+                problem = validate_client_message(message)
+            if problem is not None:
+                # 不符合signaling_schema的帧不进入处理逻辑，连接保持打开
+                MESSAGES_RECEIVED.labels("invalid").inc()
+                log_event(logger, logging.WARNING, "invalid_message", client_id=client_id, room_id=room_id,
+                          problem=problem)
+                await manager.send_personal_message({
+                    "type": "error",
+                    "code": "invalid_message",
+                    "message": f"无效的消息: {problem}"
+                }, client_id)
+                continue
 
             # 处理不同类型的消息
-            msg_type = message.get("type")
-            logger.info(f"Received message from client {client_id} in room {room_id}: {message}")
+            msg_type = message["type"]
+            MESSAGES_RECEIVED.labels(msg_type).inc()
+            level = message_log.level_for(msg_type)
+            if level is not None:
+                log_event(logger, level, "message_received", type=msg_type, client_id=client_id,
+                          room_id=room_id, size=len(data))
+
+            if msg_type == "offer" and manager.bot_media is not None and message.get("target") == BOT_PEER_ID:
+                # 服务器作为机器人参与者直接应答，媒体走UDP/SRTP
+                try:
+                    answer_sdp = await manager.bot_media.handle_offer(room_id, client_id, message.get("sdp"))
+                    await manager.send_personal_message({
+                        "type": "answer",
+                        "sender": BOT_PEER_ID,
+                        "sdp": answer_sdp
+                    }, client_id)
+                except Exception as e:
+                    logger.error(f"Bot media negotiation failed for client {client_id}: {e}", exc_info=True)
+                    await manager.send_personal_message({
+                        "type": "error",
+                        "message": "机器人媒体连接失败"
+                    }, client_id)
 
-            if msg_type == "offer":
-                # 转发offer给房间内其他用户
-                await manager.broadcast_to_room(room_id, {
+            elif msg_type == "offer" and manager.relay_media is not None and message.get("target") == RELAY_PEER_ID:
+                # 中继拓扑：成员只向服务器转发端上传一路音频
+                try:
+                    answer_sdp = await manager.relay_media.handle_offer(room_id, client_id, message.get("sdp"))
+                    await manager.send_signal(client_id, {
+                        "type": "answer",
+                        "sender": RELAY_PEER_ID,
+                        "sdp": answer_sdp
+                    })
+                except Exception as e:
+                    logger.error(f"Relay negotiation failed for client {client_id}: {e}", exc_info=True)
+                    await manager.send_signal(client_id, {
+                        "type": "error",
+                        "message": "中继媒体连接失败"
+                    })
+
+            elif msg_type == "offer":
+                offer = {
                     "type": "offer",
                     "sender": client_id,
                     "sdp": message.get("sdp")
-                }, exclude_client=client_id)
+                }
+                target_client = message.get("target")
+                if target_client:
+                    # 定向offer只发给目标用户
+                    await manager.send_personal_message(offer, target_client)
+                else:
+                    # 未指定目标的旧客户端：转发offer给房间内其他用户
+                    await manager.broadcast_to_room(room_id, offer, exclude_client=client_id)
+
+            elif msg_type == "answer" and manager.relay_media is not None and message.get("target") == RELAY_PEER_ID:
+                # 中继发起的重新协商的应答
+                manager.relay_media.handle_answer(room_id, client_id, message.get("sdp"))
 
             elif msg_type == "answer":
                 # 转发answer给指定用户
                 target_client = message.get("target")
-                if target_client in manager.active_connections:
-                    await manager.send_personal_message(json.dumps({
+                if target_client:
+                    await manager.send_personal_message({
                         "type": "answer",
                         "sender": client_id,
                         "sdp": message.get("sdp")
-                    }), target_client)
+                    }, target_client)
+
+            elif msg_type == "ice_candidate" and manager.bot_media is not None and message.get("target") == BOT_PEER_ID:
+                await manager.bot_media.add_ice_candidate(room_id, client_id, message.get("candidate"))
+
+            elif msg_type == "ice_candidate" and manager.relay_media is not None and message.get("target") == RELAY_PEER_ID:
+                await manager.relay_media.add_ice_candidate(room_id, client_id, message.get("candidate"))
 
             elif msg_type == "ice_candidate":
-                # 转发ICE候选给房间内其他用户
-                await manager.broadcast_to_room(room_id, {
+                candidate = {
                     "type": "ice_candidate",
                     "sender": client_id,
                     "candidate": message.get("candidate")
-                }, exclude_client=client_id)
+                }
+                target_client = message.get("target")
+                if target_client:
+                    # 候选只对目标用户的连接有用
+                    await manager.send_personal_message(candidate, target_client)
+                else:
+                    # 转发ICE候选给房间内其他用户
+                    await manager.broadcast_to_room(room_id, candidate, exclude_client=client_id)
+
+            elif msg_type == "pong":
+                # 心跳应答，last_seen已经更新
+                pass
 
             elif msg_type == "get_users":
-                # 返回房间内所有用户
+                # 带since_version时只返回该版本之后的成员变化
                 if room_id in manager.rooms:
-                    await manager.send_personal_message(json.dumps({
-                        "type": "users_list",
-                        "users": list(manager.rooms[room_id])
-                    }), client_id)
+                    since_version = message.get("since_version")
+                    if not isinstance(since_version, int) or isinstance(since_version, bool):
+                        since_version = None
+                    await manager.send_presence(room_id, client_id, since_version)
 
             elif msg_type == "asr_text":
-                # 处理ASR文本消息
-                asr_text = message.get("text", "")
-                logger.info(f"ASR text received from client {client_id}: '{asr_text}'")
-                logger.info(f"ASR text length: {len(asr_text) if asr_text else 0}")
-
-                if asr_text and asr_text.strip():
-                    # 转发ASR文本到聊天机器人
-                    chatbot_message = {
-                        "type": "asr_text",
-                        "text": asr_text,
-                        "client_id": client_id,
-                        "session_id": room_id
-                    }
-
-                    response = await manager.send_to_asr_chatbot(room_id, chatbot_message)
-
-                    if response:
-                        logger.info(f"Received response from chatbot: {response}")
-                        # 将聊天机器人响应广播到房间
-                        await manager.broadcast_to_room(room_id, {
-                            "type": "bot_response",
-                            "text": response.get("text", ""),
-                            "client_id": client_id,
-                            "session_id": room_id
-                        })
-                    else:
-                        logger.error("Failed to get response from chatbot")
-                        await manager.send_personal_message(json.dumps({
-                            "type": "error",
-                            "message": "无法从聊天机器人获取响应"
-                        }), client_id)
-                else:
-                    logger.warning("Received empty ASR text")
-                    await manager.send_personal_message(json.dumps({
-                        "type": "error",
-                        "message": "收到空的ASR文本"
-                    }), client_id)
+                # 聊天机器人回复可能需要很久，放到单独的任务里处理，接收循环继续读取pong和其他信令，
+                # 否则等待期间心跳会把该客户端当作半开连接清理掉
+                manager.spawn(handle_asr_text(client_id, room_id, message))
 
     except Exception as e:
         logger.error(f"WebSocket error for client {client_id}: {e}")
     finally:
-        manager.disconnect(client_id)
+        if close_code in LEAVE_CLOSE_CODES and not record.suspended:
+            manager.disconnect(client_id, websocket)
+        else:
+            manager.suspend(client_id, websocket)
+
+@app.websocket("/ws/audio/{client_id}/{room_id}")
+async def audio_endpoint(websocket: WebSocket, client_id: str, room_id: str, sample_rate: int = 16000):
+    """Binary route: framed PCM16 chunks into the client's ring buffer"""
+    await websocket.accept()
+    if sample_rate not in SUPPORTED_SAMPLE_RATES:
+        logger.warning(f"Rejected audio stream from client {client_id} with unsupported sample rate {sample_rate}")
+        # 1003: Unsupported Data
+        await websocket.close(code=1003)
+        return
+    buffer = None
+    try:
+        buffer = await audio_ingest.open(client_id, sample_rate)
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            chunk = message.get("bytes")
+            if chunk is not None and not buffer.write_frame(chunk):
+                logger.warning(f"Malformed audio frame from client {client_id} in room {room_id}")
+    except Exception as e:
+        logger.error(f"Audio WebSocket error for client {client_id}: {e}")
+    finally:
+        if buffer is not None:
+            audio_ingest.close(client_id, buffer)
 
 if __name__ == "__main__":
+    # 配置日志：后台线程写文件，按大小轮转
+    setup_logging(LOG_FILE)
     uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file